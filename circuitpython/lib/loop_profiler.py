@@ -0,0 +1,98 @@
+# loop_profiler.py -- lightweight per-loop timing for asyncio tasks
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Use like:
+#   prof = LoopProfiler("touch_updater")
+#   while True:
+#       prof.start()
+#       ...do the work...
+#       prof.stop()
+#       await asyncio.sleep(0)
+# and call print_summary() when you want to see how all the loops are doing.
+#
+import time
+from array import array
+
+# histogram bucket upper bounds, in microseconds (last bucket is everything slower)
+hist_bounds_us = (500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+profilers = []  # every LoopProfiler made, for print_summary()
+
+class LoopProfiler:
+    """
+    Records how long each iteration of a loop takes (start() to stop()) in a
+    ring buffer of the last 'size' iterations, plus worst case, a histogram,
+    and the gap between iteration starts (how long the loop went unserviced).
+    Only integer math in start() & stop(), nothing printed until asked.
+    """
+    def __init__(self, name, size=64, enabled=True):
+        self.name = name
+        self.size = size
+        self.enabled = enabled
+        self.times_us = array('L', [0] * size)  # ring buffer of recent iteration times
+        self.hist = array('L', [0] * (len(hist_bounds_us) + 1))
+        self.reset()
+        profilers.append(self)
+
+    def reset(self):
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.min_gap_us = 0
+        self.max_gap_us = 0
+        self.last_start_ns = 0
+        self.start_ns = 0
+        self.pos = 0
+        for i in range(len(self.hist)):
+            self.hist[i] = 0
+
+    def start(self):
+        if self.enabled:
+            self.start_ns = time.monotonic_ns()
+
+    def stop(self):
+        if not self.enabled or not self.start_ns:
+            return
+        dt_us = (time.monotonic_ns() - self.start_ns) // 1000
+        self.count += 1
+        self.total_us += dt_us
+        if dt_us > self.max_us:
+            self.max_us = dt_us
+        self.times_us[self.pos] = dt_us
+        self.pos = (self.pos + 1) % self.size
+        b = 0
+        while b < len(hist_bounds_us) and dt_us >= hist_bounds_us[b]:
+            b += 1
+        self.hist[b] += 1
+        if self.last_start_ns:
+            gap_us = (self.start_ns - self.last_start_ns) // 1000
+            if gap_us > self.max_gap_us:
+                self.max_gap_us = gap_us
+            if gap_us < self.min_gap_us or not self.min_gap_us:
+                self.min_gap_us = gap_us
+        self.last_start_ns = self.start_ns
+
+    def recent_avg_us(self):
+        """Average of the iterations still in the ring buffer"""
+        n = min(self.count, self.size)
+        return sum(self.times_us[i] for i in range(n)) // n if n else 0
+
+    def jitter_us(self):
+        """Spread between shortest and longest gap between iteration starts"""
+        return self.max_gap_us - self.min_gap_us
+
+    def summary(self):
+        avg_us = self.total_us // self.count if self.count else 0
+        s = "%-18s n:%6d avg:%6.2f recent:%6.2f max:%6.2f maxgap:%6.2f jitter:%6.2f ms" % (
+            self.name, self.count, avg_us/1000, self.recent_avg_us()/1000, self.max_us/1000,
+            self.max_gap_us/1000, self.jitter_us()/1000)
+        hist = " ".join("<%g:%d" % (hist_bounds_us[i]/1000, self.hist[i]) for i in range(len(hist_bounds_us)))
+        return s + "\n" + " " * 19 + "hist ms " + hist + " >:%d" % self.hist[-1]
+
+def print_summary():
+    for p in profilers:
+        print(p.summary())
+
+def reset_all():
+    for p in profilers:
+        p.reset()
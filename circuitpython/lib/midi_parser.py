@@ -0,0 +1,97 @@
+# midi_parser.py -- allocation-free MIDI input parser with table dispatch
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Use like:
+#   midi_in = MidiParser(usb_midi.ports[0])
+#   midi_in.on(NOTE_ON, lambda channel, note, vel: print("note on", note, vel))
+#   while True:
+#       midi_in.poll()
+#
+from micropython import const
+
+NOTE_OFF = const(0x80)
+NOTE_ON = const(0x90)
+POLY_PRESSURE = const(0xA0)
+CONTROL_CHANGE = const(0xB0)
+PROGRAM_CHANGE = const(0xC0)
+CHANNEL_PRESSURE = const(0xD0)
+PITCH_BEND = const(0xE0)
+
+CLOCK = const(0xF8)
+START = const(0xFA)
+CONTINUE = const(0xFB)
+STOP = const(0xFC)
+
+# number of data bytes for each channel message type, 0x80 - 0xE0
+_data_lens = (2, 2, 2, 2, 1, 1, 2)
+
+class MidiParser:
+    """
+    Parses the MIDI byte stream from a port (usb_midi.PortIn or busio.UART)
+    and calls a handler for each message, looked up by message type.
+    Bytes are read in bulk into a preallocated buffer and no message objects
+    are made, so parsing doesn't allocate. Handles running status,
+    skips SysEx, and note on w/ velocity 0 is sent to the note off handler.
+
+    Channel message handlers are called as handler(channel, data1, data2),
+    with data2=0 for one-data-byte messages (program change, channel pressure).
+    For pitch bend, data1 is the LSB and data2 the MSB.
+    Realtime messages (clock, start, stop...) go to realtime_handler(status).
+    """
+    def __init__(self, port, buf_size=64, channel=None):
+        self.port = port
+        self.buf = bytearray(buf_size)
+        self.channel = channel  # None = all channels
+        self.handlers = [None] * 7  # 0x80 - 0xE0
+        self.realtime_handler = None
+        self.status = 0  # running status, 0 = none
+        self.data1 = -1  # first data byte of message, -1 = not received yet
+        self.msg_count = 0
+
+    def on(self, msg_type, handler):
+        """Set handler for a message type (e.g. NOTE_ON), None to ignore them"""
+        self.handlers[(msg_type >> 4) - 8] = handler
+
+    def poll(self):
+        """Read what's waiting on the port (up to buf_size bytes) and dispatch it.
+        Returns number of bytes read."""
+        n = self.port.readinto(self.buf)
+        if not n:
+            return 0
+        self.feed(self.buf, n)
+        return n
+
+    def feed(self, data, n):
+        """Parse and dispatch the first 'n' bytes of 'data'"""
+        handlers = self.handlers
+        for i in range(n):
+            b = data[i]
+            if b >= 0xF8:  # realtime, can appear anywhere, doesn't affect running status
+                if self.realtime_handler:
+                    self.realtime_handler(b)
+                continue
+            if b >= 0x80:  # status byte
+                self.status = b if b < 0xF0 else 0  # SysEx & system common cancel running status
+                self.data1 = -1
+                continue
+            status = self.status
+            if not status:  # data w/o status, or inside SysEx
+                continue
+            kind = (status >> 4) - 8
+            if _data_lens[kind] == 2:
+                if self.data1 < 0:
+                    self.data1 = b
+                    continue
+                data1, data2 = self.data1, b
+            else:
+                data1, data2 = b, 0
+            self.data1 = -1  # keep status for running status
+            channel = status & 0x0F
+            if self.channel is not None and channel != self.channel:
+                continue
+            if kind == 1 and data2 == 0:  # note on w/ vel 0 is note off
+                kind = 0
+            self.msg_count += 1
+            handler = handlers[kind]
+            if handler:
+                handler(channel, data1, data2)
@@ -0,0 +1,117 @@
+# midi_writer.py -- queued, non-blocking MIDI output, with running status on UARTs
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Use like:
+#   midi_out = MidiWriter(hw.uart, baud_rate=31250)
+#   midi_out.note_on(60, 100)
+#   midi_out.note_on(64, 100)
+#   midi_out.flush()   # once per loop
+#
+import time
+
+class MidiWriter:
+    """
+    Queues MIDI messages for a port (usb_midi.PortOut or busio.UART) in a
+    preallocated buffer and writes them out together in flush().
+    If 'baud_rate' is set (for a UART), messages are encoded with running status,
+    and flush() only writes what fits in the UART's TX FIFO given what's still
+    being sent, so it never waits on the wire; the rest goes out on later flush()es.
+    (USB MIDI packs each whole message into a packet, so it always gets status bytes.)
+    Messages that don't fit in the queue are dropped and counted. The last
+    'note_off_reserve' bytes are kept for note-offs, so a queue filled up with
+    aftertouch or note-ons still takes the note-offs and no note gets stuck on.
+    """
+    def __init__(self, port, buf_size=128, baud_rate=None, fifo_size=32, running_status_timeout=0.3,
+                 note_off_reserve=24):
+        self.port = port
+        self.buf = bytearray(buf_size)
+        self.note_off_reserve = note_off_reserve
+        self.mv = memoryview(self.buf)
+        self.byte_ns = 10 * 1_000_000_000 // baud_rate if baud_rate else 0  # 8N1 = 10 bits/byte
+        self.fifo_size = fifo_size
+        self.running_status_timeout_ns = int(running_status_timeout * 1_000_000_000)
+        self.running_status = bool(baud_rate)
+        self.head = 0  # queue is buf[head:depth], flush() writes from head
+        self.depth = 0
+        self.status = 0  # running status of what's been queued, 0 = none
+        self.last_send_ns = 0
+        self.busy_until_ns = 0  # when the UART will have sent everything written to it
+        self.max_depth = 0
+        self.msg_count = 0
+        self.byte_count = 0
+        self.dropped_count = 0
+
+    def send(self, status, data1, data2=-1):
+        """Queue a channel message, data2=-1 for one-data-byte messages.
+        Returns False if the queue was full and the message was dropped."""
+        now = time.monotonic_ns()
+        if not self.running_status or now - self.last_send_ns > self.running_status_timeout_ns:
+            self.status = 0  # resend status now and then, in case receiver missed it
+        self.last_send_ns = now
+        n = (status != self.status) + 1 + (data2 >= 0)
+        buf = self.buf
+        room = self.room()
+        if status & 0xF0 != 0x80 and not (status & 0xF0 == 0x90 and data2 == 0):
+            room -= self.note_off_reserve  # only note-offs get the last bytes
+        if n > room:
+            self.dropped_count += 1
+            return False
+        if self.depth + n > len(buf):
+            for j in range(self.depth - self.head):  # move unsent bytes to the front
+                buf[j] = buf[self.head + j]
+            self.depth -= self.head
+            self.head = 0
+        i = self.depth
+        if status != self.status:
+            buf[i] = status
+            i += 1
+            self.status = status
+        buf[i] = data1
+        if data2 >= 0:
+            buf[i+1] = data2
+        self.depth += n
+        self.msg_count += 1
+        if self.depth - self.head > self.max_depth:
+            self.max_depth = self.depth - self.head
+        return True
+
+    def room(self):
+        """Bytes free in the queue"""
+        return len(self.buf) - (self.depth - self.head)
+
+    def note_on(self, note, vel=100, channel=0):
+        return self.send(0x90 | channel, note, vel)
+
+    def note_off(self, note, vel=0, channel=0):
+        return self.send(0x80 | channel, note, vel)
+
+    def poly_pressure(self, note, pressure, channel=0):
+        return self.send(0xA0 | channel, note, pressure)
+
+    def control_change(self, control, value, channel=0):
+        return self.send(0xB0 | channel, control, value)
+
+    def flush(self):
+        """Write as much of the queue to the port as can go without blocking.
+        Returns number of bytes written."""
+        n = self.depth - self.head
+        if not n:
+            return 0
+        if self.byte_ns:  # UART: only what the TX FIFO has room for
+            now = time.monotonic_ns()
+            in_fifo = max(0, self.busy_until_ns - now) // self.byte_ns
+            n = min(n, self.fifo_size - in_fifo)
+            if n <= 0:
+                return 0
+        written = self.port.write(self.mv[self.head:self.head + n]) or 0
+        self.head += written
+        if self.head == self.depth:  # all sent, start over at the front
+            self.head = self.depth = 0
+        self.byte_count += written
+        if self.byte_ns:
+            self.busy_until_ns = max(self.busy_until_ns, now) + written * self.byte_ns
+        return written
+
+    def stats(self):
+        """Returns (queue depth, max queue depth, messages, dropped messages)"""
+        return self.depth - self.head, self.max_depth, self.msg_count, self.dropped_count
@@ -2,16 +2,16 @@
 # 1 Sep 2023 - @todbot / Tod Kurt
 # Part of https://github.com/todbot/picotouch_synth
 #
-import time
 import board, busio, digitalio
 import audiomixer, synthio, audiopwmio
 import neopixel
 import touchio
 #import touchpio
 import keypad  # so we can use keypad.Event for check_touch()
+import ulab.numpy as np
 import adafruit_fancyled.adafruit_fancyled as fancy
 
-from synthio_instrument import map_range, lerp
+from loop_profiler import LoopProfiler
 
 # pin definitions
 
@@ -33,18 +33,98 @@ top_pads = (1,3,  6,8,10,  13,15)     # "black" keys
 bot_pads = (0,2,4,5,7,9,11,12,14,16)  # "white" keys
 mode_pads = (17,18,19, 20,21)         # A, B, C, X, Y keys
 
-debug_timing = False
 
-if debug_timing:
-    # for checking how long check_touch() takes
-    key_times = [0] * 50
-    key_time_i = 0
-    key_time_max = 1000
-    key_time_min = 0
+class LEDFramebuffer:
+    """
+    Array-backed stand-in for the NeoPixel strip: set pixels, fade them, and
+    call show() like on a NeoPixel, but the strip is only written to when a
+    pixel actually changed. Writing a NeoPixel strip blocks interrupts,
+    so skipping needless writes cuts touch & MIDI jitter.
+    """
+    def __init__(self, strip):
+        self.strip = strip
+        self.n = len(strip)
+        self.buf = np.zeros(self.n * 3, dtype=np.int16)  # r,g,b,r,g,b,...
+        self.dirty = True
+        self.show_count = 0  # how many show()s asked for
+        self.write_count = 0  # how many actually written to strip
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        j = (i % self.n) * 3
+        return (int(self.buf[j]), int(self.buf[j+1]), int(self.buf[j+2]))
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self[i]
+
+    def __setitem__(self, i, color):
+        if isinstance(i, slice):
+            start = i.start or 0
+            stop = self.n if i.stop is None else i.stop
+            for k, c in zip(range(start, stop, i.step or 1), color):
+                self[k] = c
+            return
+        if isinstance(color, int):
+            r, g, b = (color >> 16) & 0xff, (color >> 8) & 0xff, color & 0xff
+        else:
+            r, g, b = color
+        buf = self.buf
+        j = (i % self.n) * 3
+        if buf[j] != r or buf[j+1] != g or buf[j+2] != b:
+            buf[j], buf[j+1], buf[j+2] = r, g, b
+            self.dirty = True
+
+    def fill(self, color):
+        for i in range(self.n):
+            self[i] = color
+
+    def fade(self, fade_by=5):
+        """Dim all pixels by 'fade_by', all at once"""
+        if np.max(self.buf) == 0:
+            return
+        self.buf -= fade_by
+        self.buf[self.buf < 0] = 0
+        self.dirty = True
+
+    def show(self):
+        """Write pixels to the strip, if any changed. Returns True if written"""
+        self.show_count += 1
+        if not self.dirty:
+            return False
+        buf, strip = self.buf, self.strip
+        for i in range(self.n):
+            j = i * 3
+            strip[i] = (buf[j], buf[j+1], buf[j+2])
+        strip.show()
+        self.dirty = False
+        self.write_count += 1
+        return True
+
+
+class HueLUT:
+    """
+    Packed RGB colors of a single hue at 'steps' brightnesses,
+    made once so LED updates don't do HSV math every frame
+    """
+    def __init__(self, hue, sat=0.98, steps=256):
+        self.steps = steps
+        self.colors = [fancy.CHSV(hue, sat, i / (steps-1)).pack() for i in range(steps)]
+
+    def color(self, val):
+        """Packed color at brightness 'val' 0-1 (clamped)"""
+        return self.colors[int(min(max(val, 0), 1) * (self.steps-1) + 0.5)]
+
 
 class PicoTouchSynthHardware():
-    def __init__(self, sample_rate=28000, num_voices=1, buffer_size=2048, touch_threshold_adjust=400):
-        self.leds= neopixel.NeoPixel(neopixel_pin, num_leds, brightness=0.2, auto_write=False)
+    def __init__(self, sample_rate=28000, num_voices=1, buffer_size=2048, touch_threshold_adjust=400,
+                 mode_scan_every=4, touch_pressure_range=1000, touch_velocity_range=1000,
+                 touch_velocity_min=40):
+        self.strip = neopixel.NeoPixel(neopixel_pin, num_leds, brightness=0.2, auto_write=False)
+        self.leds = LEDFramebuffer(self.strip)
+        self.hue_luts = {}  # key = hue, val = HueLUT
         self.uart = busio.UART(rx=uart_rx_pin, tx=uart_tx_pin, baudrate=31250, timeout=0.001)
 
         # make power supply less noisy on real Picos
@@ -60,7 +140,29 @@ class PicoTouchSynthHardware():
             touchin.threshold += touch_threshold_adjust
             self.touch_ins.append(touchin)
         self.num_touch_pads = len(self.touch_ins)
-        self.last_touch_vals = [t.value for t in self.touch_ins]  # get initial value
+
+        # pads are read once per scan with raw_value, compared against a threshold
+        # that follows each pad's untouched baseline as it drifts (but not a finger
+        # coming near), how fast raw_value rose gives a press its velocity, and
+        # how far past threshold a pad is gives its pressure
+        self.touch_baselines = [t.raw_value for t in self.touch_ins]
+        self.touch_threshold_offsets = [t.threshold - b for t,b in zip(self.touch_ins, self.touch_baselines)]
+        self.touch_baseline_bands = [max(o // 4, 16) for o in self.touch_threshold_offsets]  # drift, not fingers
+        self.touch_thresholds = [t.threshold for t in self.touch_ins]
+        self.touch_prev_raws = [list(self.touch_baselines), list(self.touch_baselines)]  # last 2 scans' raw_values
+        self.touch_pressure_range = touch_pressure_range  # raw counts past threshold for full pressure
+        self.touch_velocity_range = touch_velocity_range  # raw counts risen over 2 scans for full velocity
+        self.touch_velocity_min = touch_velocity_min
+        self.touch_velocities = [0] * self.num_touch_pads  # 0-127 velocity when last pressed
+        self.touch_pressures = [0] * self.num_touch_pads   # 0-127 pressure now, 0 if not pressed
+        self.last_touch_vals = [t.raw_value > t.threshold for t in self.touch_ins]  # get initial value
+
+        # touch scan tiers: note pads are read every check_touch(), mode pads
+        # every 'mode_scan_every' check_touch() (or every time if held, to catch release)
+        self.note_pads = tuple(sorted(bot_pads + top_pads))
+        self.mode_scan_every = mode_scan_every
+        self.scan_count = 0
+        self.scan_profiler = LoopProfiler("check_touch")  # see scan_stats()
 
         self.synth_voicenum = num_voices-1
         self.audio = audiopwmio.PWMAudioOut(pwm_audio_pin)
@@ -76,8 +178,7 @@ class PicoTouchSynthHardware():
         self.mixer.voice[self.synth_voicenum].level = v
 
     def fade_leds(self,fade_by=5):
-        # FIXME: use np
-        self.leds[:] = [[max(i-fade_by,0) for i in l] for l in self.leds]
+        self.leds.fade(fade_by)
 
     def is_bottom_pad(self,i):
         return i in bot_pads
@@ -103,66 +204,108 @@ class PicoTouchSynthHardware():
     def is_mode_pad(self,i):
         return i in mode_pads
 
+    def hue_lut(self, hue):
+        lut = self.hue_luts.get(hue)
+        if not lut:
+            lut = self.hue_luts[hue] = HueLUT(hue)
+        return lut
+
     def leds_control_left(self, v, hue=0.05):
-        color1 = fancy.CHSV( hue, 0.98, 0.25 * 1-v)
-        color2 = fancy.CHSV( hue, 0.98, 0.25 * v)
-        self.leds[1] = color1.pack()
-        self.leds[3] = color2.pack()
+        lut = self.hue_lut(hue)
+        self.leds[1] = lut.color( 0.25 * 1-v)
+        self.leds[3] = lut.color( 0.25 * v)
 
     def leds_control_mid(self,v, hue=0.30):
-        color1 = fancy.CHSV( hue, 0.98, 0.25 * 1-v)
-        color2 = fancy.CHSV( hue, 0.98, 0.25 * 0.5)
-        color3 = fancy.CHSV( hue, 0.98, 0.25 * v)
-        self.leds[6] = color1.pack()
-        self.leds[8] = color2.pack()
-        self.leds[10] = color3.pack()
+        lut = self.hue_lut(hue)
+        self.leds[6] = lut.color( 0.25 * 1-v)
+        self.leds[8] = lut.color( 0.25 * 0.5)
+        self.leds[10] = lut.color( 0.25 * v)
 
     def leds_control_right(self,v, hue=0.98):
-        color1 = fancy.CHSV( 0.6, 0.98, 0.25 * 1-v)
-        color2 = fancy.CHSV( 0.6, 0.98, 0.25 * v)
-        self.leds[13] = color1.pack()
-        self.leds[15] = color2.pack()
+        lut = self.hue_lut(0.6)
+        self.leds[13] = lut.color( 0.25 * 1-v)
+        self.leds[15] = lut.color( 0.25 * v)
 
 
     # using Debouncer instead of Button: 15 millis vs 24 millis (no keys pressed)
     # using DIY debouncer instead of Debouncer: 9 millis vs 15 millis (no keys pressed)
     # using PIO on 7 pads: 8 millis vs 9 millis
     # pressing keys adds about 0.4 msec per key in touchio (thus 30 msecs max if all keys pressed)
+    # only scanning mode pads every 4th time: about 7 millis vs 9 millis
     def check_touch(self):
         """
-        Check all capsense pads and generate KeyEvents if pressed or released.
-        Must be called frequently.  Takes about 9 millisecs with no keys pressed,
-        for reading 22 touch pads, giving us a natural debounce timer.
+        Check capsense pads and generate KeyEvents if pressed or released.
+        A pressed pad's velocity is in touch_velocities[pad_num] and
+        its ongoing pressure in touch_pressures[pad_num], both 0-127.
+        Must be called frequently.  Takes about 7 millisecs with no keys pressed,
+        for reading the 17 note pads (and the 5 mode pads every 'mode_scan_every' calls),
+        giving us a natural debounce timer.
         :return list of press or release Events since last check_touch()
         """
-        if debug_timing:
-            st = time.monotonic()  # timing
+        self.scan_profiler.start()
 
         events = []
-        for i in range(self.num_touch_pads):
-            touch_val = self.touch_ins[i].value
-            last_touch_val = self.last_touch_vals[i]
-            if touch_val and not last_touch_val:  # pressed
+        for i in self.note_pads:
+            self._scan_pad(i, events)
+        scan_modes = self.scan_count % self.mode_scan_every == 0
+        for i in mode_pads:
+            if scan_modes or self.last_touch_vals[i]:  # held mode pads every time
+                self._scan_pad(i, events)
+        self.scan_count += 1
+
+        self.scan_profiler.stop()
+        return events
+
+    def _scan_pad(self, i, events):
+        raw_val = self.touch_ins[i].raw_value  # one read, same cost as .value
+        threshold = self.touch_thresholds[i]
+        touch_val = raw_val > threshold
+        last_touch_val = self.last_touch_vals[i]
+        prev1, prev2 = self.touch_prev_raws
+        if touch_val:
+            pressure = min((raw_val - threshold) * 127 // self.touch_pressure_range, 127)
+            self.touch_pressures[i] = pressure
+            if not last_touch_val:  # pressed, a fast press rose further in the last 2 scans
+                rise = min(max(raw_val - prev2[i], 0) * 127 // self.touch_velocity_range, 127)
+                vel_min = self.touch_velocity_min
+                self.touch_velocities[i] = vel_min + rise * (127 - vel_min) // 127
                 events.append(keypad.Event(i,True))
-            if not touch_val and last_touch_val:  # released
+        else:
+            self.touch_pressures[i] = 0
+            if last_touch_val:  # released
                 events.append(keypad.Event(i,False))
-            self.last_touch_vals[i] = touch_val  # save state for next time
-
-        if debug_timing:
-            global key_time_max, key_time_min, key_time_i
-            dt = int((time.monotonic()-st)*1000)  # timing
-            key_times[ key_time_i ] = dt
-            key_time_i = (key_time_i+1) % 50
-            key_time_max = min(key_time_max, dt)
-            key_time_min = max(key_time_min, dt)
-            key_time_avg = sum(key_times) / 50
-            print("check_touch: %2d %2d %2d %.1f" % (dt, key_time_max, key_time_min, key_time_avg) )
+            # slowly follow untouched baseline, and the threshold with it,
+            # but not a finger coming near (raw_val rising well above baseline)
+            baseline = self.touch_baselines[i]
+            diff = raw_val - baseline
+            band = self.touch_baseline_bands[i]
+            if -band < diff < band:
+                step = (diff + 8) >> 4 if diff >= 0 else -((8 - diff) >> 4)  # rounds the same both ways
+                if step:
+                    baseline += step
+                    self.touch_baselines[i] = baseline
+                    self.touch_thresholds[i] = baseline + self.touch_threshold_offsets[i]
+        prev2[i] = prev1[i]
+        prev1[i] = raw_val
+        self.last_touch_vals[i] = touch_val  # save state for next time
 
-        return events
+    def reset_scan_stats(self):
+        self.scan_profiler.reset()
+
+    def scan_stats(self):
+        """
+        Timing of check_touch() since last reset_scan_stats(), in millisecs:
+        (num scans, worst-case scan time, average scan time, jitter between scan starts)
+        """
+        p = self.scan_profiler
+        avg_us = p.total_us / p.count if p.count else 0
+        return (p.count, p.max_us / 1000, avg_us / 1000, p.jitter_us() / 1000)
 
     def check_touch_hold(self, hold_func):
-        """Call callback for any key currently being held"""
+        """
+        Call callback hold_func(pad_num, pressure) for any key currently being held,
+        with its 0-127 pressure from the last check_touch()
+        """
         for i in range(self.num_touch_pads):
-            if self.touch_ins[i].value:  # is pressed
-                hold_pressure = self.touchins[i].raw_value - self.touchins[i].threshold
-                hold_func(i, hold_pressure)
+            if self.last_touch_vals[i]:  # is pressed
+                hold_func(i, self.touch_pressures[i])
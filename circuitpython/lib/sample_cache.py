@@ -0,0 +1,168 @@
+# sample_cache.py -- WAV samples decoded into RAM, with an LRU memory budget
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Use like:
+#   samples = SampleCache(max_bytes=80*1024)
+#   samples.preload(["drum_wavs/kitA/00_kick.wav", "drum_wavs/kitA/01_snare.wav"])
+#   sample = samples.get("drum_wavs/kitA/00_kick.wav")  # None if it doesn't fit in RAM
+#   if sample is None:
+#       sample = audiocore.WaveFile(open("drum_wavs/kitA/00_kick.wav", "rb"))
+#
+import struct
+import audiocore
+import ulab.numpy as np
+
+def read_wav_info(f):
+    """Parse a WAV file's header, returns (channels, sample_rate, bits, data_offset, data_size)"""
+    riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+    if riff != b"RIFF" or wave != b"WAVE":
+        raise ValueError("not a WAV file")
+    fmt = None
+    while True:
+        hdr = f.read(8)
+        if len(hdr) < 8:
+            raise ValueError("no WAV data")
+        chunk_id, chunk_size = struct.unpack("<4sI", hdr)
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", f.read(16))
+            f.seek(chunk_size - 16 + (chunk_size & 1), 1)
+        elif chunk_id == b"data":
+            if fmt is None or fmt[0] != 1:  # 1 = PCM
+                raise ValueError("unsupported WAV format")
+            return fmt[1], fmt[2], fmt[5], f.tell(), chunk_size
+        else:
+            f.seek(chunk_size + (chunk_size & 1), 1)  # chunks are word-aligned
+
+
+class SampleCache:
+    """
+    Least-recently-used cache of 16-bit WAV files decoded into RAM as
+    audiocore.RawSamples, holding at most 'max_bytes' of sample data.
+    To make room, samples not used in the last 'recent_uses' get()s are evicted,
+    oldest first. Samples that don't fit (too big, everything in RAM is in
+    recent use, wrong format, or out of memory) return None from get(),
+    so the caller can stream them from flash instead.
+    """
+    def __init__(self, max_bytes=80*1024, recent_uses=16):
+        self.max_bytes = max_bytes
+        self.recent_uses = recent_uses
+        self.samples = {}  # key = filename, val = [last_used_tick, RawSample, nbytes]
+        self.sizes = {}  # key = filename, val = nbytes of sample data, or 0 if it can't be loaded
+        self.used_bytes = 0
+        self.loading = {}  # key = filename being loaded by load_steps(), val = nbytes it reserved
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, fname):
+        """Get the RawSample for WAV file 'fname', loading it if need be (evicting
+        least recently used samples), or None if it can't be held in RAM"""
+        self.tick += 1
+        entry = self.samples.get(fname)
+        if entry:
+            self.hits += 1
+            entry[0] = self.tick
+            return entry[1]
+        self.misses += 1
+        if fname in self.loading:
+            return None  # still being loaded, stream it this time
+        nbytes = self.sizes.get(fname)
+        if nbytes is not None and not self.make_room(nbytes):
+            return None  # don't bother opening it
+        return self.load(fname, evict=True)
+
+    def make_room(self, nbytes, evict=True):
+        """Evict samples not recently used until 'nbytes' fits in the budget.
+        Returns False (evicting nothing) if it can't be done."""
+        if not nbytes:
+            return False
+        need = self.used_bytes + nbytes - self.max_bytes
+        if need <= 0:
+            return True
+        if not evict:
+            return False
+        stale = self.tick - self.recent_uses
+        if sum(e[2] for e in self.samples.values() if e[0] <= stale) < need:
+            return False
+        while self.used_bytes + nbytes > self.max_bytes:
+            oldest = min(self.samples, key=lambda k: self.samples[k][0])
+            self.used_bytes -= self.samples.pop(oldest)[2]
+            self.evictions += 1
+        return True
+
+    def load(self, fname, evict=False):
+        """Decode 'fname' into RAM, if it fits in what's left of the budget
+        (or after evicting samples not recently used, if 'evict')"""
+        for _ in self.load_steps(fname, evict):
+            pass
+        entry = self.samples.get(fname)
+        return entry[1] if entry else None
+
+    def load_steps(self, fname, evict=False, chunk_bytes=0):
+        """Generator version of load() that yields after reading each 'chunk_bytes'
+        of sample data, so a load can be spread out (0 = read it all at once).
+        Does nothing if 'fname' is already being loaded."""
+        if fname in self.loading:
+            return
+        sample = None
+        self.loading[fname] = 0
+        try:
+            with open(fname, "rb") as f:
+                channels, rate, bits, offset, nbytes = read_wav_info(f)
+                if bits != 16 or nbytes > self.max_bytes:
+                    nbytes = 0  # never fits
+                self.sizes[fname] = nbytes
+                if not self.make_room(nbytes, evict):
+                    return
+                self.used_bytes += nbytes  # reserve it while loading
+                self.loading[fname] = nbytes
+                buf = np.zeros(nbytes // 2, dtype=np.int16)
+                f.seek(offset)
+                if chunk_bytes:
+                    mv = memoryview(buf)
+                    step = chunk_bytes // 2
+                    for i in range(0, len(buf), step):
+                        f.readinto(mv[i:i+step])
+                        yield
+                else:
+                    f.readinto(buf)
+            sample = audiocore.RawSample(buf, channel_count=channels, sample_rate=rate)
+            self.samples[fname] = [self.tick, sample, nbytes]
+        except (OSError, ValueError, MemoryError) as e:
+            print("SampleCache:", fname, e)
+            self.sizes[fname] = 0
+        finally:
+            reserved = self.loading.pop(fname)
+            if sample is None:  # failed or was cancelled
+                self.used_bytes -= reserved
+
+    def drop_others(self, fnames):
+        """Drop all samples not in 'fnames'"""
+        for fname in list(self.samples):
+            if fname not in fnames:
+                self.used_bytes -= self.samples.pop(fname)[2]
+
+    def preload(self, fnames):
+        """Make room for and load 'fnames' (e.g. a new kit), in order, until the
+        budget is full. Samples not in 'fnames' are dropped first."""
+        for _ in self.preload_steps(fnames):
+            pass
+
+    def preload_steps(self, fnames, chunk_bytes=0):
+        """Generator version of preload(), yields after each file and each
+        'chunk_bytes' read, so it can run a bit at a time in an asyncio task"""
+        self.drop_others(fnames)
+        for fname in fnames:
+            if fname and fname not in self.samples and fname not in self.loading and self.sizes.get(fname) != 0:
+                self.tick += 1
+                yield from self.load_steps(fname, chunk_bytes=chunk_bytes)
+                yield
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def stats(self):
+        """Returns (samples in RAM, bytes used, hit rate, evictions)"""
+        return len(self.samples), self.used_bytes, self.hit_rate(), self.evictions
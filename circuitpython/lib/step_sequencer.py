@@ -0,0 +1,227 @@
+# step_sequencer.py -- pattern step sequencer on a monotonic tick clock, w/ MIDI clock sync
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Use like:
+#   seq = StepSequencer(trigger_func=lambda track, vel: print("hit", track, vel))
+#   seq.pattern.set(0, 0, 127)   # track 0 (kick) on step 0
+#   seq.start()
+#   while True:
+#       seq.update()
+#       await asyncio.sleep(seq.time_to_next())
+#
+import time
+from array import array
+from loop_profiler import hist_bounds_us
+
+MIDI_CLOCKS_PER_BEAT = 24
+
+class Pattern:
+    """
+    A pattern of 'num_steps' steps (16 or 32) for each of 'num_tracks' tracks,
+    stored as one velocity byte per step (0 = no hit), so a 10-track 32-step
+    pattern is 320 bytes.
+    """
+    def __init__(self, num_tracks=10, num_steps=16):
+        self.num_tracks = num_tracks
+        self.num_steps = num_steps
+        self.steps = bytearray(num_tracks * num_steps)
+
+    def get(self, track, step):
+        return self.steps[track * self.num_steps + step]
+
+    def set(self, track, step, vel=100):
+        self.steps[track * self.num_steps + step] = vel
+
+    def toggle(self, track, step, vel=100):
+        i = track * self.num_steps + step
+        self.steps[i] = 0 if self.steps[i] else vel
+
+    def clear(self, track=None):
+        """Clear one track, or all of them"""
+        if track is None:
+            self.steps[:] = bytes(len(self.steps))
+        else:
+            i = track * self.num_steps
+            self.steps[i:i+self.num_steps] = bytes(self.num_steps)
+
+
+class StepSequencer:
+    """
+    Plays Patterns by calling trigger_func(track, velocity) for each hit.
+    Step times are computed from the start time and step number on
+    time.monotonic_ns(), so late wakeups never accumulate into drift.
+    Odd steps are delayed by 'swing' (0-0.5) of a step.
+    When MIDI clock is arriving (feed realtime bytes to midi_realtime()),
+    the step grid is re-anchored to the clock every step and the tempo
+    follows the clock rate.
+    How late each step fires compared to its ideal time is recorded,
+    see jitter_report().
+    """
+    def __init__(self, trigger_func, bpm=120, steps_per_beat=4, swing=0, num_tracks=10, num_steps=16):
+        self.trigger_func = trigger_func
+        self.steps_per_beat = steps_per_beat
+        self.swing = swing
+        self.patterns = [Pattern(num_tracks, num_steps)]
+        self.pattern = self.patterns[0]
+        self.playing = False
+        self.step_ns = 0
+        self.set_bpm(bpm)
+        self.start_ns = 0  # time of step 0, moves on tempo changes & clock sync, None = wait for clock
+        self.next_n = 0  # step number (not wrapped to pattern length) due next
+        self.stop_ns = 0  # when stop() was called, so resume() can pick up from there
+        self.skip_tracks = 0  # bitmask of tracks not to fire at next_n, they were just recorded live
+        # MIDI clock sync
+        self.ext_clock = False
+        self.clock_count = 0
+        self.last_clock_ns = 0
+        self.clock_ns = 0  # smoothed time between MIDI clocks
+        self.late_hist = array('L', [0] * (len(hist_bounds_us) + 1))
+        self.reset_jitter()
+
+    @property
+    def step(self):
+        """Pattern step number that plays next"""
+        return self.next_n % self.pattern.num_steps
+
+    def set_bpm(self, bpm):
+        """Change tempo, keeping the next step where it was"""
+        step_ns = 60_000_000_000 // (bpm * self.steps_per_beat)
+        if self.playing and self.start_ns is not None:
+            due = self.start_ns + self.next_n * self.step_ns
+            self.start_ns = due - self.next_n * step_ns
+        self.step_ns = step_ns
+        self.bpm = bpm
+
+    def start(self, now=None):
+        self.next_n = 0
+        self.skip_tracks = 0
+        self.start_ns = now or time.monotonic_ns()
+        self.playing = True
+
+    def stop(self, now=None):
+        if self.playing:
+            self.stop_ns = now or time.monotonic_ns()
+        self.playing = False
+
+    def resume(self, now=None):
+        """Carry on from the step where stop() left off, shifting the step grid
+        by the time spent stopped so nothing plays in a burst to catch up"""
+        if self.playing:
+            return
+        now = now or time.monotonic_ns()
+        if self.start_ns is not None:
+            self.start_ns += now - self.stop_ns
+        self.playing = True
+
+    def select_pattern(self, num):
+        """Switch to pattern 'num', making new empty patterns as needed"""
+        while len(self.patterns) <= num:
+            self.patterns.append(Pattern(self.pattern.num_tracks, self.pattern.num_steps))
+        self.pattern = self.patterns[num]
+
+    def due_ns(self, n):
+        """Ideal time of step number 'n'"""
+        t = self.start_ns + n * self.step_ns
+        if n % 2:
+            t += int(self.swing * self.step_ns)
+        return t
+
+    def time_to_next(self):
+        """Seconds until the next step is due, for asyncio.sleep()"""
+        if not self.playing or self.start_ns is None:
+            return 0.005
+        return max(0, self.due_ns(self.next_n) - time.monotonic_ns()) / 1_000_000_000
+
+    def update(self, now=None):
+        """Fire every step that is due. A step more than half a step late
+        (e.g. the loop was held up) is skipped rather than played late."""
+        if not self.playing or self.start_ns is None:
+            return
+        now = now or time.monotonic_ns()
+        while True:
+            due = self.due_ns(self.next_n)
+            if due > now:
+                break
+            late_ns = now - due
+            if late_ns < self.step_ns // 2:
+                self.fire(self.next_n % self.pattern.num_steps)
+                self.record_late(late_ns // 1000)
+            else:
+                self.missed_count += 1
+            self.next_n += 1
+            self.skip_tracks = 0
+
+    def fire(self, step):
+        pattern = self.pattern
+        steps = pattern.steps
+        for track in range(pattern.num_tracks):
+            vel = steps[track * pattern.num_steps + step]
+            if vel and not self.skip_tracks & (1 << track):
+                self.trigger_func(track, vel)
+
+    def record(self, track, vel, now=None):
+        """Put a live hit on the nearest step of the pattern"""
+        if not self.playing or self.start_ns is None:
+            return
+        now = now or time.monotonic_ns()
+        n = (now - self.start_ns + self.step_ns // 2) // self.step_ns
+        self.pattern.set(track, n % self.pattern.num_steps, vel)
+        if n >= self.next_n:  # it was heard already, don't play it again right away
+            self.skip_tracks |= 1 << track
+
+    def midi_realtime(self, status, now=None):
+        """Handle MIDI realtime bytes: clock, start, continue, stop"""
+        now = now or time.monotonic_ns()
+        if status == 0xF8:  # clock
+            if self.last_clock_ns:
+                dt = now - self.last_clock_ns
+                self.clock_ns = dt if not self.clock_ns else (self.clock_ns * 7 + dt) // 8
+            self.last_clock_ns = now
+            self.ext_clock = True
+            clocks_per_step = MIDI_CLOCKS_PER_BEAT // self.steps_per_beat
+            if self.playing and self.clock_count % clocks_per_step == 0:
+                if self.clock_ns:  # follow the clock's tempo
+                    self.step_ns = self.clock_ns * clocks_per_step
+                    self.bpm = 60_000_000_000 // (self.step_ns * self.steps_per_beat)
+                # re-anchor the grid, this clock is when step 'n' is due
+                n = self.clock_count // clocks_per_step
+                self.start_ns = now - n * self.step_ns
+                if self.next_n < n:  # caught up by clock, e.g. after a stall
+                    self.next_n = n
+            if self.playing:  # masters keep clocking while stopped, that's not song position
+                self.clock_count += 1
+        elif status == 0xFA:  # start
+            self.clock_count = 0
+            self.start(now)
+            self.start_ns = None  # first clock after start is step 0
+        elif status == 0xFB:  # continue
+            self.resume(now)
+        elif status == 0xFC:  # stop
+            self.stop(now)
+
+    def record_late(self, late_us):
+        self.fired_count += 1
+        self.late_total_us += late_us
+        if late_us > self.late_max_us:
+            self.late_max_us = late_us
+        b = 0
+        while b < len(hist_bounds_us) and late_us >= hist_bounds_us[b]:
+            b += 1
+        self.late_hist[b] += 1
+
+    def reset_jitter(self):
+        self.fired_count = 0
+        self.missed_count = 0
+        self.late_total_us = 0
+        self.late_max_us = 0
+        for i in range(len(self.late_hist)):
+            self.late_hist[i] = 0
+
+    def jitter_report(self):
+        """How late steps fired compared to the ideal grid"""
+        avg_us = self.late_total_us // self.fired_count if self.fired_count else 0
+        s = "sequencer  %d bpm%s steps:%d missed:%d  late avg:%6.2f max:%6.2f ms" % (
+            self.bpm, " (midi clock)" if self.ext_clock else "", self.fired_count,
+            self.missed_count, avg_us/1000, self.late_max_us/1000)
+        hist = " ".join("<%g:%d" % (hist_bounds_us[i]/1000, self.late_hist[i]) for i in range(len(hist_bounds_us)))
+        return s + "\n" + " " * 11 + "late ms " + hist + " >:%d" % self.late_hist[-1]
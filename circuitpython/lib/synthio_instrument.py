@@ -2,8 +2,13 @@
 # 1 Sep 2023 - @todbot / Tod Kurt
 # Part of https://github.com/todbot/picotouch_synth
 
+import gc
+import os
 import time
+import math
+import struct
 import synthio
+from array import array
 from collections import namedtuple
 from micropython import const
 import ulab.numpy as np
@@ -19,10 +24,252 @@ def lerp(a, b, t):  return (1-t)*a + t*b
 def map_range(s, a1, a2, b1, b2):  return  b1 + ((s - a1) * (b2 - b1) / (a2 - a1))
 
 
+class WaveMixer:
+    """
+    Mix between two waveforms into an existing int16 buffer (like a
+    synthio.Note waveform) without making any temporary arrays, unlike lerp().
+    Waves A & B are kept as A and B-A in preallocated scratch buffers,
+    so a mix is one copy, a multiply and an add, all in-place.
+    The mix amount is quantized to Q15 and a mix is skipped if nothing changed.
+    """
+    def __init__(self, size=512):
+        self.size = size
+        self.wave_a = np.zeros(size, dtype=np.float)
+        self.wave_d = np.zeros(size, dtype=np.float)  # wave B - wave A
+        self.work = np.zeros(size, dtype=np.float)
+        self.t_q15 = -1  # last mix amount, -1 = needs mixing
+        self.gain = 1.0
+        self.dest = None
+
+    def set_waves(self, wave_a, wave_b):
+        """Load new waves A & B to mix between"""
+        self.wave_a[:] = wave_a
+        self.wave_d[:] = wave_b
+        self.wave_d -= self.wave_a
+        self.t_q15 = -1
+
+    def mix_into(self, dest, t, gain=1.0):
+        """Write mix of waves A & B into 'dest', t ranges 0-1 (0=A, 1=B),
+        scaled by 'gain' (which must not push the mix past int16)"""
+        t_q15 = int(min(max(t, 0), 1) * 32767)
+        if t_q15 == self.t_q15 and gain == self.gain and dest is self.dest:
+            return False  # already mixed
+        self.work[:] = self.wave_d
+        self.work *= t_q15 / 32767
+        self.work += self.wave_a
+        if gain != 1.0:
+            self.work *= gain
+        dest[:] = self.work
+        self.t_q15 = t_q15
+        self.gain = gain
+        self.dest = dest
+        return True
+
+
+class Noise:
+    """
+    Seeded pseudo-random noise made a whole buffer at a time, no per-sample Python.
+    'size' Lehmer generators (x = x * 251 mod 65521) run side by side in a float
+    array and are all stepped at once. The products stay under 2**24, so the
+    float math is exact even in single precision. Each step is mapped onto
+    an int16 buffer of 'size' as white, pink or sample & hold noise, in place
+    through preallocated scratch buffers, so filling makes no temporary arrays.
+    """
+    m = 65521  # prime
+    a = 251  # primitive root, and a * m < 2**24
+
+    def __init__(self, size=512, seed=1):
+        self.size = size
+        self.state = np.zeros(size, dtype=np.float)
+        self.work = np.zeros(size, dtype=np.float)
+        self.total = np.zeros(size, dtype=np.float)  # pink noise's sum of rows
+        self.quot = np.zeros(size, dtype=np.uint16)  # x * a // m, at most 250
+        self.seed(seed)
+
+    def seed(self, seed):
+        """Start the generators at 'seed', the only per-sample loop, not needed after this"""
+        x = seed % (Noise.m - 1) + 1
+        for i in range(self.size):
+            x = x * 75 % Noise.m
+            self.state[i] = x
+
+    def step(self):
+        """Step every generator once, returns the state: floats from -1 to 1
+        (in a scratch buffer, good until the next step())"""
+        state, work = self.state, self.work
+        state *= Noise.a
+        work[:] = state
+        work /= Noise.m
+        self.quot[:] = work  # truncates, a floor for these positive values
+        work[:] = self.quot
+        work *= Noise.m
+        state -= work  # mod m
+        work[:] = state
+        work *= 2 / Noise.m
+        work -= 1
+        return work
+
+    def white(self, dest, volume=30000):
+        """Fill int16 buffer 'dest' with white noise"""
+        work = self.step()
+        work *= volume
+        dest[:] = work
+        return dest
+
+    def sample_hold(self, dest, volume=30000, steps=16):
+        """Fill 'dest' with 'steps' random levels, each held for len(dest)/steps samples"""
+        hold = len(dest) // steps
+        levels = self.step()
+        for k in range(steps):
+            dest[k*hold:(k+1)*hold] = int(levels[k] * volume)
+        return dest
+
+    def pink(self, dest, volume=30000, rows=6):
+        """Fill 'dest' with pink-ish (-3dB/octave) noise, the sum of 'rows' white noises,
+        each held twice as long as the one before (Voss-McCartney)"""
+        size = len(dest)
+        total = self.total
+        total[:] = self.step()  # row 0, new every sample
+        rand = self.step()
+        pos = 0
+        for k in range(1, rows):
+            hold = 1 << k
+            n = size >> k
+            for offset in range(hold):  # row k's values, each on 'hold' samples in a row
+                total[offset::hold] += rand[pos:pos+n]
+            pos += n
+        total *= volume / max(np.max(total), -np.min(total))
+        dest[:] = total
+        return dest
+
+    def fill(self, waveid, dest, volume=30000):
+        """Refill 'dest' with new noise of type 'waveid' ('NOISE', 'PINK' or 'SNH'), in place"""
+        waveid = waveid.upper()
+        if waveid in ('PNK', 'PINK'):
+            return self.pink(dest, volume)
+        elif waveid in ('SNH', 'SAMPLEHOLD'):
+            return self.sample_hold(dest, volume)
+        return self.white(dest, volume)
+
+
 class Waves:
     """
-    Generate waveforms for either oscillator or LFO use
+    Generate waveforms for either oscillator or LFO use.
+    make_waveform() makes a new buffer each time, shared() and octave_set()
+    return memoized buffers shared by everyone, so don't write into those.
     """
+    store = {}  # key = (waveid, size, volume), val = waveform, see shared()
+    octave_sets = {}  # key = (waveid, sample_rate, size, volume), val = [users, waves], see octave_set()
+    lowest_freq = 16.3516  # MIDI note 12, C0, bottom of octave_set()'s first octave
+    num_octaves = 10
+    bend_headroom = 1.13  # leave room for +2 semitones pitch bend before aliasing
+
+    def shared(waveid, size=512, volume=30000):
+        """Memoized waveform, made only the first time it's asked for"""
+        waveid = waveid.upper()
+        key = (waveid, size, volume)
+        waveform = Waves.store.get(key)
+        if waveform is None:
+            waveform = Waves.make_waveform(waveid, size, volume)
+            Waves.store[key] = waveform
+        return waveform
+
+    def octave_set(waveid, sample_rate, size=512, volume=30000):
+        """
+        Tuple of waveforms, one per octave starting at C0, each band-limited so notes
+        in its octave (plus pitch bend) have no harmonics above Nyquist. Pick one with octave_for().
+        Octaves that would get the same harmonics share a waveform (all of them, for SIN).
+        Sets are shared by everyone using the same wave, call release_octave_set() when done
+        so the last one out frees its tables.
+        """
+        waveid = waveid.upper()
+        if not Waves.has_harmonics(waveid):
+            return (Waves.shared(waveid, size, volume),) * Waves.num_octaves
+        key = (waveid[:3], sample_rate, size, volume)
+        entry = Waves.octave_sets.get(key)
+        if entry:
+            entry[0] += 1
+            return entry[1]
+        odd_only = key[0] != 'SAW'
+        harmonics = []
+        for octave in range(Waves.num_octaves):
+            f_top = Waves.lowest_freq * 2 ** (octave + 1) * Waves.bend_headroom
+            max_harmonic = max(min(int(sample_rate / 2 / f_top), size // 2 - 1), 1)
+            if odd_only and max_harmonic % 2 == 0:
+                max_harmonic -= 1  # its even harmonics are zero anyway
+            harmonics.append(max_harmonic)
+        tables = Waves.band_limited(key[0], size, volume, harmonics)
+        waves = tuple(tables[n] for n in harmonics)
+        Waves.octave_sets[key] = [1, waves]
+        return waves
+
+    def release_octave_set(waveid, sample_rate, size=512, volume=30000):
+        """Done with an octave_set(), frees its tables if nobody else uses them"""
+        key = (waveid.upper()[:3], sample_rate, size, volume)
+        entry = Waves.octave_sets.get(key)
+        if entry:
+            entry[0] -= 1
+            if entry[0] <= 0:
+                del Waves.octave_sets[key]
+
+    def has_harmonics(waveid):
+        """If 'waveid' is one band_limited() can make"""
+        return waveid[:3] in ('SAW', 'SQU', 'TRI')
+
+    def octave_for(freq):
+        """Which octave_set() waveform to use for a note of frequency 'freq'"""
+        octave = int(math.log(max(freq, Waves.lowest_freq) / Waves.lowest_freq) / math.log(2) + 0.0001)
+        return min(octave, Waves.num_octaves - 1)
+
+    def band_limited(waveid, size, volume, harmonics):
+        """
+        Dict of harmonic count -> 'SAW', 'SQU' or 'TRI' summed from sine harmonics 1 up to that
+        count, peak normalized to 'volume', for each count in 'harmonics'. All are made in one
+        pass adding harmonics to a running sum, and there's only one sin() and cos(): each
+        next harmonic is the last one's phase rotated by the step between harmonics,
+        a few multiply-adds on preallocated arrays instead of a sin() of the whole table.
+        """
+        x = np.linspace(0, 2*np.pi, size, endpoint=False)
+        step = 1 if waveid == 'SAW' else 2  # square & triangle are odd harmonics only
+        rot_c = np.cos(x * step)
+        rot_s = np.sin(x * step)
+        c = np.cos(x)  # cos(k*x) & sin(k*x) of harmonic k, starting at k = 1
+        s = np.sin(x)
+        c_next = np.zeros(size, dtype=np.float)
+        tmp = np.zeros(size, dtype=np.float)
+        wave = np.zeros(size, dtype=np.float)
+        tables = {}
+        todo = sorted(set(harmonics))
+        k = 1
+        while todo:
+            if waveid == 'TRI':  # 1/k^2, starting at its low point like triangle()
+                tmp[:] = c
+                tmp *= -1 / (k * k)
+            else:  # 1/k, saw falling like saw_down()
+                tmp[:] = s
+                tmp *= 1 / k
+            wave += tmp
+            if k == todo[0]:
+                todo.pop(0)
+                peak = max(np.max(wave), -np.min(wave))
+                tmp[:] = wave
+                tmp *= volume / peak
+                table = np.zeros(size, dtype=np.int16)
+                table[:] = tmp
+                tables[k] = table
+            # c, s = c*rot_c - s*rot_s, s*rot_c + c*rot_s
+            c_next[:] = c
+            c_next *= rot_c
+            tmp[:] = s
+            tmp *= rot_s
+            c_next -= tmp
+            s *= rot_c
+            c *= rot_s
+            s += c
+            c, c_next = c_next, c
+            k += step
+        return tables
+
     def make_waveform(waveid, size=512, volume=30000):
         waveid = waveid.upper()
         if waveid=='SIN' or waveid=='SINE':
@@ -37,6 +284,10 @@ class Waves:
             return Waves.silence(size)
         elif waveid=='NZE' or waveid=='NOISE':
             return Waves.noise(size,volume)
+        elif waveid=='PNK' or waveid=='PINK':
+            return Waves.noise_gen(size).pink(Waves.silence(size), volume)
+        elif waveid=='SNH' or waveid=='SAMPLEHOLD':
+            return Waves.noise_gen(size).sample_hold(Waves.silence(size), volume)
         else:
             print("unknown wave type", waveid)
 
@@ -64,8 +315,19 @@ class Waves:
         return np.zeros(size, dtype=np.int16)
 
     def noise(size,volume):
-        # tbd
-        pass
+        return Waves.noise_gen(size).white(Waves.silence(size), volume)
+
+    noise_gens = {}  # key = size, val = Noise
+
+    def noise_gen(size, seed=1):
+        """Shared Noise generator for buffers of 'size'"""
+        gen = Waves.noise_gens.get(size)
+        if gen is None:
+            gen = Waves.noise_gens[size] = Noise(size, seed)
+        return gen
+
+    def is_noise(waveid):
+        return waveid.upper() in ('NZE', 'NOISE', 'PNK', 'PINK', 'SNH', 'SAMPLEHOLD')
 
     def from_list( vals ):
         print("Waves.from_list: vals=",vals)
@@ -97,6 +359,123 @@ class Waves:
             return (w.getnframes(), w.getnchannels(), w.getsampwidth())
 
 
+class WaveCache:
+    """
+    Least-recently-used cache of single-cycle waves read from a WAV file,
+    holding at most 'max_bytes' worth of waves. Used by Wavetable when
+    the whole table is too big to load into RAM, so scanning back and
+    forth over the same waves doesn't go back to flash each time.
+    """
+    def __init__(self, read_func, wave_bytes, max_bytes=8192):
+        self.read_func = read_func  # function(wave_num) returning a waveform
+        self.max_waves = max(max_bytes // wave_bytes, 2)  # always room for waves A & B
+        self.waves = {}  # key = wave num, val = [last_used_tick, waveform]
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, wave_num):
+        self.tick += 1
+        entry = self.waves.get(wave_num)
+        if entry:
+            self.hits += 1
+            entry[0] = self.tick
+            return entry[1]
+        self.misses += 1
+        if len(self.waves) >= self.max_waves:  # evict least recently used
+            oldest = min(self.waves, key=lambda k: self.waves[k][0])
+            del self.waves[oldest]
+        waveform = self.read_func(wave_num)
+        self.waves[wave_num] = [self.tick, waveform]
+        return waveform
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def clear(self):
+        self.waves.clear()
+
+
+class WaveAnalysis:
+    """
+    Per-wave RMS, peak and spectral centroid of a wavetable, worked out once
+    with numpy and kept in a small sidecar file next to the WAV
+    (e.g. "/wav/PLAITS02.WAV" -> "/wav/PLAITS02.WTA"). The sidecars are made on
+    the host (sim/mapped_wavetable.py --write-analysis) and copied with the WAVs.
+    A sidecar is only used if the WAV's size and the sums of its first and
+    last waves match, copying files to CIRCUITPY changes their mtime.
+    """
+    magic = b'WTA2'
+    _hdr_fmt = "<4sHHIii"  # magic, num_waves, wave size, WAV file size, first & last wave sums
+
+    def __init__(self, num_waves):
+        self.num_waves = num_waves
+        self.rms = array('H', bytes(num_waves * 2))
+        self.peak = array('H', bytes(num_waves * 2))
+        self.centroid = array('H', bytes(num_waves * 2))  # in harmonics * 16
+
+    def sidecar_path(wav_path):
+        return wav_path.rsplit('.', 1)[0] + ".WTA"
+
+    @classmethod
+    def load(cls, wav_path, num_waves, size, read_wave, analyze=False):
+        """Get the analysis of wavetable 'wav_path' from its sidecar, or None if there
+        isn't a matching one. If 'analyze', instead analyze its waves (read with
+        'read_wave(num)') and try to save the sidecar, that reads the whole WAV."""
+        first = int(np.sum(np.array(read_wave(0), dtype=np.float)))  # exact, < 2**24
+        last = int(np.sum(np.array(read_wave(num_waves - 1), dtype=np.float)))
+        hdr = struct.pack(cls._hdr_fmt, cls.magic, num_waves, size, os.stat(wav_path)[6], first, last)
+        path = cls.sidecar_path(wav_path)
+        info = cls(num_waves)
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(hdr)) == hdr:
+                    for arr in (info.rms, info.peak, info.centroid):
+                        f.readinto(arr)
+                    return info
+        except OSError:
+            pass
+        if not analyze:
+            return None
+        for i in range(num_waves):
+            info.analyze_wave(i, read_wave(i))
+        try:
+            with open(path, 'wb') as f:
+                f.write(hdr)
+                for arr in (info.rms, info.peak, info.centroid):
+                    f.write(arr)
+        except OSError as e:  # read-only filesystem
+            print("WaveAnalysis: couldn't save", path, e)
+        return info
+
+    def analyze_wave(self, i, wave):
+        w = np.array(wave, dtype=np.float)
+        self.rms[i] = int(np.sqrt(np.mean(w * w)))
+        self.peak[i] = int(max(np.max(w), -np.min(w)))
+        spec = np.fft.fft(w)
+        if isinstance(spec, tuple):  # ulab without complex numbers gives (real, imag)
+            re, im = spec
+        else:
+            re, im = spec.real, spec.imag
+        n = len(w) // 2
+        mag = np.sqrt(re[1:n] * re[1:n] + im[1:n] * im[1:n])
+        total = np.sum(mag)
+        if total:
+            self.centroid[i] = int(16 * np.sum(mag * np.arange(1, n)) / total)
+
+    def gains(self, max_gain=4.0):
+        """Per-wave gain that brings each wave to the table's average RMS,
+        without clipping and boosting at most 'max_gain'"""
+        loud = [r for r in self.rms if r]
+        target = sum(loud) / len(loud) if loud else 0
+        gains = array('f', [1.0] * self.num_waves)
+        for i in range(self.num_waves):
+            if self.rms[i]:
+                gains[i] = min(target / self.rms[i], max_gain, 32767 / self.peak[i])
+        return gains
+
+
 class Wavetable:
     """
     A 'waveform' for synthio.Note that uses a wavetable with a scannable
@@ -111,27 +490,50 @@ class Wavetable:
     In this implementation, you select a wave position (wave_pos) that can be
     fractional, and the fractional part allows for mixing of the waves
     at wave_pos and wave_pos+1.
+
+    If not 'in_memory', waves are read from the file as needed and kept
+    in a WaveCache of 'cache_bytes' size (0 = no cache).
+
+    If 'level_comp', each wave is scaled to the table's average loudness,
+    from a WaveAnalysis lookup table, so scanning the table doesn't jump in level.
+    None (the default) uses the table's sidecar if it has one and is off if not,
+    True analyzes the table if need be (reading all of it, slow on the device).
     """
 
-    def __init__(self, filepath, size=256, in_memory=False):
+    def __init__(self, filepath, size=256, in_memory=False, cache_bytes=8192, level_comp=None):
         self.filepath = filepath
         """Sample size of each wave in the table"""
         self.size = size
         self.w = adafruit_wave.open(filepath)
-        print("hi wavetable")
+        print("hi wavetable", filepath)
         if self.w.getsampwidth() != 2 or self.w.getnchannels() != 1:
             raise ValueError("unsupported WAV format")
         self.wav = None
         if in_memory:  # load entire WAV into RAM
             self.wav = np.frombuffer(self.w.readframes(self.w.getnframes()), dtype=np.int16)
+        self.cache = None
+        if not in_memory and cache_bytes:
+            self.cache = WaveCache(self.read_wave, size*2, cache_bytes)
         self.samp_posA = -1
 
         """How many waves in this wavetable"""
         self.num_waves = self.w.getnframes() / self.size
         """ The waveform to be used by synthio.Note """
-        self.waveform = Waves.silence(size) # makes a buffer for us to lerp into
+        self.waveform = Waves.silence(size) # makes a buffer for us to mix into
+        self.mixer = WaveMixer(size)
+        self.load_gains(level_comp)
         self.set_wave_pos(0)
 
+    def load_gains(self, level_comp):
+        """Per-wave level compensation gains, or None"""
+        self.analysis = None
+        self.gains = None
+        if level_comp is not False and int(self.num_waves) > 1:
+            self.analysis = WaveAnalysis.load(self.filepath, int(self.num_waves), self.size,
+                                              self.read_wave, analyze=level_comp)
+            if self.analysis:
+                self.gains = self.analysis.gains()
+
     def set_wave_pos(self,wave_pos):
         """
         wave_pos integer part of specifies which wave from 0-num_waves,
@@ -141,35 +543,70 @@ class Wavetable:
         wave_pos = min(max(wave_pos, 0), self.num_waves-1)  # constrain
         self.wave_pos = wave_pos
 
-        samp_posA = int(wave_pos) * self.size
-        samp_posB = int(wave_pos+1) * self.size
+        wave_numA = int(wave_pos)
+        wave_numB = min(wave_numA + 1, int(self.num_waves) - 1)  # last wave has no next wave
+        samp_posA = wave_numA * self.size
+        samp_posB = wave_numB * self.size
         #print("samp_posA", samp_posA, self.samp_posA, wave_pos)
         if samp_posA != self.samp_posA:  # avoid needless computation
-            if self.wav:  # if we've loaded the entire wavetable into RAM
+            if self.wav is not None:  # if we've loaded the entire wavetable into RAM
                 waveformA = self.wav[samp_posA : samp_posA + self.size] # slice
                 waveformB = self.wav[samp_posB : samp_posB + self.size]
+            elif self.cache:
+                waveformA = self.cache.get(wave_numA)
+                waveformB = self.cache.get(wave_numB)
             else:
-                self.w.setpos(samp_posA)
-                waveformA = np.frombuffer(self.w.readframes(self.size), dtype=np.int16)
-                self.w.setpos(samp_posB)
-                waveformB = np.frombuffer(self.w.readframes(self.size), dtype=np.int16)
+                waveformA = self.read_wave(wave_numA)
+                waveformB = self.read_wave(wave_numB)
 
             self.samp_posA = samp_posA  # save
             self.waveformA = waveformA
             self.waveformB = waveformB
+            self.mixer.set_waves(waveformA, waveformB)
 
         # fractional position between a wave A & B
         wave_pos_frac = wave_pos - int(wave_pos)
-        # mix waveforms A & B and copy result into waveform used by synthio
-        self.waveform[:] = lerp(self.waveformA, self.waveformB, wave_pos_frac)
+        gain = 1.0
+        if self.gains:
+            # the mix is never louder than the louder of A & B, so their smaller max gain is safe
+            gainA, gainB = self.gains[wave_numA], self.gains[wave_numB]
+            gain = min(lerp(gainA, gainB, wave_pos_frac),
+                       32767 / max(self.analysis.peak[wave_numA], self.analysis.peak[wave_numB], 1))
+        # mix waveforms A & B into waveform used by synthio
+        self.mixer.mix_into(self.waveform, wave_pos_frac, gain)
+
+    def read_wave(self, wave_num):
+        """Read a single wave from the WAV file"""
+        self.w.setpos(wave_num * self.size)
+        return np.frombuffer(self.w.readframes(self.size), dtype=np.int16)
 
     def deinit(self):
         self.w.close()
 
 
+# binary Patch layout, see Patch.to_bytes()
+PATCH_MAGIC = b'PT'
+PATCH_VERSION = 2  # 2 added unison
+PATCH_SIZE = 160  # fixed record size, room for later versions to add fields
+_patch_fmt = "<2sBBBB16s16s16s16s6f"  # magic, version, wave_type, filt_type, flags, name, wave, waveB, wave_dir, 6 floats
+_env_fmt = "<5f"
+_unison_fmt = "<B"  # after the two EnvParams, version 2 and up
+_lfo_fmt = "<3fB"
+_str_len = 16
+
+def _pack_str(s):
+    return (s or '').encode()[:_str_len]
+
+def _unpack_str(b):
+    return b.rstrip(b'\0').decode()
+
 class LFOParams:
     """
+    Binary layout (13 bytes): rate, scale, offset as floats (NaN = None), once as a byte.
+    The waveform is not stored.
     """
+    size = struct.calcsize(_lfo_fmt)
+
     def __init__(self, rate=None, scale=None, offset=None, once=False, waveform=None):
         self.rate = rate
         self.scale = scale
@@ -182,9 +619,25 @@ class LFOParams:
                            scale=self.scale, offset=self.offset,
                            waveform=self.waveform)
 
+    def pack_into(self, buf, offset=0):
+        nan = float('nan')
+        struct.pack_into(_lfo_fmt, buf, offset,
+                         nan if self.rate is None else self.rate,
+                         nan if self.scale is None else self.scale,
+                         nan if self.offset is None else self.offset, self.once)
+
+    @classmethod
+    def unpack_from(cls, buf, offset=0):
+        rate, scale, offs, once = struct.unpack_from(_lfo_fmt, buf, offset)
+        none_if_nan = lambda v: None if math.isnan(v) else v
+        return cls(none_if_nan(rate), none_if_nan(scale), none_if_nan(offs), bool(once))
+
 class EnvParams():
     """
+    Binary layout (20 bytes): attack_time, decay_time, release_time, attack_level, sustain_level as floats
     """
+    size = struct.calcsize(_env_fmt)
+
     def __init__(self, attack_time=0.1, decay_time=0.01, release_time=0.2, attack_level=0.8, sustain_level=0.8):
         self.attack_time = attack_time
         self.decay_time = decay_time
@@ -199,26 +652,92 @@ class EnvParams():
                                 attack_level = self.attack_level,
                                 sustain_level = self.sustain_level)
 
+    def pack_into(self, buf, offset=0):
+        struct.pack_into(_env_fmt, buf, offset, self.attack_time, self.decay_time,
+                         self.release_time, self.attack_level, self.sustain_level)
+
+    def key(self):
+        """The params as a tuple, rounded like a PatchBank stores them (float32),
+        so a patch and its bank-loaded copy give the same key"""
+        buf = bytearray(self.size)
+        self.pack_into(buf)
+        return struct.unpack_from(_env_fmt, buf)
+
+    @classmethod
+    def unpack_from(cls, buf, offset=0):
+        attack_time, decay_time, release_time, attack_level, sustain_level = struct.unpack_from(_env_fmt, buf, offset)
+        return cls(attack_time, decay_time, release_time, attack_level, sustain_level)
+
 class FiltType:
     """ """
     LP = const(0)
     HP = const(1)
     BP = const(2)
     def str(t):
-        if t==LP: return 'LP'
-        elif t==HP: return 'HP'
-        elif t==BP: return 'BP'
+        if t==FiltType.LP: return 'LP'
+        elif t==FiltType.HP: return 'HP'
+        elif t==FiltType.BP: return 'BP'
         return 'UN'
 
+class FilterCache:
+    """
+    Cache of synthio filters (Biquads) so that voices sharing the same filter
+    settings share one Biquad and an unchanged filter isn't made again every update.
+    Cutoff is quantized to 'freq_steps' per octave and Q to 'q_step',
+    at most 'max_filters' are kept, least recently used are evicted.
+    """
+    def __init__(self, synth, max_filters=32, freq_steps=48, q_step=0.05):
+        self.synth = synth
+        self.max_filters = max_filters
+        self.freq_scale = freq_steps / math.log(2)
+        self.q_step = q_step
+        self.filters = {}  # key = (filt_type, freq_key, q_key), val = [last_used_tick, filter]
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filt_type, filt_f, filt_q):
+        """Get filter of type FiltType with cutoff 'filt_f' and resonance 'filt_q'"""
+        self.tick += 1
+        freq_key = int(math.log(max(filt_f, 1)) * self.freq_scale + 0.5)
+        q_key = int(filt_q / self.q_step + 0.5)
+        key = (filt_type, freq_key, q_key)
+        entry = self.filters.get(key)
+        if entry:
+            self.hits += 1
+            entry[0] = self.tick
+            return entry[1]
+        self.misses += 1
+        if len(self.filters) >= self.max_filters:  # evict least recently used
+            oldest = min(self.filters, key=lambda k: self.filters[k][0])
+            del self.filters[oldest]
+        f = math.exp(freq_key / self.freq_scale)
+        q = max(q_key * self.q_step, self.q_step)
+        if filt_type == FiltType.HP:
+            filt = self.synth.high_pass_filter(f, q)
+        elif filt_type == FiltType.BP:
+            filt = self.synth.band_pass_filter(f, q)
+        else:
+            filt = self.synth.low_pass_filter(f, q)
+        self.filters[key] = [self.tick, filt]
+        return filt
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def clear(self):
+        self.filters.clear()
+
 class WaveType:
     OSC = const(0)
     WTB = const(1)
     def str(t):
-        if t==WTB:  return 'wtb'
+        if t==WaveType.WTB:  return 'wtb'
         return 'osc'
     def from_str(s):
-        if s=='wtb':  return WTB
-        return OSC
+        if s=='wtb':  return WaveType.WTB
+        return WaveType.OSC
 
 class Patch:
     """ Patch is a serializable data structure for the Instrument's settings
@@ -235,6 +754,8 @@ class Patch:
         self.wave_mix_lfo_amount = 3
         self.wave_mix_lfo_rate = 0.5
         self.wave_dir = '/wav'
+        self.noise_per_note = False  # new noise every note, for noise waves
+        self.unison = 2  # oscs per voice: 2 = osc2 at 'detune', 3 or more = spread over +/-'detune'
         self.detune = detune
         self.filt_type = filt_type   # allowed values:
         self.filt_f = filt_f
@@ -256,10 +777,111 @@ class Patch:
         self.wave, *waveB = oscs.split('/')  # wave contains wavetable filename if wave_type=='wtb'
         self.waveB = waveB[0] if waveB and len(waveB) else None  # can this be shorter?
 
+    def to_bytes(self, buf=None):
+        """
+        Encode patch into PATCH_SIZE bytes ('buf' if given): a fixed layout of
+        magic 'PT', version, wave_type, filt_type, flags (bit 0 = noise_per_note), name, wave, waveB & wave_dir
+        (16 bytes each, nul-padded), wave_mix, wave_mix_lfo_amount, wave_mix_lfo_rate,
+        detune, filt_f, filt_q (floats), then filt_env_params, amp_env_params and unison (a byte).
+        """
+        buf = buf or bytearray(PATCH_SIZE)
+        struct.pack_into(_patch_fmt, buf, 0, PATCH_MAGIC, PATCH_VERSION,
+                         self.wave_type, self.filt_type, 1 if self.noise_per_note else 0,
+                         _pack_str(self.name), _pack_str(self.wave), _pack_str(self.waveB), _pack_str(self.wave_dir),
+                         self.wave_mix, self.wave_mix_lfo_amount, self.wave_mix_lfo_rate,
+                         self.detune, self.filt_f, self.filt_q)
+        offset = struct.calcsize(_patch_fmt)
+        self.filt_env_params.pack_into(buf, offset)
+        self.amp_env_params.pack_into(buf, offset + EnvParams.size)
+        struct.pack_into(_unison_fmt, buf, offset + 2 * EnvParams.size, self.unison)
+        return buf
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """Decode a patch made by to_bytes(), or None if 'buf' doesn't hold one"""
+        (magic, version, wave_type, filt_type, flags, name, wave, waveB, wave_dir,
+         wave_mix, lfo_amount, lfo_rate, detune, filt_f, filt_q) = struct.unpack_from(_patch_fmt, buf, 0)
+        if magic != PATCH_MAGIC:
+            return None
+        if version > PATCH_VERSION:
+            raise ValueError("unsupported patch version %d" % version)
+        offset = struct.calcsize(_patch_fmt)
+        patch = cls(_unpack_str(name), wave_type, _unpack_str(wave), detune, filt_type, filt_f, filt_q,
+                    EnvParams.unpack_from(buf, offset), EnvParams.unpack_from(buf, offset + EnvParams.size))
+        patch.waveB = _unpack_str(waveB) or None
+        patch.wave_dir = _unpack_str(wave_dir)
+        patch.noise_per_note = bool(flags & 1)
+        patch.wave_mix = wave_mix
+        patch.wave_mix_lfo_amount = lfo_amount
+        patch.wave_mix_lfo_rate = lfo_rate
+        if version >= 2:
+            patch.unison = struct.unpack_from(_unison_fmt, buf, offset + 2 * EnvParams.size)[0]
+        return patch
+
     def __repr__(self):
         return "Patch('%s','%s')" % (self.name,self.wave_select())
 
 
+class PatchBank:
+    """
+    A file of up to 'num_slots' Patches in fixed-size slots after a 16 byte
+    header ('PTBK', version, slot size, number of slots), so loading patch N
+    (e.g. on MIDI Program Change) is one seek and one read, no parsing
+    of the rest of the bank. Empty slots are all zero.
+    """
+    header_fmt = "<4sBHH"
+    header_size = 16
+
+    def __init__(self, filepath, num_slots=128, create=True):
+        self.filepath = filepath
+        self.buf = bytearray(PATCH_SIZE)
+        self.writable = True
+        try:
+            self.f = open(filepath, 'r+b')
+        except OSError:
+            try:
+                self.f = open(filepath, 'rb')  # CIRCUITPY read-only to code, can only load
+                self.writable = False
+            except OSError:
+                if not create:
+                    raise
+                self.f = open(filepath, 'w+b')
+                header = bytearray(self.header_size)
+                struct.pack_into(self.header_fmt, header, 0, b'PTBK', PATCH_VERSION, PATCH_SIZE, num_slots)
+                self.f.write(header)
+                for _ in range(num_slots):
+                    self.f.write(self.buf)  # still all zeros
+                self.f.flush()
+        self.f.seek(0)
+        magic, version, slot_size, num_slots = struct.unpack_from(self.header_fmt, self.f.read(self.header_size))
+        if magic != b'PTBK' or slot_size != PATCH_SIZE:
+            raise ValueError("not a patch bank: " + filepath)
+        self.num_slots = num_slots
+
+    def load(self, num):
+        """Load patch in slot 'num', or None if slot is empty"""
+        if not 0 <= num < self.num_slots:
+            return None
+        self.f.seek(self.header_size + num * PATCH_SIZE)
+        self.f.readinto(self.buf)
+        return Patch.from_bytes(self.buf)
+
+    def save(self, num, patch):
+        """Store 'patch' in slot 'num', or clear the slot if patch is None"""
+        if not 0 <= num < self.num_slots:
+            raise IndexError("no patch slot %d" % num)
+        if patch:
+            patch.to_bytes(self.buf)
+        else:
+            self.buf[:] = bytes(PATCH_SIZE)
+        self.f.seek(self.header_size + num * PATCH_SIZE)
+        self.f.write(self.buf)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
 # a very simple instrument
 class Instrument():
 
@@ -276,7 +898,7 @@ class Instrument():
         # FIXME: deal with multiple note_ons of same note
         f = synthio.midi_to_hz(midi_note)
         amp_env = self.patch.amp_env_params.make_env()
-        voice = synthio.Note( frequency=f, envelope=amp_env )
+        voice = synthio.Note( frequency=f, envelope=amp_env, amplitude=midi_vel/127 )
         self.voices[midi_note] = voice
         self.synth.press( voice )
 
@@ -293,38 +915,175 @@ class MonoOsc(Instrument):
         self.load_patch(patch)
 
 
-#
-class WavePolyTwoOsc(Instrument):
-    #Voice = namedtuple("Voice", "osc1 osc2 filt_env amp_env")   # idea:
+class VoiceSteal:
+    """How a full voice pool picks a voice to steal for a new note"""
+    OLDEST = const(0)    # voice that was pressed longest ago
+    QUIETEST = const(1)  # voice with the lowest amp envelope level
+
+
+max_synth_notes = 12  # CIRCUITPY_SYNTHIO_MAX_CHANNELS, more presses than this are dropped
+
+def unison_spread(i, n):
+    """Where osc 'i' of 'n' sits, in units of the patch's detune: 2 oscs are
+    at 0 & 1 (osc2 at detune), 3 or more are spread evenly from -1 to +1"""
+    if n <= 2:
+        return i
+    return 2 * i / (n - 1) - 1
+
+# synthio.BlockBiquad (CircuitPython 9.2+) lets synthio sweep filters itself
+has_block_biquad = hasattr(synthio, 'BlockBiquad')
+
+_filter_modes = {}
+if has_block_biquad:
+    _filter_modes = {FiltType.LP: synthio.FilterMode.LOW_PASS,
+                     FiltType.HP: synthio.FilterMode.HIGH_PASS,
+                     FiltType.BP: synthio.FilterMode.BAND_PASS}
+
+class ModRouting:
     """
-    This is a two-oscillator per voice subtractive synth patch
-    with a low-pass filter w/ filter envelope and an amplitude envelope
+    Patch settings all voices of a WavePolyTwoOsc share, each held in one
+    synthio.Math block: filter cutoff & resonance, how far the filter envelope
+    sweeps the cutoff, osc2 detune and pitch bend (octaves), and level.
+    Each voice's block graph (see TwoOscVoice) reads from these, so changing
+    a setting is one write, not a loop over voices, and synthio does the rest.
     """
-    def __init__(self, synth, patch):
-        super().__init__(synth)
-        self.load_patch(patch)
+    def __init__(self):
+        self.filt_f = synthio.Math(synthio.MathOperation.SUM, 8000, 0, 0)
+        self.filt_q = synthio.Math(synthio.MathOperation.SUM, 0.707, 0, 0)
+        self.filt_mod = synthio.Math(synthio.MathOperation.SUM, 0, 0, 0)
+        self.detune = synthio.Math(synthio.MathOperation.SUM, 0, 0, 0)
+        self.bend = synthio.Math(synthio.MathOperation.SUM, 0, 0, 0)
+        self.level = synthio.Math(synthio.MathOperation.SUM, 1, 0, 0)
+        self.filt_type = None  # FiltType voices filter with, None = unfiltered
+        self.synced = None  # patch settings last pushed into the blocks
+
+    def sync(self, patch):
+        """Push 'patch's settings into the blocks if they changed.
+        Returns True if voices need their filter changed (see TwoOscVoice.set_filter())"""
+        fp = patch.filt_env_params
+        settings = (patch.filt_type, patch.filt_f, patch.filt_q, patch.detune, fp.attack_time)
+        if settings == self.synced:
+            return False
+        self.synced = settings
+        self.filt_f.a = patch.filt_f
+        self.filt_q.a = max(patch.filt_q, 0.05)
+        self.detune.a = math.log(patch.detune) / math.log(2) if patch.detune > 0 else 0
+        filt_type = patch.filt_type
+        if filt_type == FiltType.LP:
+            if fp.attack_time <= 0:
+                filt_type = None  # no filter envelope, no filter
+            self.filt_mod.a = 0.5 * 4000 / 2  # 8k/2 = max freq, 0.5 = filtermod amt
+        elif filt_type in (FiltType.HP, FiltType.BP):
+            self.filt_mod.a = 0.5 * 8000 / 2
+        else:
+            print("unknown filt_type:", filt_type)
+            filt_type = None
+        changed = filt_type != self.filt_type
+        self.filt_type = filt_type
+        return changed
 
-    def load_patch(self, patch):
-        """Loads patch specifics from passed-in Patch object.
-           ##### FIXME: no it doesnt: Will reload patch if patch is not specified. """
-        self.patch = patch #  self.patch or patch
-        print("PolyTwoOsc.load_patch", patch)
 
-        self.synth.blocks.clear()   # remove any global LFOs
+class TwoOscVoice:
+    """
+    One preallocated voice of WavePolyTwoOsc: two (or for unison, 'num_oscs')
+    synthio.Notes, a filter envelope and the amp envelope they share.
+    Reused for note after note, never reallocated. 'notes' are the oscs
+    playing, the first 'unison' of them, see set_unison().
+    Its modulation is a synthio block graph built once from the ModRouting and
+    attached to the Notes, so synthio runs it with no Python in the loop:
+      cutoff = filt_env * routing.filt_mod + routing.filt_f  -> BlockBiquad frequency
+      osc bend = routing.detune * unison_spread() + routing.bend
+      amplitude = velocity * routing.level * sqrt(2 / unison)
+    The sqrt(2/unison) gain law keeps the loudness of detuned (uncorrelated) oscs
+    the same for any unison count, and two oscs at the level they always had.
+    (A lone osc stays at 1, Note amplitude doesn't go higher.)
+    """
+    cut_env = synthio.Envelope(release_time=0.02)  # for release tails there's no CPU for
 
+    def __init__(self, waveform, amp_env, filt_env_wave, routing, num_oscs=2):
+        self.oscs = tuple(synthio.Note( frequency=440, waveform=waveform, envelope=amp_env )
+                          for _ in range(max(num_oscs, 1)))
+        self.osc1 = self.oscs[0]
+        self.osc2 = self.oscs[1] if num_oscs > 1 else None
+        # fake an envelope with an LFO in 'once' mode
+        self.filt_env = synthio.LFO(once=True, scale=0.9, offset=1.01,
+                                    waveform=filt_env_wave, rate=1)  # always positive
+        self.amp_env = amp_env
+        self.routing = routing
+        self.cutoff = synthio.Math(synthio.MathOperation.SCALE_OFFSET, self.filt_env,
+                                   routing.filt_mod, routing.filt_f)
+        self.amp = synthio.Math(synthio.MathOperation.PRODUCT, 1.0, routing.level, 1.0)
+        for osc in self.oscs:
+            osc.bend = synthio.Math(synthio.MathOperation.SCALE_OFFSET, routing.detune, 0, routing.bend)
+            osc.amplitude = self.amp
+        self.notes = self.oscs
+        self.set_unison(len(self.oscs))
+        self.filters = {}  # key = FiltType, val = BlockBiquad on self.cutoff, made as needed
+        self.midi_note = None  # None = not held
+        self.order = 0  # when this voice was last pressed, for voice stealing
+        self.release_deadline = None  # time.monotonic() its release ends, None = not releasing
+
+    def set_unison(self, unison):
+        """Play the first 'unison' oscs, spread over the detune"""
+        unison = min(max(unison, 1), len(self.oscs))
+        self.notes = self.oscs[:unison]
+        for i, osc in enumerate(self.notes):
+            osc.bend.b = unison_spread(i, unison)
+            osc.envelope = self.amp_env  # in case it was cut()
+        self.amp.c = min(1.0, math.sqrt(2 / unison))
+
+    def cut(self, oscs):
+        """Make 'oscs' release in a few ms instead of their whole release time"""
+        for osc in oscs:
+            osc.envelope = self.cut_env
+
+    def set_filter(self, filt_type):
+        """Filter both oscs with the routing's filter type (or not at all, if None)"""
+        filt = None
+        if filt_type is not None and has_block_biquad:
+            filt = self.filters.get(filt_type)
+            if filt is None:
+                filt = self.filters[filt_type] = synthio.BlockBiquad(_filter_modes[filt_type],
+                                                                     self.cutoff, self.routing.filt_q)
+        for osc in self.oscs:
+            osc.filter = filt
+
+
+class CompiledPatch:
+    """
+    The parts of a Patch that WavePolyTwoOsc builds before it can play it:
+    waveforms & wave mixer or the opened Wavetable, the wave LFO, and the voice pool
+    (whose Notes share the amp envelope). Patches with the same 'key' share one.
+    """
+    def __init__(self, patch, max_voices, sample_rate, routing):
+        self.key = CompiledPatch.key_for(patch, max_voices)
         raw_lfo1 = synthio.LFO(rate = 0.3)  #, scale=0.5, offset=0.5)  # FIXME: set lfo rate by patch param
-        lfo1 = synthio.Math( synthio.MathOperation.SCALE_OFFSET, raw_lfo1, 0.5, 0.5) # unipolar
-        self.wave_lfo = lfo1
-        self.synth.blocks.append(lfo1)  # global lfo for wave_lfo
+        self.wave_lfo = synthio.Math( synthio.MathOperation.SCALE_OFFSET, raw_lfo1, 0.5, 0.5) # unipolar
+        self.waveformA = None
+        self.waveformB = None
+        self.wave_mixer = None
+        self.wavetable = None
+
+        self.octave_waves = None  # per-octave band-limited waves, if voices pick their own
+        self.noise = None  # Noise generator, if voices get new noise every note
 
         # standard two-osc oscillator patch
         if patch.wave_type == WaveType.OSC:
-            self.waveform = Waves.make_waveform('silence')  # our working buffer, overwritten w/ wavemix
-            self.waveformA = Waves.make_waveform( patch.wave )
-            self.waveformB = None
+            self.waveformA = Waves.shared( patch.wave )
             if patch.waveB:
-                self.waveformB = Waves.make_waveform( patch.waveB )
+                self.waveform = Waves.make_waveform('silence')  # our working buffer, overwritten w/ wavemix
+                self.waveformB = Waves.shared( patch.waveB )
+                self.wave_mixer = WaveMixer(len(self.waveform))
+                self.wave_mixer.set_waves(self.waveformA, self.waveformB)
+            elif Waves.is_noise( patch.wave ):
+                self.waveform = self.waveformA
+                if patch.noise_per_note:  # each voice gets its own buffer, refilled at note_on()
+                    self.noise = Waves.noise_gen( len(self.waveform) )
             else:
+                # single wave: each voice plays the octave's band-limited version, see note_on()
+                self.octave_waves = Waves.octave_set( patch.wave, sample_rate )
+                self.patch_wave = patch.wave  # for deinit()
+                self.sample_rate = sample_rate
                 self.waveform = self.waveformA
 
         # wavetable patch
@@ -333,98 +1092,441 @@ class WavePolyTwoOsc(Instrument):
             self.waveform = self.wavetable.waveform
 
         self.filt_env_wave = Waves.lfo_triangle()
+        # changes to patch.amp_env_params take effect on next load_patch()
+        amp_env = patch.amp_env_params.make_env()
+        self.voice_pool = [TwoOscVoice(self.waveform, amp_env, self.filt_env_wave, routing, patch.unison)
+                           for _ in range(max_voices)]
+        if self.noise:
+            for voice in self.voice_pool:
+                buf = Waves.silence( len(self.waveform) )
+                for osc in voice.oscs:
+                    osc.waveform = buf
+
+    @staticmethod
+    def key_for(patch, max_voices):
+        """What a compiled patch depends on. Not the filter or wave mix settings,
+        those are read live from the Patch in update()"""
+        return (patch.wave_type, patch.wave, patch.waveB, patch.wave_dir, patch.noise_per_note,
+                patch.unison, max_voices) + patch.amp_env_params.key()
+
+    def deinit(self):
+        if self.wavetable:
+            self.wavetable.deinit()  # close its WAV file
+        if self.octave_waves:
+            Waves.release_octave_set( self.patch_wave, self.sample_rate )
+
+
+class PatchCache:
+    """
+    Least-recently-used cache of CompiledPatches, at most 'max_patches' of them,
+    and fewer if free memory drops below 'min_free' bytes (where gc.mem_free() exists).
+    Evicted patches close their wavetable files and let go of their band-limited waves.
+    Voices are wired to 'routing', the ModRouting of the instrument that owns the cache.
+    """
+    def __init__(self, sample_rate, routing, max_patches=4, min_free=24*1024):
+        self.sample_rate = sample_rate
+        self.routing = routing
+        self.max_patches = max_patches
+        self.min_free = min_free
+        self.patches = {}  # key = CompiledPatch.key, val = [last_used_tick, CompiledPatch]
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, patch, max_voices, in_use=None):
+        """Get the CompiledPatch for 'patch', compiling it if need be,
+        never evicting 'in_use' (the one currently playing)"""
+        self.tick += 1
+        key = CompiledPatch.key_for(patch, max_voices)
+        entry = self.patches.get(key)
+        if entry:
+            self.hits += 1
+            entry[0] = self.tick
+            return entry[1]
+        self.misses += 1
+        while len(self.patches) >= self.max_patches or (self.patches and self.mem_tight()):
+            if not self.evict_oldest(in_use):
+                break
+        compiled = CompiledPatch(patch, max_voices, self.sample_rate, self.routing)
+        self.patches[key] = [self.tick, compiled]
+        return compiled
+
+    def mem_tight(self):
+        if not hasattr(gc, 'mem_free'):
+            return False
+        gc.collect()
+        return gc.mem_free() < self.min_free
+
+    def evict_oldest(self, in_use=None):
+        keys = [k for k in self.patches if self.patches[k][1] is not in_use]
+        if not keys:
+            return False
+        oldest = min(keys, key=lambda k: self.patches[k][0])
+        self.patches.pop(oldest)[1].deinit()
+        return True
+
+    def clear(self, in_use=None):
+        while self.evict_oldest(in_use):
+            pass
+
+
+class LoadGovernor:
+    """
+    Decides how many synthio notes may sound at once, so the audio never underruns.
+    synthio renders in the background, taking CPU from the Python loop, so the
+    loop that calls tick() (like instrument_updater()) comes around less often
+    the more notes sound: with each note taking 'note_cost' of the CPU, its rate is
+      rate = idle_rate * (1 - note_cost * sounding)
+    The governor fits that line to the (sounding, rate) it sees, a least squares fit
+    that forgets old ticks, and allows as many notes as fit in 'budget' of the CPU,
+    leaving the rest as headroom so the audio buffer never runs dry.
+    Until it has seen 'min_ticks' ticks with enough spread in notes sounding to fit,
+    it goes by 'note_cost' as given, a conservative guess, so it starts out allowing
+    fewer notes rather than too many.
+    """
+    def __init__(self, budget=0.6, note_cost=0.08, memory=0.98, min_ticks=16):
+        self.budget = budget
+        self.min_ticks = min_ticks
+        self.fitted = False  # has note_cost been measured
+        self.note_cost = note_cost
+        self.min_cost = note_cost / 4  # don't believe notes are nearly free
+        self.memory = memory  # how much of the fit each tick keeps, 0.98 = the last ~50 ticks
+        self.last_ns = 0
+        self.sums = [0.0] * 5  # weighted sums of 1, sounding, rate, sounding**2, sounding*rate
+        self.idle_rate = 0  # loop rate with no notes sounding, per the fit
+        self.load = 0  # share of the CPU the notes take
+
+    def max_notes(self):
+        return max(1, min(max_synth_notes, int(self.budget / self.note_cost)))
+
+    def tick(self, sounding, now=None):
+        """Call every time around the update loop with the number of notes sounding,
+        returns how many notes may sound"""
+        now = now or time.monotonic_ns()
+        dt = now - self.last_ns
+        last_ns, self.last_ns = self.last_ns, now
+        if not last_ns:  # first tick, or after skip()
+            return self.max_notes()
+        rate = 1_000_000_000 / dt
+        k = self.memory
+        s = self.sums
+        s[0] = s[0] * k + 1
+        s[1] = s[1] * k + sounding
+        s[2] = s[2] * k + rate
+        s[3] = s[3] * k + sounding * sounding
+        s[4] = s[4] * k + sounding * rate
+        mean_n, mean_rate = s[1] / s[0], s[2] / s[0]
+        var_n = s[3] / s[0] - mean_n * mean_n
+        if var_n > 0.25 and s[0] >= self.min_ticks:  # enough spread in notes sounding to see the slope
+            slope = (s[4] / s[0] - mean_n * mean_rate) / var_n  # negative, rate lost per note
+            self.idle_rate = mean_rate - slope * mean_n
+            if self.idle_rate > 0:
+                self.note_cost = min(max(-slope / self.idle_rate, self.min_cost), 1)
+                self.fitted = True
+        self.load = min(self.note_cost * sounding, 1)
+        return self.max_notes()
+
+    def skip(self):
+        """Don't count the time until the next tick, the loop stalled on something
+        that isn't audio (like loading a patch)"""
+        self.last_ns = 0
+
+    def report(self):
+        return "governor  max notes:%d  note cost:%.3f%s  load:%.2f  idle loop rate:%.1f Hz" % (
+            self.max_notes(), self.note_cost, "" if self.fitted else " (guess)", self.load, self.idle_rate)
+
+
+#
+class WavePolyTwoOsc(Instrument):
+    """
+    This is a two-oscillator per voice subtractive synth patch
+    with a low-pass filter w/ filter envelope and an amplitude envelope.
+    Voices come from a pool of 'max_voices' made at load_patch() time,
+    when all are in use the 'voice_steal' policy picks one to reuse.
+    Released voices keep their filter envelope running until their
+    amp envelope release is done, then are reaped back into the pool.
+    Filter envelope, detune, pitch bend and velocity are synthio block graphs
+    on the voices' Notes (see ModRouting), so update() only does wave mixing,
+    pushing changed Patch settings into the ModRouting, and reaping voices.
+    (Without synthio.BlockBiquad, update() sets each voice's filter from a FilterCache.)
+    Voices play 'patch.unison' oscs while synthio's notes (or the 'governor's
+    budget, a LoadGovernor) allow, see govern().
+    """
+    def __init__(self, synth, patch, max_voices=6, voice_steal=VoiceSteal.OLDEST, max_patches=4,
+                 governor=None):
+        super().__init__(synth)
+        self.max_voices = max_voices  # each voice uses 'unison' of synthio's 12 notes
+        self.voice_steal = voice_steal
+        self.voice_count = 0  # total voices pressed, for voice ordering
+        self.steal_count = 0
+        self.bend = 0  # pitch bend in octaves, applies to all voices
+        self.routing = ModRouting()
+        self.filter_cache = None if has_block_biquad else FilterCache(synth)
+        self.patch_cache = PatchCache(synth.sample_rate, self.routing, max_patches)
+        self.compiled = None  # CompiledPatch of current patch
+        self.governor = governor
+        self.max_notes = max_synth_notes
+        self.unison_cuts = 0  # times govern() lowered voices' unison
+        self.voice_cuts = 0  # times govern() ended a voice
+        self.load_patch(patch)
+
+    def load_patch(self, patch):
+        """Loads patch specifics from passed-in Patch object.
+        What the patch needs built (waveforms, wavetable, LFO, voice pool) comes
+        from the PatchCache, so switching back to a recent patch builds nothing."""
+        self.patch = patch
+        print("PolyTwoOsc.load_patch", patch)
+
+        for voice in self.voices.values():  # don't leave old voices droning
+            self.synth.release( voice.oscs )
+
+        compiled = self.patch_cache.get(patch, self.max_voices, in_use=self.compiled)
+        self.compiled = compiled
+        if self.governor:
+            self.governor.skip()  # compiling may have taken a while
+
+        self.synth.blocks.clear()   # remove any global LFOs (and voices' cutoffs, w/o BlockBiquad)
+        self.wave_lfo = compiled.wave_lfo
+        self.synth.blocks.append(self.wave_lfo)  # global lfo for wave_lfo
+
+        self.waveform = compiled.waveform
+        self.waveformA = compiled.waveformA
+        self.waveformB = compiled.waveformB
+        self.wave_mixer = compiled.wave_mixer
+        self.wavetable = compiled.wavetable
+        self.octave_waves = compiled.octave_waves
+        self.noise = compiled.noise
+        self.filt_env_wave = compiled.filt_env_wave
+        self.last_wave_pos = None  # force shared waveform update
+        self.last_wave_mix = None
+
+        self.releasing = []  # voices in their release, oldest first
+        self.next_reap = None  # time.monotonic() of earliest release deadline
+        self.voice_pool = compiled.voice_pool
+        self.routing.sync(patch)
+        for voice in self.voice_pool:  # may be coming back from an earlier use
+            voice.midi_note = None
+            voice.release_deadline = None
+            voice.set_filter(self.routing.filt_type)
+        self.voices.clear()
 
     def reload_patch(self):
         self.note_off_all()
         self.synth.blocks.clear()  # clear out global wavetable LFOs (if any)
         self.load_patch(self.patch)
 
-    def update(self):
-        for (osc1,osc2,filt_env,amp_env) in self.voices.values():
-
-            # let Wavetable do the work  # FIXME: don't need to do this per osc1 yeah?
-            if self.patch.wave_type == WaveType.WTB:
+    def update_shared(self):
+        """
+        Update the modulation shared by all voices, once per update().
+        All voices play the same waveform buffer, so it's only re-mixed when
+        the wave position (LFO + wave_mix) or the wave_mix actually changed.
+        """
+        # let Wavetable do the work
+        if self.patch.wave_type == WaveType.WTB:
+            if self.wave_lfo.a.rate != self.patch.wave_mix_lfo_rate:
                 self.wave_lfo.a.rate = self.patch.wave_mix_lfo_rate  # FIXME: danger
-                wave_pos = self.wave_lfo.value * self.patch.wave_mix_lfo_amount * 10
-                wave_pos += self.patch.wave_mix * self.wavetable.num_waves
+            wave_pos = self.wave_lfo.value * self.patch.wave_mix_lfo_amount * 10
+            wave_pos += self.patch.wave_mix * self.wavetable.num_waves
+            if wave_pos != self.last_wave_pos:
                 self.wavetable.set_wave_pos( wave_pos )
+                self.last_wave_pos = wave_pos
 
-            # else simple osc wave mixing
-            else:
-                if self.waveformB:
-                    #wave_mix = self.patch.wave_mix + self.wave_lfo.a.rate * self.patch.wave_mix_lfo_amount * 2  # FIXME: does not work yet
-                    wave_mix = self.patch.wave_mix
-                    osc1.waveform[:] = lerp(self.waveformA, self.waveformB, wave_mix) #self.patch.wave_mix)
-                    if self.patch.detune:
-                        osc2.waveform[:] = lerp(self.waveformA, self.waveformB, wave_mix) #self.patch.wave_mix)
-
-            filt_q = self.patch.filt_q
-            filt_mod = 0
-            filt_f = 0
-            filt = None
-
-            # prevent filter instability around note frequency
-            # must do this for each voice
-            #if self.patch.filt_f / osc1.frequency < 1.2:  filt_q = filt_q / 2
-            #filt_f = max(self.patch.filt_f * filt_env.value, osc1.frequency*0.75) # filter unstable <oscfreq?
-            #filt_f = max(self.patch.filt_f * filt_env.value, 0) # filter unstable <100?
-
-            if self.patch.filt_type == FiltType.LP:
-                if self.patch.filt_env_params.attack_time > 0:
-                    filt_mod = max(0, 0.5 * 4000 * (filt_env.value/2))  # 8k/2 = max freq, 0.5 = filtermod amt
-                    filt_f = self.patch.filt_f + filt_mod
-                    filt = self.synth.low_pass_filter( filt_f,filt_q )
-                    #print("filt:",filt_mod, filt_f)
-
-            elif self.patch.filt_type == FiltType.HP:
-                    filt_mod = max(0, 0.5 * 8000 * (filt_env.value/2))  # 8k/2 = max freq, 0.5 = filtermod amt
-                    filt_f = self.patch.filt_f + filt_mod
-                    filt = self.synth.high_pass_filter( filt_f,filt_q )
-
-            elif self.patch.filt_type == FiltType.BP:
-                    filt_mod = max(0, 0.5 * 8000 * (filt_env.value/2))  # 8k/2 = max freq, 0.5 = filtermod amt
-                    filt_f = self.patch.filt_f + filt_mod
-                    filt = self.synth.band_pass_filter( filt_f,filt_q )
-            else:
-                print("unknown filt_type:", self.patch.filt_type)
+        # else simple osc wave mixing
+        elif self.waveformB is not None:
+            #wave_mix = self.patch.wave_mix + self.wave_lfo.a.rate * self.patch.wave_mix_lfo_amount * 2  # FIXME: does not work yet
+            wave_mix = self.patch.wave_mix
+            if wave_mix != self.last_wave_mix:
+                self.wave_mixer.mix_into(self.waveform, wave_mix)
+                self.last_wave_mix = wave_mix
 
-            #print("%s: %.1f %.1f %.1f %.1f"%(self.patch.filt_type,osc1.frequency,filt_f,self.patch.filt_f,filt_q))
-            osc1.filter = filt
-            if self.patch.detune:
-                osc2.filter = filt
+    def update(self):
+        if self.routing.sync(self.patch):  # knobs changed the patch, maybe its filter type
+            for voice in self.voice_pool:
+                voice.set_filter(self.routing.filt_type)
+        if self.governor:  # release tails cost CPU too, so the governor counts them
+            self.max_notes = self.governor.tick(self.sounding_notes())
+            held = 0
+            for voice in self.voices.values():
+                held += len(voice.notes)
+            if held > self.max_notes:
+                self.govern()
+        if not self.voices and not self.releasing:
+            return
+        self.update_shared()
+
+        if self.filter_cache:  # no BlockBiquad, filters follow their envelopes from here
+            for voice in self.voices.values():
+                self.update_voice(voice)
+            for voice in self.releasing:
+                self.update_voice(voice)
+
+        if self.next_reap is not None and time.monotonic() >= self.next_reap:
+            self.reap_voices()
+
+    def update_voice(self, voice):
+        """Set one voice's filter from its cutoff block, for when there's no BlockBiquad"""
+        filt = None
+        if self.routing.filt_type is not None:
+            filt = self.filter_cache.get(self.routing.filt_type, voice.cutoff.value, self.routing.filt_q.a)
+        for osc in voice.oscs:
+            osc.filter = filt
+
+    def govern(self):
+        """Fit the held voices into 'max_notes' synthio notes, after the governor
+        lowered it: lower their unison first, then end the oldest voices"""
+        unison = min(self.patch.unison, max(1, self.max_notes // max(len(self.voices), 1)))
+        for voice in self.voices.values():
+            if len(voice.notes) > unison:
+                voice.cut(voice.notes[unison:])
+                self.synth.release(voice.notes[unison:])
+                voice.set_unison(unison)
+                self.unison_cuts += 1
+        while len(self.voices) > self.max_notes // unison:
+            oldest = min(self.voices.values(), key=lambda v: v.order)
+            self.note_off(oldest.midi_note)
+            self.voice_cuts += 1
+        self.cut_tails(self.sounding_notes() - self.max_notes)
+
+    def cut_tails(self, count):
+        """Cut short the release tails of the oldest released voices until 'count'
+        fewer synthio notes are sounding, their CPU is needed for held notes"""
+        now = time.monotonic()
+        for voice in self.releasing:
+            if count <= 0:
+                break
+            for osc in voice.oscs:
+                if self.synth.note_info(osc)[0] is not None:
+                    count -= 1
+            voice.cut(voice.oscs)
+            voice.release_deadline = min(voice.release_deadline, now + TwoOscVoice.cut_env.release_time)
+            self.next_reap = min(self.next_reap, voice.release_deadline)
+
+    def sounding_notes(self, but=None):
+        """How many synthio notes the voices (except 'but') have sounding, including releases"""
+        n = 0
+        for voice in self.voice_pool:
+            if voice is not but:
+                for osc in voice.oscs:
+                    if self.synth.note_info(osc)[0] is not None:
+                        n += 1
+        return n
+
+    def find_voice(self, midi_note):
+        """Pick a voice from the pool for midi_note, stealing one if need be"""
+        voice = self.voices.get(midi_note)
+        if voice:  # same note pressed again, retrigger its voice
+            return voice
+        oldest = None
+        for v in self.voice_pool:  # of the idle voices, reuse the one pressed longest ago
+            if v.midi_note is None and v.release_deadline is None:
+                if oldest is None or v.order < oldest.order:
+                    oldest = v
+        if oldest:
+            return oldest
+        return self.steal_voice()
+
+    def steal_voice(self):
+        """The sounding voice to take over: the one furthest into its release,
+        else a held one picked by 'voice_steal'"""
+        if self.releasing:
+            return self.releasing[0]
+        self.steal_count += 1
+        if self.voice_steal == VoiceSteal.QUIETEST:
+            return min(self.voices.values(), key=lambda v: self.synth.note_info(v.osc1)[1])
+        return min(self.voices.values(), key=lambda v: v.order)
 
     def note_on(self, midi_note, midi_vel=127):
-        amp_env = self.patch.amp_env_params.make_env()
-
-        #filt_env = self.patch.filt_env_params.make_env()  # synthio.Envelope.value does not exist
-        # fake an envelope with an LFO in 'once' mode
-        filt_env = synthio.LFO(once=True, scale=0.9, offset=1.01,
-                               waveform=self.filt_env_wave,
-                               rate=self.patch.filt_env_params.attack_time, ) # always positve
-
+        voice = self.find_voice(midi_note)
+        # new notes get fewer unison oscs as synthio's notes (or the governor's budget) run out,
+        # and take over a sounding voice when not even one osc fits.
+        # (released oscs hold their synthio channels until their release ends)
+        room = self.max_notes - self.sounding_notes(voice)
+        if room < 1 and voice.midi_note == midi_note:  # retrigger in place, make room from tails
+            self.cut_tails(1 - room)
+        elif room < 1 and (self.voices or self.releasing):
+            voice = self.steal_voice()
+            room = self.max_notes - self.sounding_notes(voice)
+            self.voice_cuts += 1
+            if room < 1:
+                self.cut_tails(1 - room)
+        held = len(self.voices) + (0 if voice.midi_note is not None else 1)
+        unison = max(1, min(self.patch.unison, room, self.max_notes // held))
+        if voice.midi_note is not None:  # stolen or retriggered
+            self.voices.pop(voice.midi_note)
+        elif voice.release_deadline is not None:  # cut short its release
+            self.releasing.remove(voice)
+            voice.release_deadline = None
+        elif self.filter_cache:
+            self.synth.blocks.append(voice.cutoff)  # so update_voice() can read its value
+
+        if len(voice.notes) > unison:  # stolen voice had more oscs going
+            self.synth.release(voice.notes[unison:])
+        voice.set_unison(unison)
         f = synthio.midi_to_hz(midi_note)
-        osc1 = synthio.Note( frequency=f, waveform=self.waveform, envelope=amp_env )
-        osc2 = synthio.Note( frequency=f * self.patch.detune, waveform=self.waveform, envelope=amp_env )
+        for osc in voice.oscs:
+            osc.frequency = f  # detune is in their bends
+        if self.octave_waves:  # band-limited for the note's octave, no aliasing up high
+            self.set_octave_waves(voice)
+        elif self.noise:  # new noise for this note, into the voice's own buffer
+            self.noise.fill(self.patch.wave, voice.osc1.waveform)
+        voice.amp.a = midi_vel / 127
+        voice.filt_env.rate = self.patch.filt_env_params.attack_time
+        voice.filt_env.retrigger()
+        self.voice_count += 1
+        voice.order = self.voice_count
+        voice.midi_note = midi_note
 
-        self.voices[midi_note] = (osc1, osc2, filt_env, amp_env)
-        self.synth.press( (osc1,osc2) )
-        self.synth.blocks.append(filt_env) # not tracked automaticallly by synthio
+        self.voices[midi_note] = voice
+        self.synth.release_then_press( release=voice.notes, press=voice.notes )
 
     def note_off(self, midi_note, midi_vel=0):
         print("note_off:", midi_note)
-        (osc1,osc2,filt_env,amp_env) = self.voices.get(midi_note, (None,None,None,None)) # FIXME
-        #print("note_off:",osc1)
-        if osc1:  # why this check? in case user tries to note_off a non-existant note
-            self.synth.release( (osc1,osc2) )
-            self.voices.pop(midi_note)  # FIXME: let filter run on release, check amp_env?
-            self.synth.blocks.remove(filt_env)  # FIXME: figure out how to release after note is done
-        #print("note_off: blocks:", self.synth.blocks)
+        voice = self.voices.pop(midi_note, None)
+        if voice:  # in case user tries to note_off a non-existant note
+            self.synth.release( voice.oscs )
+            voice.midi_note = None
+            # keep its filter envelope running until release is done, see reap_voices()
+            voice.release_deadline = time.monotonic() + self.patch.amp_env_params.release_time
+            self.releasing.append(voice)
+            if self.next_reap is None or voice.release_deadline < self.next_reap:
+                self.next_reap = voice.release_deadline
+
+    def reap_voices(self):
+        """Return all voices whose release is done to the voice pool, in one pass"""
+        now = time.monotonic()
+        next_reap = None
+        i = 0
+        while i < len(self.releasing):
+            voice = self.releasing[i]
+            if voice.release_deadline <= now:
+                self.releasing.pop(i)
+                voice.release_deadline = None
+                if self.filter_cache:
+                    self.synth.blocks.remove(voice.cutoff)
+            else:
+                if next_reap is None or voice.release_deadline < next_reap:
+                    next_reap = voice.release_deadline
+                i += 1
+        self.next_reap = next_reap
 
     def note_off_all(self):
-        for n in self.voices.keys():
+        for n in list(self.voices.keys()):
             print("note_off_all:",n)
             self.note_off(n)
 
+    def pitch_bend(self, bend):
+        """Bend all voices by 'bend' octaves, e.g. 2/12 for up a whole step"""
+        self.bend = bend
+        self.routing.bend.a = bend  # every voice's bend reads this
+
     def redetune(self):
-        for (osc1,osc2,filt_env,amp_env) in self.voices.values():
-            osc2.frequency = osc1.frequency * self.patch.detune
+        self.routing.sync(self.patch)  # oscs' bends read the new detune
+        if self.octave_waves:
+            for voice in self.voices.values():
+                self.set_octave_waves(voice)
+
+    def set_octave_waves(self, voice):
+        """Give each of a voice's oscs the band-limited wave for its detuned frequency"""
+        detune = self.routing.detune.a
+        for osc in voice.notes:
+            osc.waveform = self.octave_waves[Waves.octave_for(osc.frequency * 2 ** (detune * osc.bend.b))]
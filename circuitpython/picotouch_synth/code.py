@@ -7,18 +7,20 @@ import time
 import ulab.numpy as np
 import synthio
 import usb_midi
-import adafruit_midi
-from adafruit_midi.note_on import NoteOn
-from adafruit_midi.note_off import NoteOff
-from adafruit_midi.control_change import ControlChange
 
-from synthio_instrument import WavePolyTwoOsc, Patch, FiltType, WaveType
-from picotouch_synth import PicoTouchSynthHardware, map_range
+from synthio_instrument import WavePolyTwoOsc, Patch, PatchBank, LoadGovernor, FiltType, WaveType
+from picotouch_synth import PicoTouchSynthHardware
+from midi_writer import MidiWriter
+from midi_parser import MidiParser, NOTE_ON, NOTE_OFF, CONTROL_CHANGE, PITCH_BEND, PROGRAM_CHANGE
+from loop_profiler import LoopProfiler, print_summary
 
 base_note_default = 36
 base_note = 36
 filter_freq = 3000
 filter_resonance = 1.2
+bend_range = 2  # semitones
+aftertouch_interval = 0.05  # at most one aftertouch per pad this often, in seconds
+aftertouch_headroom = 64  # MIDI out queue bytes left free for notes, aftertouch goes first
 
 # some musical scales, extended for our 17-key range
 scale_mixolydian   = (0, 2, 4, 5, 7, 9, 10, 12, 14, 16)
@@ -26,7 +28,7 @@ scale_minor        = (0, 2, 3, 5, 7, 8, 10, 12, 14, 15)
 scale_major        = (0, 2, 4, 5, 7, 9, 11, 12, 14, 16)
 scale = scale_major
 
-hw = PicoTouchSynthHardware()
+hw = PicoTouchSynthHardware(touch_threshold_adjust=300)  # this app always used 300, the library defaults to 400
 
 # set up the patch that describes how this synth sounds
 patchA = Patch('wtbA')
@@ -58,18 +60,38 @@ patchC.filt_env_params.attack_time = 0.5
 patchC.filt_env_params.attack_level = 0.8
 patchC.amp_env_params.release_time = 1.0
 
+patchD = Patch('sawD')  # supersaw lead
+patchD.wave_type = WaveType.OSC
+patchD.wave = 'SAW'
+patchD.unison = 5
+patchD.detune = 1.012  # spread +/- 20 cents
+patchD.filt_q = 1.2
+patchD.filt_env_params.attack_time = 1.0
+patchD.amp_env_params.release_time = 0.4
+
 mod_left = 0.02
 mod_mid = 0.3
 mod_right = 0.02
 
-# set up the instrument that holds the patch
-inst = WavePolyTwoOsc(hw.synth, patchA)
+# patches for MIDI Program Change, the bank starts out with patches A, B, C, D
+try:
+    patch_bank = PatchBank('/patches.bin')
+except OSError as e:  # no bank yet & CIRCUITPY is read-only
+    print("no patch bank:", e)
+    patch_bank = None
+if patch_bank and patch_bank.writable and patch_bank.load(3) is None:
+    for i, patch in enumerate((patchA, patchB, patchC, patchD)):
+        patch_bank.save(i, patch)
+
+# set up the instrument that holds the patch,
+# the governor thins out unison then voices if the synth gets too much for the CPU
+inst = WavePolyTwoOsc(hw.synth, patchA, governor=LoadGovernor())
 
-midi_uart = adafruit_midi.MIDI(midi_out=hw.uart, midi_in=hw.uart)
-midi_usb = adafruit_midi.MIDI(midi_out=usb_midi.ports[1], midi_in=usb_midi.ports[0])
+# MIDI out is queued and sent once per touch scan, so the 31250 baud UART never stalls touch_updater()
+midi_outs = (MidiWriter(usb_midi.ports[1]), MidiWriter(hw.uart, baud_rate=31250))
 
 def note_on(midi_note, vel=100):
-    inst.note_on(midi_note)
+    inst.note_on(midi_note, vel)
     led_num = midi_note - base_note
     if led_num >=0 and led_num < 17:
         hw.leds[led_num] = 0x330033
@@ -84,27 +106,79 @@ def note_off_all():
     inst.note_off_all()
 
 def midi_note_on(midi_note, vel=100):
-    msg = NoteOn(midi_note, velocity=vel)
-    midi_usb.send( msg )
-    midi_uart.send( msg )
+    for midi_out in midi_outs:
+        midi_out.note_on(midi_note, vel)
 
 def midi_note_off(midi_note, vel=0):
-    msg = NoteOff(midi_note, velocity=vel)
-    midi_usb.send( msg )
-    midi_uart.send( msg )
-
+    for midi_out in midi_outs:
+        midi_out.note_off(midi_note, vel)
+
+def midi_aftertouch(midi_note, pressure):
+    for midi_out in midi_outs:
+        if midi_out.room() > aftertouch_headroom:  # shed aftertouch when busy, notes matter more
+            midi_out.poly_pressure(midi_note, pressure)
+
+def handle_note_on(channel, note, vel):
+    note_on(note, vel)
+
+def handle_note_off(channel, note, vel):
+    note_off(note, vel)
+
+def handle_cc(channel, control, value):
+    print("CC:", control, value)
+    if control == 71:  # "sound controller 1"
+        inst.patch.wave_mix = value/127
+    elif control == 1: # mod wheel
+        inst.patch.wave_mix_lfo_amount = value/127 * 50
+        #inst.patch.wave_mix_lfo_rate = value/127 * 5
+    elif control == 74: # filter cutoff
+        inst.patch.filt_f = value/127 * 8000
+
+def handle_pitch_bend(channel, lsb, msb):
+    bend = ((msb << 7 | lsb) - 8192) / 8192  # -1 to +1
+    inst.pitch_bend(bend * bend_range / 12)
+
+def handle_program_change(channel, program, _):
+    if patch_bank:
+        patch = patch_bank.load(program)
+    else:
+        patch = (patchA, patchB, patchC, patchD)[program] if program < 4 else None
+    print("program change:", program, patch)
+    if patch:
+        inst.note_off_all()
+        inst.load_patch(patch)
+
+midi_ins = (MidiParser(usb_midi.ports[0]), MidiParser(hw.uart))
+for midi_in in midi_ins:
+    midi_in.on(NOTE_ON, handle_note_on)
+    midi_in.on(NOTE_OFF, handle_note_off)
+    midi_in.on(CONTROL_CHANGE, handle_cc)
+    midi_in.on(PITCH_BEND, handle_pitch_bend)
+    midi_in.on(PROGRAM_CHANGE, handle_program_change)
+
+
+# press X & Y pads together to print loop timings
+profiling = True
 
 async def instrument_updater():
+    prof = LoopProfiler("instrument_updater", enabled=profiling)
     while True:
+        prof.start()
         inst.update()
+        prof.stop()
         await asyncio.sleep(0.01)  # as fast as possible
 
 async def touch_updater():
     global mod_left, mod_mid, mod_right, base_note
 
     held_keys = [False] * hw.num_touch_pads
+    sent_pressures = [0] * hw.num_touch_pads  # last aftertouch sent per pad
+    sent_times = [0] * hw.num_touch_pads  # and when, in ns
+    aftertouch_interval_ns = int(aftertouch_interval * 1_000_000_000)
+    prof = LoopProfiler("touch_updater", enabled=profiling)
 
     while True:
+        prof.start()
         touches = hw.check_touch()
         for t in touches:
             print("t:",t)
@@ -113,12 +187,14 @@ async def touch_updater():
 
             if t.pressed:
                 held_keys[pad_num] = True
+                vel = hw.touch_velocities[pad_num]
                 if trig_num is not None:
                     note_num = scale[trig_num]
-                    note_on( base_note + note_num)
+                    note_on( base_note + note_num, vel)
 
                 if pad_num < 17:
-                    midi_note_on(base_note + pad_num)  # act as MIDI controller
+                    midi_note_on(base_note + pad_num, vel)  # act as MIDI controller
+                    sent_pressures[pad_num] = 0
 
                 elif pad_num == 17: # A key
                     print("load patch A")
@@ -139,6 +215,11 @@ async def touch_updater():
                     base_note = min(base_note + 12, 60)
                     note_off_all()
 
+                if held_keys[20] and held_keys[21]:  # X & Y together, octave ends up unchanged
+                    print_summary()
+                    if inst.governor:
+                        print(inst.governor.report())
+
             else: # release
                 held_keys[pad_num] = False
                 if trig_num is not None:
@@ -147,8 +228,16 @@ async def touch_updater():
                 if pad_num < 17:
                     midi_note_off(base_note + pad_num)  # act as MIDI controller
 
+        now = time.monotonic_ns()
         for key_number, held in enumerate(held_keys):
             if held:
+                # pad pressure as MIDI polyphonic aftertouch, when it changes enough
+                pressure = hw.touch_pressures[key_number]
+                if (key_number < 17 and abs(pressure - sent_pressures[key_number]) > 4
+                        and now - sent_times[key_number] >= aftertouch_interval_ns):
+                    midi_aftertouch(base_note + key_number, pressure)
+                    sent_pressures[key_number] = pressure
+                    sent_times[key_number] = now
                 # mod_left keys
                 if key_number == 1:
                     mod_left = max( mod_left - 0.02, 0.02)
@@ -172,10 +261,15 @@ async def touch_updater():
         inst.patch.wave_mix_lfo_amount = mod_left * 2
         #inst.patch.filt_f = 50 + mod_mid * 8000
 
+        for midi_out in midi_outs:  # send this scan's MIDI, without waiting on the UART
+            midi_out.flush()
+        prof.stop()
         await asyncio.sleep(0.0)
 
 async def led_updater():
+    prof = LoopProfiler("led_updater", enabled=profiling)
     while True:
+        prof.start()
         # octave up/down leds
         if base_note == base_note_default:
             hw.leds[18:20] = 0x080000, 0x080000
@@ -198,26 +292,17 @@ async def led_updater():
         hw.leds_control_right( mod_right)
 
         hw.leds.show()
+        prof.stop()
         await asyncio.sleep(0.05)
 
 async def midi_handler():
+    prof = LoopProfiler("midi_handler", enabled=profiling)
     while True:
-        # MIDI input
-        while msg := midi_usb.receive() or midi_uart.receive():
-            if isinstance(msg, NoteOn) and msg.velocity != 0:
-                note_on(msg.note, msg.velocity)
-            elif isinstance(msg,NoteOff) or isinstance(msg,NoteOn) and msg.velocity==0:
-                note_off(msg.note, msg.velocity)
-            elif isinstance(msg,ControlChange):
-                print("CC:",msg.control, msg.value)
-                if msg.control == 71:  # "sound controller 1"
-                    inst.patch.wave_mix = msg.value/127
-                elif msg.control == 1: # mod wheel
-                    inst.patch.wave_mix_lfo_amount = msg.value/127 * 50
-                    #inst.patch.wave_mix_lfo_rate = msg.value/127 * 5
-                elif msg.control == 74: # filter cutoff
-                    inst.patch.filt_f = msg.value/127 * 8000
-
+        prof.start()
+        # MIDI input, each port read once per loop so neither can starve the other
+        for midi_in in midi_ins:
+            midi_in.poll()
+        prof.stop()
         await asyncio.sleep(0.001)
 
 async def debug_printer():
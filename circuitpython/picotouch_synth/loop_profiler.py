@@ -0,0 +1 @@
+../lib/loop_profiler.py
\ No newline at end of file
@@ -0,0 +1 @@
+../lib/midi_parser.py
\ No newline at end of file
@@ -0,0 +1 @@
+../lib/picotouch_synth.py
\ No newline at end of file
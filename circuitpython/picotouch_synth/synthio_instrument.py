@@ -0,0 +1 @@
+../lib/synthio_instrument.py
\ No newline at end of file
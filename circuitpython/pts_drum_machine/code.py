@@ -4,21 +4,30 @@
 
 import asyncio
 import os
+import json
 import audiocore
 import rainbowio
 import usb_midi
-import adafruit_midi
-from adafruit_midi.note_on import NoteOn
-from adafruit_midi.note_off import NoteOff
 
 from synthio_instrument import WavePolyTwoOsc, Patch
 
 from picotouch_synth import PicoTouchSynthHardware
+from midi_writer import MidiWriter
+from midi_parser import MidiParser, NOTE_ON, NOTE_OFF
+from sample_cache import SampleCache
+from step_sequencer import StepSequencer
+from loop_profiler import LoopProfiler, print_summary
 
 base_note = 24
 drum_dir = "drum_wavs"
 
 SAMPLE_RATE = 11025
+sample_ram_budget = 80 * 1024  # bytes of RAM for decoded drum samples, the rest stream from flash
+seq_bpm = 120
+seq_swing = 0.0  # 0-0.5, how much later odd steps play
+
+# press X & Y pads together to print loop timings
+profiling = True
 
 # FIXME: put these in PicoTouchSynthHardware
 num_pads = 17
@@ -26,31 +35,129 @@ num_trig_pads = 10
 
 hw = PicoTouchSynthHardware(sample_rate=SAMPLE_RATE, num_voices=num_trig_pads)
 
-midi_uart = adafruit_midi.MIDI(midi_out=hw.uart, midi_in=hw.uart)
-midi_usb = adafruit_midi.MIDI(midi_out=usb_midi.ports[1], midi_in=usb_midi.ports[0])
+# MIDI out is queued and sent once per touch scan, so the 31250 baud UART never stalls touch_updater()
+midi_outs = (MidiWriter(usb_midi.ports[1]), MidiWriter(hw.uart, baud_rate=31250))
+
+
+class KitIndex:
+    """
+    Which WAV file goes on which trigger pad ("00...", "01...", etc) for each kit
+    directory in 'drum_dir'. Kept on flash in a JSON manifest, so switching kits
+    doesn't list directories. A kit is rescanned when its directory's
+    modification time changes, or when one of its WAVs isn't the size and
+    modification time it was (FAT doesn't always update a directory's mtime).
+    (CIRCUITPY must be writable by code, via storage.remount() in boot.py,
+    to save the manifest, else it's rebuilt at boot.)
+    """
+    version = 2
+
+    def __init__(self, drum_dir, num_trigs, manifest_name="kits.json"):
+        self.drum_dir = drum_dir
+        self.num_trigs = num_trigs
+        self.manifest_path = drum_dir + "/" + manifest_name
+        self.kits = {}  # key = kit name, val = {"mtime": dir mtime, "fnames": [wav path per pad, or None],
+                        #   "stats": [[size, mtime] per pad, or None]}
+        self.rebuilt = 0  # kits rescanned at last refresh()
+        self.load()
+        self.refresh()
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") == self.version and manifest.get("num_trigs") == self.num_trigs:
+                self.kits = manifest["kits"]
+        except (OSError, ValueError, KeyError) as e:
+            print("KitIndex: no manifest", e)
+
+    def save(self):
+        try:
+            with open(self.manifest_path, "w") as f:
+                json.dump({"version": self.version, "num_trigs": self.num_trigs, "kits": self.kits}, f)
+        except OSError as e:  # read-only filesystem
+            print("KitIndex: couldn't save manifest", e)
+
+    def refresh(self):
+        """Rescan kits whose directories changed, save the manifest if any did"""
+        self.rebuilt = 0
+        kit_names = []
+        for kit_name in os.listdir(self.drum_dir):
+            kit_dir = self.drum_dir + "/" + kit_name
+            st = os.stat(kit_dir)
+            if kit_name.startswith('.') or not st[0] & 0x4000:  # only directories
+                continue
+            kit_names.append(kit_name)
+            kit = self.kits.get(kit_name)
+            if not kit or kit["mtime"] != st[8] or kit["stats"] != self.file_stats(kit["fnames"]):
+                fnames = self.scan_kit(kit_name)
+                self.kits[kit_name] = {"mtime": st[8], "fnames": fnames, "stats": self.file_stats(fnames)}
+                self.rebuilt += 1
+        for kit_name in list(self.kits):  # kits that went away
+            if kit_name not in kit_names:
+                del self.kits[kit_name]
+                self.rebuilt += 1
+        if self.rebuilt:
+            self.save()
+
+    def scan_kit(self, kit_name):
+        """List a kit's directory and put the first WAV with each pad's number prefix on that pad"""
+        fnames = [None] * self.num_trigs
+        for fname in sorted(os.listdir( self.drum_dir + '/' + kit_name )):
+            if fname.lower().endswith('.wav') and not fname.startswith('.'):
+                prefix = fname[:2]
+                if prefix.isdigit() and int(prefix) < self.num_trigs and not fnames[int(prefix)]:
+                    fnames[int(prefix)] = self.drum_dir + "/" + kit_name + '/' + fname
+        return fnames
+
+    def file_stats(self, fnames):
+        """[size, mtime] of each file in 'fnames', None for no file or one that's gone"""
+        stats = []
+        for fname in fnames:
+            try:
+                st = os.stat(fname) if fname else None
+                stats.append([st[6], st[8]] if st else None)
+            except OSError:
+                stats.append(None)
+        return stats
+
+    def kit_fnames(self, kit_name):
+        return self.kits[kit_name]["fnames"]
 
 
 class DrumMachine:
-    def __init__(self, drum_dir, kit_name, num_trigs):
+    def __init__(self, drum_dir, kit_name, num_trigs, ram_budget=sample_ram_budget):
         self.drum_dir = drum_dir
         self.num_trig_pads = num_trigs
-        self.load_kit(kit_name)
-
-    def load_kit(self, kit_name):
+        self.kits = KitIndex(drum_dir, num_trigs)
+        self.samples = SampleCache(ram_budget)
+        self.kit_loader = None  # SampleCache.preload_steps() of kit being loaded
+        self.streams = [None] * num_trigs  # WaveFiles of samples playing from flash, per voice
+        self.trig_profiler = LoopProfiler("play_drum", enabled=profiling)  # trigger-to-play() latency
+        self.load_kit(kit_name, background=False)
+
+    def load_kit(self, kit_name, background=True):
+        """Switch to a kit. Its samples are decoded into RAM a bit at a time
+        by load_step() if 'background', until then they stream from flash."""
         self.kit_name = kit_name
-        self.drum_fnames = [None] * self.num_trig_pads  # maximum number
-        wav_list = []
-        for fname in sorted(os.listdir( self.drum_dir + '/' + self.kit_name )):
-            if fname.lower().endswith('.wav') and not fname.startswith('.'):
-                wav_list.append(fname)
-        for i in range(self.num_trig_pads):
-            fprefix = "%02d" % i
-            fns = [fn for fn in wav_list if fn.startswith(fprefix)]
-            if len(fns):  # if there's a match
-                self.drum_fnames[i] = drum_dir + "/" + self.kit_name + '/' + fns[0]
+        self.drum_fnames = self.kits.kit_fnames(kit_name)
         self.kit_size = self.calc_kit_size()
+        if self.kit_loader:  # stop loading the previous kit
+            self.kit_loader.close()
+        self.kit_loader = self.samples.preload_steps(self.drum_fnames, chunk_bytes=4096 if background else 0)
+        if not background:
+            self.load_step(all_steps=True)
         return self.drum_fnames
 
+    def load_step(self, all_steps=False):
+        """Do the next bit of loading the current kit's samples, if any"""
+        while self.kit_loader:
+            try:
+                next(self.kit_loader)
+            except StopIteration:
+                self.kit_loader = None
+            if not all_steps:
+                break
+
     def calc_kit_size(self):
         """ """
         kit_size = self.num_trig_pads
@@ -60,16 +167,24 @@ class DrumMachine:
         return kit_size
 
     def play_drum(self, num, vel=100):
+        self.trig_profiler.start()
         print("play_drum",num)
         wav_fname = self.drum_fnames[ num ]
         loopit = False   # FIXME
         voice = hw.mixer.voice[num]
+        voice.level = vel / 127
         if wav_fname is not None:
             try:
-                wave = audiocore.WaveFile(open(wav_fname,"rb"))
+                wave = self.samples.get(wav_fname)
+                if wave is None:  # doesn't fit in RAM, stream it from flash
+                    wave = audiocore.WaveFile(open(wav_fname,"rb"))
                 voice.play(wave,loop=loopit)
+                if self.streams[num]:  # done with last stream on this voice
+                    self.streams[num].deinit()
+                self.streams[num] = wave if isinstance(wave, audiocore.WaveFile) else None
             except (OSError, ValueError) as e:
                 print(e)
+        self.trig_profiler.stop()
 
     def stop_drum(self, num, vel=0):
         wav_fname = self.drum_fnames[ num ]
@@ -86,7 +201,7 @@ held_pads = [False] * hw.num_touch_pads
 
 def note_on(midi_note, vel=100):
     pad_num = (midi_note - base_note) % num_trig_pads
-    dm.play_drum( pad_num )
+    dm.play_drum( pad_num, vel )
 
 def note_off(midi_note, vel=0):
     pad_num = (midi_note - base_note) % num_trig_pads
@@ -96,20 +211,35 @@ def note_off_all():
     pass
 
 def midi_note_on(midi_note, vel=100):
-    msg = NoteOn(midi_note, velocity=vel)
-    midi_usb.send( msg )
-    midi_uart.send( msg )
+    for midi_out in midi_outs:
+        midi_out.note_on(midi_note, vel)
 
 def midi_note_off(midi_note, vel=0):
-    msg = NoteOff(midi_note, velocity=vel)
-    midi_usb.send( msg )
-    midi_uart.send( msg )
+    for midi_out in midi_outs:
+        midi_out.note_off(midi_note, vel)
+
+# pattern sequencer, X & Y pads together start/stop it, trigger pads record into it while playing
+seq = StepSequencer(dm.play_drum, bpm=seq_bpm, swing=seq_swing, num_tracks=num_trig_pads, num_steps=16)
+for i in range(0, 16, 4):
+    seq.pattern.set(0, i, 110)  # kick
+    seq.pattern.set(2, i+2, 70)  # closed hat
+seq.pattern.set(1, 4, 100)  # snare
+seq.pattern.set(1, 12, 100)
+
+midi_ins = (MidiParser(usb_midi.ports[0]), MidiParser(hw.uart))
+for midi_in in midi_ins:
+    midi_in.on(NOTE_ON, lambda channel, note, vel: note_on(note, vel))
+    midi_in.on(NOTE_OFF, lambda channel, note, vel: note_off(note, vel))
+    midi_in.realtime_handler = seq.midi_realtime  # MIDI clock, start, stop
 
 async def touch_updater():
     global base_note
+    prof = LoopProfiler("touch_updater", enabled=profiling)
 
     while True:
+        prof.start()
         touches = hw.check_touch()
+        seq.update()  # a step may have come due during the (slow) touch scan
         for t in touches:
             pad_num = t.key_number
             trig_num = hw.bottom_pad_to_trig_num(pad_num)
@@ -117,13 +247,15 @@ async def touch_updater():
 
             if t.pressed:  # pad pressed
                 held_pads[pad_num] = True
+                vel = hw.touch_velocities[pad_num]
 
                 if trig_num is not None:  # it was a trigger pad, act as drum machine
-                    note_on(base_note + trig_num)
+                    note_on(base_note + trig_num, vel)
+                    seq.record(trig_num, vel)
                     print(pad_num, trig_num)
 
                 if pad_num < 17:
-                    midi_note_on(base_note + pad_num)  # act as MIDI controller
+                    midi_note_on(base_note + pad_num, vel)  # act as MIDI controller
                 elif pad_num == 17: # A key
                     print("load patch A")
                     dm.load_kit('kitA')
@@ -139,6 +271,15 @@ async def touch_updater():
                 elif pad_num == 21:  # Y key, oct up
                     base_note = min(base_note + 12, 60)
                     note_off_all()
+
+                if held_pads[20] and held_pads[21]:  # X & Y together, octave ends up unchanged
+                    if seq.playing:
+                        seq.stop()
+                        print_summary()
+                        print(seq.jitter_report())
+                    else:
+                        seq.reset_jitter()
+                        seq.start()
             else:  # release
                 held_pads[pad_num] = False
                 if trig_num is not None:  # act as drum machine
@@ -146,11 +287,28 @@ async def touch_updater():
                 if pad_num < 17:
                     midi_note_off( base_note + pad_num )  # act as MIDI controller
 
+        for midi_out in midi_outs:  # send this scan's MIDI, without waiting on the UART
+            midi_out.flush()
+        prof.stop()
         await asyncio.sleep(0.0)
 
+async def sequencer_updater():
+    # steps are timed by the sequencer's own clock, this only wakes it up when one is due
+    while True:
+        seq.update()
+        await asyncio.sleep(seq.time_to_next())
+
+async def kit_loader():
+    # load samples for a newly selected kit without holding up touch_updater()
+    while True:
+        dm.load_step()
+        await asyncio.sleep(0)
+
 async def led_updater():
     fade_by = 5
+    prof = LoopProfiler("led_updater", enabled=profiling)
     while True:
+        prof.start()
 
         for i in range(num_pads):
             if held_pads[i]:  # key pressed
@@ -175,16 +333,18 @@ async def led_updater():
             hw.leds[17] = 0x110800
 
         hw.leds.show()
+        prof.stop()
         await asyncio.sleep(0.03)
 
 async def midi_handler():
+    prof = LoopProfiler("midi_handler", enabled=profiling)
     while True:
-        # MIDI input
-        while msg := midi_usb.receive() or midi_uart.receive():
-            if isinstance(msg, NoteOn) and msg.velocity != 0:
-                note_on(msg.note, msg.velocity)
-            elif isinstance(msg,NoteOff) or isinstance(msg,NoteOn) and msg.velocity==0:
-                note_off(msg.note, msg.velocity)
+        prof.start()
+        # MIDI input, each port read once per loop so neither can starve the other
+        for midi_in in midi_ins:
+            midi_in.poll()
+        seq.update()  # MIDI clock may have made a step due
+        prof.stop()
         await asyncio.sleep(0)
 
 async def main():
@@ -192,6 +352,8 @@ async def main():
         asyncio.create_task(touch_updater()),
         asyncio.create_task(led_updater()),
         asyncio.create_task(midi_handler()),
+        asyncio.create_task(kit_loader()),
+        asyncio.create_task(sequencer_updater()),
     )
     await asyncio.gather( *tasks )
 
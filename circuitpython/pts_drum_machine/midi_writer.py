@@ -0,0 +1 @@
+../lib/midi_writer.py
\ No newline at end of file
@@ -0,0 +1 @@
+../lib/sample_cache.py
\ No newline at end of file
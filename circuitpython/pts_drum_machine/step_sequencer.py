@@ -0,0 +1 @@
+../lib/step_sequencer.py
\ No newline at end of file
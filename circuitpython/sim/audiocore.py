@@ -0,0 +1,27 @@
+# audiocore.py -- host stand-in for CircuitPython 'audiocore'
+# Part of https://github.com/todbot/picotouch_synth
+
+import wave
+
+class WaveFile:
+    def __init__(self, f, buffer=None):
+        self.file = f
+        with wave.open(f) as w:
+            self.sample_rate = w.getframerate()
+            self.channel_count = w.getnchannels()
+            self.bits_per_sample = w.getsampwidth() * 8
+            self.num_frames = w.getnframes()
+        f.seek(0)
+
+    def deinit(self):
+        self.file.close()
+
+class RawSample:
+    def __init__(self, buffer, *, channel_count=1, sample_rate=8000, single_buffer=True):
+        self.buffer = buffer
+        self.channel_count = channel_count
+        self.sample_rate = sample_rate
+        self.num_frames = len(buffer) // channel_count
+
+    def deinit(self):
+        pass
@@ -0,0 +1,47 @@
+# audiomixer.py -- host stand-in for CircuitPython 'audiomixer'
+# Part of https://github.com/todbot/picotouch_synth
+
+import time
+
+class MixerVoice:
+    def __init__(self):
+        self.level = 1.0
+        self.sample = None
+        self.loop = False
+        self.play_count = 0
+        self.last_play_time = None
+
+    def play(self, sample, *, loop=False):
+        self.sample = sample
+        self.loop = loop
+        self.play_count += 1
+        self.last_play_time = time.monotonic()
+
+    def stop(self):
+        self.sample = None
+
+    @property
+    def playing(self):
+        return self.sample is not None
+
+class Mixer:
+    def __init__(self, voice_count=2, buffer_size=1024, channel_count=2,
+                 bits_per_sample=16, samples_signed=True, sample_rate=8000):
+        self.voice = tuple(MixerVoice() for _ in range(voice_count))
+        self.voice_count = voice_count
+        self.buffer_size = buffer_size
+        self.channel_count = channel_count
+        self.sample_rate = sample_rate
+
+    def play(self, sample, *, voice=0, loop=False):
+        self.voice[voice].play(sample, loop=loop)
+
+    def stop_voice(self, voice=0):
+        self.voice[voice].stop()
+
+    @property
+    def playing(self):
+        return any(v.playing for v in self.voice)
+
+    def deinit(self):
+        pass
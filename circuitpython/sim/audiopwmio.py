@@ -0,0 +1,20 @@
+# audiopwmio.py -- host stand-in for CircuitPython 'audiopwmio'
+# Part of https://github.com/todbot/picotouch_synth
+
+class PWMAudioOut:
+    def __init__(self, left_channel, *, right_channel=None, quiescent_value=0x8000):
+        self.left_channel = left_channel
+        self.source = None
+
+    def play(self, sample, *, loop=False):
+        self.source = sample
+
+    def stop(self):
+        self.source = None
+
+    @property
+    def playing(self):
+        return self.source is not None
+
+    def deinit(self):
+        pass
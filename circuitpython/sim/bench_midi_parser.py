@@ -0,0 +1,131 @@
+# bench_midi_parser.py -- MIDI input throughput, MidiParser vs adafruit_midi
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Replays a dense MIDI stream (notes w/ running status, CC sweeps, pitch bend,
+# interleaved clock) through midi_parser.MidiParser and through adafruit_midi's
+# receive() + isinstance dispatch, like midi_handler() used to do.
+#
+# Usage (from the circuitpython directory):
+#   python3 sim/bench_midi_parser.py --messages 20000
+#
+import os, sys, time, random, argparse
+
+sim_dir = os.path.dirname(os.path.abspath(__file__))
+cp_dir = os.path.dirname(sim_dir)
+for _p in (os.path.join(cp_dir, 'lib'), sim_dir):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+import simhw
+from midi_parser import MidiParser, NOTE_ON, NOTE_OFF, CONTROL_CHANGE, PITCH_BEND
+
+def make_stream(num_messages, running_status=True, seed=1234):
+    """Returns (bytes, num_channel_messages) of a dense MIDI stream"""
+    rng = random.Random(seed)
+    out = bytearray()
+    status = 0
+    count = 0
+    def put(st, *data):
+        nonlocal status
+        if st != status or not running_status or rng.random() < 0.2:  # mostly running status
+            out.append(st)
+            status = st
+        out.extend(data)
+    while count < num_messages:
+        r = rng.random()
+        ch = rng.randrange(2)
+        if r < 0.5:  # note on & note off-as-vel-0
+            note = rng.randrange(36, 84)
+            put(0x90 | ch, note, rng.randrange(1, 128))
+            put(0x90 | ch, note, 0)
+            count += 2
+        elif r < 0.6:
+            put(0x80 | ch, rng.randrange(36, 84), 64)
+            count += 1
+        elif r < 0.85:  # CC sweep
+            cc = rng.choice((1, 71, 74))
+            for v in range(0, 128, 16):
+                put(0xB0 | ch, cc, v)
+                count += 1
+        else:  # bend sweep
+            for v in range(0, 16384, 2048):
+                put(0xE0 | ch, v & 0x7F, v >> 7)
+                count += 1
+        if rng.random() < 0.3:
+            out.append(0xF8)  # clock, in between messages
+    return bytes(out), count
+
+def bench_parser(stream, buf_size):
+    port = simhw.MidiPort("bench")
+    port.inject(stream)
+    counts = [0, 0, 0, 0]
+    def note_on(channel, note, vel): counts[0] += 1
+    def note_off(channel, note, vel): counts[1] += 1
+    def cc(channel, control, value): counts[2] += 1
+    def bend(channel, lsb, msb): counts[3] += 1
+    midi_in = MidiParser(port, buf_size=buf_size)
+    midi_in.on(NOTE_ON, note_on)
+    midi_in.on(NOTE_OFF, note_off)
+    midi_in.on(CONTROL_CHANGE, cc)
+    midi_in.on(PITCH_BEND, bend)
+    t0 = time.perf_counter()
+    while midi_in.poll():
+        pass
+    return time.perf_counter() - t0, counts
+
+def bench_adafruit_midi(stream):
+    import adafruit_midi
+    from adafruit_midi.note_on import NoteOn
+    from adafruit_midi.note_off import NoteOff
+    from adafruit_midi.control_change import ControlChange
+    from adafruit_midi.pitch_bend import PitchBend
+    port = simhw.MidiPort("bench")
+    port.inject(stream)
+    midi = adafruit_midi.MIDI(midi_in=port, in_buf_size=64)
+    counts = [0, 0, 0, 0]
+    t0 = time.perf_counter()
+    while port.in_waiting or midi._in_buf:
+        msg = midi.receive()
+        if msg is None:
+            continue
+        if isinstance(msg, NoteOn) and msg.velocity != 0:
+            counts[0] += 1
+        elif isinstance(msg, NoteOff) or isinstance(msg, NoteOn) and msg.velocity == 0:
+            counts[1] += 1
+        elif isinstance(msg, ControlChange):
+            counts[2] += 1
+        elif isinstance(msg, PitchBend):
+            counts[3] += 1
+    return time.perf_counter() - t0, counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--buf-size', type=int, default=64, help="MidiParser read buffer size")
+    parser.add_argument('--no-running-status', action='store_true',
+                        help="send every status byte (adafruit_midi doesn't do running status)")
+    parser.add_argument('--no-compare', action='store_true', help="skip adafruit_midi run")
+    args = parser.parse_args()
+
+    stream, num = make_stream(args.messages, running_status=not args.no_running_status)
+    print("stream: %d bytes, %d channel messages" % (len(stream), num))
+
+    def report(name, secs, counts):
+        print("%-14s %8.3f s  %9.0f msgs/s  %9.0f bytes/s  on:%d off:%d cc:%d bend:%d" %
+              (name, secs, sum(counts)/secs, len(stream)/secs, *counts))
+
+    secs, counts = bench_parser(stream, args.buf_size)
+    report("MidiParser", secs, counts)
+    if not args.no_compare:
+        try:
+            secs2, counts2 = bench_adafruit_midi(stream)
+        except ImportError:
+            print("adafruit_midi not installed, skipping comparison")
+        else:
+            report("adafruit_midi", secs2, counts2)
+            print("MidiParser is %.1fx faster" % (secs2 / secs))
+            if sum(counts2) != sum(counts):
+                print("adafruit_midi missed %d messages" % (sum(counts) - sum(counts2)))
+
+if __name__ == '__main__':
+    main()
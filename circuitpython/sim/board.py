@@ -0,0 +1,15 @@
+# board.py -- host stand-in for CircuitPython 'board' on a Raspberry Pi Pico
+# Part of https://github.com/todbot/picotouch_synth
+
+class Pin:
+    def __init__(self, name, num):
+        self.name = name
+        self.num = num
+
+    def __repr__(self):
+        return "board." + self.name
+
+for _i in range(29):
+    globals()["GP%d" % _i] = Pin("GP%d" % _i, _i)
+
+LED = GP25
@@ -0,0 +1,27 @@
+# busio.py -- host stand-in for CircuitPython 'busio', just enough UART for MIDI
+# Part of https://github.com/todbot/picotouch_synth
+
+import time
+import simhw
+
+class UART(simhw.MidiPort):
+    def __init__(self, tx=None, rx=None, baudrate=9600, timeout=1, **kwargs):
+        super().__init__("uart%d" % len(simhw.uarts))
+        self.baudrate = baudrate
+        self.timeout = timeout
+        simhw.uarts.append(self)
+        self.busy_until = 0  # perf_counter() when the last written byte is on the wire
+        self.write_wait = 0  # total seconds write() has blocked
+
+    def write(self, buf, nbytes=None):
+        """Takes as long as a real UART would to get the bytes into its TX FIFO"""
+        nbytes = len(buf) if nbytes is None else nbytes
+        if simhw.uart_write_blocks:
+            byte_time = 10 / self.baudrate  # 8N1
+            now = time.perf_counter()
+            self.busy_until = max(self.busy_until, now) + nbytes * byte_time
+            wait_until = self.busy_until - simhw.uart_fifo_size * byte_time
+            while time.perf_counter() < wait_until:
+                pass
+            self.write_wait += max(0, wait_until - now)
+        return super().write(buf, nbytes)
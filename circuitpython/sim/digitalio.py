@@ -0,0 +1,28 @@
+# digitalio.py -- host stand-in for CircuitPython 'digitalio'
+# Part of https://github.com/todbot/picotouch_synth
+
+class Direction:
+    INPUT = 0
+    OUTPUT = 1
+
+class Pull:
+    UP = 1
+    DOWN = 2
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.pull = None
+        self.value = False
+
+    def switch_to_output(self, value=False, drive_mode=None):
+        self.direction = Direction.OUTPUT
+        self.value = value
+
+    def switch_to_input(self, pull=None):
+        self.direction = Direction.INPUT
+        self.pull = pull
+
+    def deinit(self):
+        pass
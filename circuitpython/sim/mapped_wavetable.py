@@ -0,0 +1,148 @@
+# mapped_wavetable.py -- zero-copy memory-mapped wavetables for host-side tools
+# Part of https://github.com/todbot/picotouch_synth
+#
+# MappedWavetable is a synthio_instrument.Wavetable whose WAV file is mmap()ed
+# instead of read, so each wave is an int16 view straight into the page cache.
+# Opening a wavetable costs a header parse, and only the pages of the waves
+# actually used get read. Host only, CircuitPython has no mmap.
+#
+# Use like:
+#   wt = MappedWavetable("picotouch_synth/wav/PLAITS02.WAV")
+#   wt.set_wave_pos(12.5)   # same as Wavetable, wt.waveform is the mix
+#   wave = wt.wave(3)       # read-only view of wave 3, no copy
+#
+# Or index a directory of wavetables (from the circuitpython directory):
+#   python3 sim/mapped_wavetable.py picotouch_synth/wav --compare
+# and make the level compensation sidecars (.WTA) the device uses:
+#   python3 sim/mapped_wavetable.py picotouch_synth/wav --write-analysis
+#
+import os, sys, time, mmap, argparse, resource
+
+sim_dir = os.path.dirname(os.path.abspath(__file__))
+cp_dir = os.path.dirname(sim_dir)
+for _p in (os.path.join(cp_dir, 'lib'), sim_dir):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+import numpy as np
+from synthio_instrument import Wavetable, WaveAnalysis, WaveMixer, Waves
+from sample_cache import read_wav_info
+
+wav_dtype = np.dtype('<i2')  # WAV samples are little-endian whatever the host is
+
+
+def map_wav(filepath):
+    """Memory-map a 16-bit mono WAV, returns (mmap, int16 view of all its samples)"""
+    with open(filepath, 'rb') as f:
+        channels, _, bits, offset, data_size = read_wav_info(f)
+        if bits != 16 or channels != 1:
+            raise ValueError("unsupported WAV format")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # stays valid after close
+    nframes = min(data_size, len(mm) - offset) // 2  # truncated files have less than they say
+    return mm, np.frombuffer(mm, dtype=wav_dtype, count=nframes, offset=offset)
+
+
+def mapped_wav(filepath, size=256, pos=0):
+    """Like Waves.wav(), but a view into the mapped file instead of a copy"""
+    mm, wav = map_wav(filepath)
+    return wav[pos:pos+size]
+
+
+class MappedWavetable(Wavetable):
+    """
+    Wavetable on a memory-mapped WAV file. Has the same interface as Wavetable
+    ('num_waves', 'set_wave_pos()', 'waveform', 'deinit()'), but nothing is
+    read until a wave is used, and waves are views, not copies.
+    """
+    def __init__(self, filepath, size=256, level_comp=None):
+        self.filepath = filepath
+        self.size = size
+        self.mm, self.wav = map_wav(filepath)
+        self.w = None
+        self.cache = None
+        self.samp_posA = -1
+        self.num_waves = len(self.wav) / size
+        self.waveform = Waves.silence(size)
+        self.mixer = WaveMixer(size)
+        self.load_gains(level_comp)
+        self.set_wave_pos(0)
+
+    def wave(self, wave_num):
+        """Wave 'wave_num', as a read-only view into the file"""
+        return self.wav[wave_num * self.size : (wave_num + 1) * self.size]
+
+    read_wave = wave
+
+    def deinit(self):
+        self.wav = self.waveformA = self.waveformB = None
+        try:
+            self.mm.close()
+        except BufferError:
+            pass  # someone still holds a wave() view, the map goes when they let go
+
+
+def fault_count():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_minflt + ru.ru_majflt
+
+
+def index_dir(wav_dir, size, loader):
+    """Open every WAV in 'wav_dir' with 'loader', returns (info list, secs, page faults)"""
+    fnames = sorted(f for f in os.listdir(wav_dir) if f.lower().endswith('.wav'))
+    info = []
+    faults = fault_count()
+    t = time.perf_counter()
+    for fname in fnames:
+        wt = loader(os.path.join(wav_dir, fname), size)
+        info.append((fname, wt.num_waves))
+        wt.deinit()
+    return info, time.perf_counter() - t, fault_count() - faults
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index a directory of wavetables by memory-mapping them")
+    parser.add_argument('wav_dir', nargs='?', default=os.path.join(cp_dir, 'picotouch_synth', 'wav'))
+    parser.add_argument('--size', type=int, default=256, help="samples per wave")
+    parser.add_argument('--compare', action='store_true',
+                        help="also index with Wavetable(in_memory=True) and check the waves match")
+    parser.add_argument('--write-analysis', action='store_true',
+                        help="analyze each wavetable and write its .WTA sidecar, for level_comp on the device")
+    args = parser.parse_args()
+
+    if args.write_analysis:
+        for fname in sorted(f for f in os.listdir(args.wav_dir) if f.lower().endswith('.wav')):
+            wt = MappedWavetable(os.path.join(args.wav_dir, fname), args.size, level_comp=True)
+            if wt.analysis:
+                print("%-16s %s" % (fname, WaveAnalysis.sidecar_path(fname)))
+            wt.deinit()
+
+    info, secs, faults = index_dir(args.wav_dir, args.size, MappedWavetable)
+    for fname, num_waves in info:
+        print("%-16s %6.1f waves" % (fname, num_waves))
+    print("mapped:    %d wavetables in %.2f ms, %d page faults" % (len(info), secs * 1000, faults))
+    if not args.compare:
+        return
+
+    def load_in_memory(filepath, size):
+        return Wavetable(filepath, size, in_memory=True)
+    _, secs, faults = index_dir(args.wav_dir, args.size, load_in_memory)
+    print("in_memory: %d wavetables in %.2f ms, %d page faults" % (len(info), secs * 1000, faults))
+
+    mismatched = 0
+    for fname, num_waves in info:
+        filepath = os.path.join(args.wav_dir, fname)
+        a = MappedWavetable(filepath, args.size)
+        b = Wavetable(filepath, args.size, in_memory=True)
+        for pos in np.linspace(0, num_waves - 1, 17):
+            a.set_wave_pos(pos)
+            b.set_wave_pos(pos)
+            if not np.array_equal(a.waveform, b.waveform):
+                mismatched += 1
+                print("mismatch:", fname, "wave_pos %.2f" % pos)
+        a.deinit()
+        b.deinit()
+    print("waveforms match" if not mismatched else "%d waveforms differ" % mismatched)
+
+
+if __name__ == '__main__':
+    main()
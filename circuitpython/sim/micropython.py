@@ -0,0 +1,4 @@
+# micropython.py -- host stand-in for the 'micropython' module
+# Part of https://github.com/todbot/picotouch_synth
+
+def const(x):  return x
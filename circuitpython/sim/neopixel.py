@@ -0,0 +1,54 @@
+# neopixel.py -- host stand-in for CircuitPython 'neopixel'
+# Part of https://github.com/todbot/picotouch_synth
+
+RGB = "RGB"
+GRB = "GRB"
+
+def _to_tuple(c):
+    if isinstance(c, int):
+        return ((c >> 16) & 0xff, (c >> 8) & 0xff, c & 0xff)
+    return tuple(int(v) for v in c[:3])
+
+class NeoPixel:
+    # a real strip takes ~30 usec per pixel to write, with interrupts off
+    show_cost_per_pixel = 0.00003
+
+    def __init__(self, pin, n, *, bpp=3, brightness=1.0, auto_write=True, pixel_order=None):
+        self.pin = pin
+        self.n = n
+        self.brightness = brightness
+        self.auto_write = auto_write
+        self._pixels = [(0,0,0)] * n
+        self.shown = list(self._pixels)   # what's actually on the strip
+        self.show_count = 0
+        self.show_time = 0   # total seconds spent "writing" the strip
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return self._pixels[i]
+
+    def __setitem__(self, i, c):
+        if isinstance(i, slice):
+            self._pixels[i] = [_to_tuple(v) for v in c]
+        else:
+            self._pixels[i] = _to_tuple(c)
+        if self.auto_write:
+            self.show()
+
+    def __iter__(self):
+        return iter(self._pixels)
+
+    def fill(self, c):
+        self._pixels = [_to_tuple(c)] * self.n
+        if self.auto_write:
+            self.show()
+
+    def show(self):
+        self.show_count += 1
+        self.shown = list(self._pixels)
+        self.show_time += self.n * self.show_cost_per_pixel
+
+    def deinit(self):
+        pass
@@ -0,0 +1,12 @@
+# rainbowio.py -- host stand-in for CircuitPython 'rainbowio'
+# Part of https://github.com/todbot/picotouch_synth
+
+def colorwheel(pos):
+    pos = int(pos) & 0xff
+    if pos < 85:
+        return ((255 - pos*3) << 16) | ((pos*3) << 8)
+    if pos < 170:
+        pos -= 85
+        return ((255 - pos*3) << 8) | (pos*3)
+    pos -= 170
+    return ((pos*3) << 16) | (255 - pos*3)
@@ -0,0 +1,225 @@
+# render_patch.py -- faster-than-realtime offline renderer for WavePolyTwoOsc patches
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Plays a note list through the real WavePolyTwoOsc instrument, running against
+# the stand-in synthio on a virtual clock, and synthesizes the stand-in's notes
+# (waveform, envelope, biquad filter) with NumPy into a WAV file.
+#
+# Usage (from the circuitpython directory):
+#   python3 sim/render_patch.py wtb:PLAITS02 --notes 36,43,48,52 --out plaits.wav
+#   python3 sim/render_patch.py osc:SAW/SIN --detune 0.501 --notes 36 --length 1.5
+#
+import os, sys, time, math, argparse, contextlib, wave
+
+sim_dir = os.path.dirname(os.path.abspath(__file__))
+cp_dir = os.path.dirname(sim_dir)
+for _p in (os.path.join(cp_dir, 'lib'), sim_dir):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+import numpy as np
+import synthio
+import simhw
+from synthio_instrument import WavePolyTwoOsc, Patch, FiltType, WaveType
+
+control_rate = 0.01   # how often WavePolyTwoOsc.update() is called, like instrument_updater()
+synthio_block = 256   # samples synthio renders between evaluating blocks (SYNTHIO_MAX_DUR)
+
+
+class VirtualClock:
+    """Stands in for time.monotonic() while rendering"""
+    def __init__(self, t=0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+@contextlib.contextmanager
+def virtual_time(clock):
+    real_monotonic = time.monotonic
+    time.monotonic = clock
+    try:
+        yield clock
+    finally:
+        time.monotonic = real_monotonic
+
+
+def _allpole_response(a1, a2, n):
+    """Impulse response of 1/(1 + a1 z^-1 + a2 z^-2), computed in closed form from the poles"""
+    disc = complex(a1*a1 - 4*a2) ** 0.5
+    p1, p2 = (-a1 + disc) / 2, (-a1 - disc) / 2
+    k = np.arange(n)
+    if abs(p1 - p2) < 1e-9:
+        return ((k + 1) * p1 ** k).real
+    return ((p1 ** (k+1) - p2 ** (k+1)) / (p1 - p2)).real
+
+class BlockFilter:
+    """
+    Biquad run a block at a time with NumPy, no per-sample Python.
+    Output is the block convolved with the truncated impulse response,
+    plus the response to the filter state left over from the last block.
+    """
+    def __init__(self):
+        self.x1 = self.x2 = self.y1 = self.y2 = 0.0
+        self._key = None
+
+    def process(self, biquad, x):
+        n = len(x)
+        key = (biquad.b0, biquad.b1, biquad.b2, biquad.a1, biquad.a2, n)
+        if key != self._key:
+            self._key = key
+            self.g = _allpole_response(biquad.a1, biquad.a2, n)
+            h = biquad.b0 * self.g
+            h[1:] += biquad.b1 * self.g[:-1]
+            h[2:] += biquad.b2 * self.g[:-2]
+            self.h = h
+        b1, b2, a1, a2 = biquad.b1, biquad.b2, biquad.a1, biquad.a2
+        y = np.convolve(x, self.h)[:n]
+        f0 = b1*self.x1 + b2*self.x2 - a1*self.y1 - a2*self.y2
+        f1 = b2*self.x1 - a2*self.y1
+        y += f0 * self.g
+        y[1:] += f1 * self.g[:-1]
+        self.x1, self.x2 = x[-1], (x[-2] if n > 1 else self.x1)
+        self.y1, self.y2 = y[-1], (y[-2] if n > 1 else self.y1)
+        return y
+
+
+class NoteState:
+    """Per-synthio.Note rendering state"""
+    def __init__(self):
+        self.phase = 0.0
+        self.filter = BlockFilter()
+        self.last_level = 0.0
+
+def _value(x):
+    return x.value if hasattr(x, 'value') else x
+
+class SynthRenderer:
+    """Synthesizes what the stand-in synthio.Synthesizer is playing, one block at a time"""
+    def __init__(self, synth):
+        self.synth = synth
+        self.notes = {}
+        self.default_waveform = np.concatenate((np.full(256, 32767), np.full(256, -32767)))
+
+    def render(self, nframes):
+        synth = self.synth
+        sr = synth.sample_rate
+        now = time.monotonic()
+        synth._reap(now)
+        out = np.zeros(nframes)
+        for note in tuple(synth._notes):
+            ns = self.notes.get(note) or self.notes.setdefault(note, NoteState())
+            state, level = synth.note_info(note)
+            if state is None:
+                continue
+            level *= _value(note.amplitude)
+            waveform = note.waveform if note.waveform is not None else synth.waveform
+            waveform = np.asarray(waveform if waveform is not None else self.default_waveform)
+            wlen = len(waveform)
+            freq = note.frequency * 2 ** _value(note.bend)
+            step = freq * wlen / sr
+            phases = ns.phase + step * np.arange(nframes)
+            ns.phase = (ns.phase + step * nframes) % wlen
+            x = waveform[phases.astype(np.int64) % wlen].astype(np.float64)
+            x *= np.linspace(ns.last_level, level, nframes, endpoint=False)
+            ns.last_level = level
+            filt = note.filter
+            if isinstance(filt, synthio.BlockBiquad):  # swept by its blocks
+                filt = filt.biquad(sr)
+            if filt is not None:
+                x = ns.filter.process(filt, x)
+            out += x
+        for note in tuple(self.notes):   # forget notes synthio is done with
+            if note not in synth._notes:
+                del self.notes[note]
+        return out
+
+
+def render(patch, events, sample_rate=28000, volume=0.75, tail=None, instrument_class=WavePolyTwoOsc):
+    """
+    Render a list of (start_secs, midi_note, duration_secs) events played on 'patch'.
+    Returns (int16 samples, stats dict). stats['speed'] is how many times faster
+    than realtime the render ran.
+    """
+    events = sorted(events)
+    if tail is None:
+        tail = patch.amp_env_params.release_time + 0.1
+    length = max((e[0] + e[2] for e in events), default=0) + tail
+    offs = sorted((e[0] + e[2], e[1]) for e in events)
+    ons = [(e[0], e[1]) for e in events]
+    block = int(sample_rate * control_rate)
+    nblocks = int(math.ceil(length * sample_rate / block))
+    out = np.zeros(nblocks * block)
+
+    st = time.perf_counter()
+    with virtual_time(VirtualClock()) as clock, contextlib.redirect_stdout(open(os.devnull, 'w')):
+        synth = synthio.Synthesizer(sample_rate=sample_rate)
+        inst = instrument_class(synth, patch)
+        renderer = SynthRenderer(synth)
+        for b in range(nblocks):
+            clock.t = b * block / sample_rate
+            while offs and offs[0][0] <= clock.t:
+                inst.note_off(offs.pop(0)[1])
+            while ons and ons[0][0] <= clock.t:
+                inst.note_on(ons.pop(0)[1])
+            inst.update()
+            for i in range(0, block, synthio_block):  # blocks are evaluated every synthio_block samples
+                clock.t = (b * block + i) / sample_rate
+                n = min(synthio_block, block - i)
+                out[b*block+i : b*block+i+n] = renderer.render(n)
+    elapsed = time.perf_counter() - st
+
+    samples = np.clip(out * volume, -32768, 32767).astype(np.int16)
+    stats = {'seconds': len(samples) / sample_rate, 'render_secs': elapsed,
+             'speed': (len(samples) / sample_rate) / elapsed if elapsed else 0}
+    return samples, stats
+
+def write_wav(filename, samples, sample_rate):
+    with wave.open(filename, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(samples.tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a WavePolyTwoOsc patch to a WAV file")
+    parser.add_argument('wave_select', help="patch wave, like 'wtb:PLAITS02' or 'osc:SAW/SIN'")
+    parser.add_argument('--notes', default='36,40,43,48', help="comma-separated MIDI notes, played in turn")
+    parser.add_argument('--chord', action='store_true', help="play the notes at once")
+    parser.add_argument('--length', type=float, default=0.75, help="seconds each note is held")
+    parser.add_argument('--detune', type=float, default=1.01)
+    parser.add_argument('--unison', type=int, default=2, help="oscs per note, spread over the detune")
+    parser.add_argument('--wave-mix', type=float, default=0.0)
+    parser.add_argument('--filt', default='LP', choices=('LP','HP','BP'))
+    parser.add_argument('--filt-f', type=float, default=3000)
+    parser.add_argument('--filt-q', type=float, default=1.2)
+    parser.add_argument('--sample-rate', type=int, default=28000)
+    parser.add_argument('--root', default=os.path.join(cp_dir, 'picotouch_synth'),
+                        help="directory standing in for CIRCUITPY, holds /wav")
+    parser.add_argument('--out', default='render.wav')
+    args = parser.parse_args()
+
+    simhw.install_fs(args.root)
+    patch = Patch('render')
+    patch.set_by_wave_select(args.wave_select)
+    patch.detune = args.detune
+    patch.unison = args.unison
+    patch.wave_mix = args.wave_mix
+    patch.filt_type = getattr(FiltType, args.filt)
+    patch.filt_f = args.filt_f
+    patch.filt_q = args.filt_q
+
+    notes = [int(n) for n in args.notes.split(',')]
+    if args.chord:
+        events = [(0, n, args.length) for n in notes]
+    else:
+        events = [(i * args.length, n, args.length) for i, n in enumerate(notes)]
+
+    samples, stats = render(patch, events, sample_rate=args.sample_rate)
+    write_wav(args.out, samples, args.sample_rate)
+    print("%s: %.2f s of audio in %.3f s, %.1fx realtime" %
+          (args.out, stats['seconds'], stats['render_secs'], stats['speed']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+# run_sim.py -- run a picotouch_synth app headless on the host, with timing report
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Usage (from the circuitpython directory):
+#   python3 sim/run_sim.py picotouch_synth --seconds 10
+#   python3 sim/run_sim.py pts_drum_machine --seconds 10 --touch-cost 0.0004 --realtime
+#
+# Needs CPython with numpy, adafruit-circuitpython-midi, -fancyled and -wave installed.
+# The stand-in modules next to this file shadow the CircuitPython core modules,
+# the app's own directory and then ../lib are searched like on CIRCUITPY.
+#
+import os, sys, time, random, argparse, runpy, contextlib
+import asyncio
+
+sim_dir = os.path.dirname(os.path.abspath(__file__))
+cp_dir = os.path.dirname(sim_dir)
+sys.path.insert(0, sim_dir)
+import simhw
+
+class LoopStats:
+    """Per-task time from waking up to the next await asyncio.sleep()"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, dt):
+        self.count += 1
+        self.total += dt
+        self.max = max(self.max, dt)
+
+    def __str__(self):
+        avg = self.total / self.count if self.count else 0
+        return "%8d loops  avg %7.3f ms  max %7.3f ms" % (self.count, avg*1000, self.max*1000)
+
+task_stats = {}
+_resumed = {}
+_real_sleep = asyncio.sleep
+_real_run = asyncio.run
+realtime = False
+
+async def timed_sleep(delay, result=None):
+    now = time.perf_counter()
+    task = asyncio.current_task()
+    start = _resumed.get(task)
+    if start is not None:
+        name = task.get_coro().__name__
+        stats = task_stats.get(name) or task_stats.setdefault(name, LoopStats())
+        stats.add(now - start)
+        simhw.charge_audio(now - start)  # synthio rendered in the background while this task ran
+    await _real_sleep(delay if realtime else 0, result)
+    _resumed[task] = time.perf_counter()
+
+async def touch_player(hwmod, rate, hold_time):
+    """Randomly press and release note pads, and now and then a mode pad"""
+    note_pads = hwmod.bot_pads + hwmod.top_pads
+    while True:
+        pad = random.choice(note_pads) if random.random() < 0.95 else random.choice(hwmod.mode_pads[:3])
+        pin = hwmod.touch_pins[pad]
+        simhw.press_pin(pin, random.uniform(0.3, 1.0))
+        await _real_sleep(random.uniform(0.5, 1.5) * hold_time)
+        simhw.release_pin(pin)
+        await _real_sleep(random.uniform(0.5, 1.5) / rate)
+
+async def midi_player(rate):
+    """Inject random note on/off pairs into the USB and UART MIDI inputs"""
+    while True:
+        port = random.choice((simhw.usb_midi_in,) + tuple(simhw.uarts))
+        note = random.randint(36, 84)
+        port.inject(bytes((0x90, note, random.randint(1, 127))))
+        await _real_sleep(random.uniform(0.1, 0.5))
+        port.inject(bytes((0x80, note, 0)))
+        await _real_sleep(random.uniform(0.5, 1.5) / rate)
+
+async def midi_clock_player(bpm):
+    """Send MIDI start, then MIDI clock at 'bpm' into the USB MIDI input"""
+    tick = 60 / (bpm * 24)
+    simhw.usb_midi_in.inject(bytes((0xFA,)))
+    next_t = time.perf_counter()
+    while True:
+        simhw.usb_midi_in.inject(bytes((0xF8,)))
+        next_t += tick
+        await _real_sleep(max(0, next_t - time.perf_counter()))
+
+def report(app_globals, elapsed, out):
+    print("\n---------- sim report: %.2f s ----------" % elapsed, file=out)
+    for name, stats in sorted(task_stats.items()):
+        print("%-20s %s" % (name, stats), file=out)
+    hw = app_globals.get('hw')
+    if hw:
+        strip = getattr(hw, 'strip', hw.leds)
+        print("leds.show() calls: %d  strip writes: %d  (%.1f ms)" %
+              (hw.leds.show_count, strip.show_count, strip.show_time*1000), file=out)
+        if hasattr(hw, 'scan_stats'):
+            print("check_touch: %d scans  max %.3f ms  avg %.3f ms  jitter %.3f ms" %
+                  hw.scan_stats(), file=out)
+        print("synth notes pressed: %d  dropped: %d  blocks: %d" %
+              (hw.synth.press_count, hw.synth.dropped_count, len(hw.synth.blocks)), file=out)
+        if simhw.synth_note_cost:
+            print("audio  max load: %.2f  underrun: %.1f ms" %
+                  (simhw.audio_max_load, simhw.audio_underrun_time * 1000), file=out)
+    inst = app_globals.get('inst')
+    if getattr(inst, 'governor', None):
+        print(inst.governor.report(), file=out)
+        print("          unison cuts:%d  voice cuts:%d  steals:%d" %
+              (inst.unison_cuts, inst.voice_cuts, inst.steal_count), file=out)
+    samples = getattr(app_globals.get('dm'), 'samples', None)
+    if samples:
+        print("sample cache: %d samples  %d bytes  hit rate %.2f  evictions %d" % samples.stats(), file=out)
+    seq = app_globals.get('seq')
+    if seq:
+        print(seq.jitter_report(), file=out)
+    if 'loop_profiler' in sys.modules:
+        print("loop_profiler:", file=out)
+        with contextlib.redirect_stdout(out):
+            sys.modules['loop_profiler'].print_summary()
+    print("midi bytes out: usb %d  uart %s  uart write() blocked: %s ms" %
+          (simhw.usb_midi_out.tx_count, [u.tx_count for u in simhw.uarts],
+           ["%.1f" % (u.write_wait*1000) for u in simhw.uarts]), file=out)
+    for midi_out in app_globals.get('midi_outs', ()):
+        print("midi out %-12s depth: %d  max depth: %d  msgs: %d  dropped: %d" %
+              ((midi_out.port.name,) + midi_out.stats()), file=out)
+
+def main():
+    global realtime
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('app', help="app directory, e.g. 'picotouch_synth'")
+    parser.add_argument('--seconds', type=float, default=5, help="how long to run")
+    parser.add_argument('--realtime', action='store_true', help="honor asyncio.sleep() delays")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--touch-rate', type=float, default=4, help="pad presses per second")
+    parser.add_argument('--touch-hold', type=float, default=0.3, help="seconds each pad is held")
+    parser.add_argument('--touch-cost', type=float, default=0, help="seconds per TouchIn read")
+    parser.add_argument('--flash-cost', type=float, default=0, help="seconds per open() of a file")
+    parser.add_argument('--synth-cost', type=float, default=0, help="share of the CPU each sounding synth note takes")
+    parser.add_argument('--midi-rate', type=float, default=2, help="MIDI notes in per second")
+    parser.add_argument('--midi-clock', type=float, default=0, help="send MIDI start & clock at this BPM")
+    parser.add_argument('--exec', default=None, help="python statement to run in the app at start, e.g. 'seq.start()'")
+    parser.add_argument('--verbose', action='store_true', help="show the app's print()s")
+    args = parser.parse_args()
+
+    realtime = args.realtime
+    random.seed(args.seed)
+    app_dir = os.path.join(cp_dir, args.app)
+    sys.path[:0] = [sim_dir, app_dir, os.path.join(cp_dir, 'lib')]
+    os.chdir(app_dir)
+
+    simhw.touch_read_cost = args.touch_cost
+    simhw.synth_note_cost = args.synth_cost
+    simhw.flash_open_cost = args.flash_cost
+    simhw.install_fs(app_dir)
+
+    out = sys.stdout
+    quiet = open(os.devnull, 'w') if not args.verbose else sys.stdout
+
+    def sim_run(coro):
+        app_globals = sys._getframe(1).f_globals
+        hwmod = sys.modules['picotouch_synth']
+        async def runner():
+            players = [asyncio.create_task(touch_player(hwmod, args.touch_rate, args.touch_hold))]
+            if args.midi_rate:
+                players.append(asyncio.create_task(midi_player(args.midi_rate)))
+            if args.midi_clock:
+                players.append(asyncio.create_task(midi_clock_player(args.midi_clock)))
+            if args.exec:
+                exec(args.exec, app_globals)
+            try:
+                await asyncio.wait_for(coro, args.seconds)
+            except asyncio.TimeoutError:
+                pass
+            for p in players:
+                p.cancel()
+        st = time.perf_counter()
+        _real_run(runner())
+        report(app_globals, time.perf_counter() - st, out)
+
+    asyncio.sleep = timed_sleep
+    asyncio.run = sim_run
+    with contextlib.redirect_stdout(quiet):
+        runpy.run_path(os.path.join(app_dir, 'code.py'), run_name='__main__')
+
+if __name__ == '__main__':
+    main()
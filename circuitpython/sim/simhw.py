@@ -0,0 +1,144 @@
+# simhw.py -- shared state for the host-side hardware stand-ins
+# Part of https://github.com/todbot/picotouch_synth
+#
+# The stand-in modules in this directory (board, touchio, neopixel, busio,
+# usb_midi, synthio, ...) all talk to this module, so a test script or
+# run_sim.py can "touch" pads, inject MIDI and look at what was sent out.
+#
+import os, time, random
+import builtins
+
+touch_baseline = 1800     # raw_value of an untouched pad
+touch_span = 1200         # extra raw_value of a firmly touched pad
+touch_noise = 20          # +/- random jitter on raw_value
+touch_read_cost = 0       # seconds of busy-wait per TouchIn read, ~0.0004 on a real Pico
+flash_open_cost = 0       # seconds of busy-wait per open(), a few ms on a real CIRCUITPY
+uart_write_blocks = True  # UART.write() waits for its bytes to fit in the TX FIFO, like on a Pico
+uart_fifo_size = 32       # RP2040 UART TX FIFO
+synth_note_cost = 0       # share of the CPU each sounding synthio note takes to render, 0 = free
+
+_touch_pressures = {}     # key = pin number, val = 0-1 pressure
+
+synths = []               # stand-in Synthesizers made, for charge_audio()
+audio_max_load = 0        # most CPU the synth notes wanted at once
+audio_underrun_time = 0   # seconds the notes wanted more CPU than there is, the audio glitched
+
+def charge_audio(busy):
+    """Busy-wait for the CPU synthio's background rendering would have taken from
+    Python while it ran for 'busy' seconds: with the notes sounding taking 'load'
+    of the CPU, that's busy * load / (1 - load). (Time Python spends asleep is
+    free for audio.)"""
+    global audio_max_load, audio_underrun_time
+    if not synth_note_cost:
+        return
+    load = sum(s.sounding_count() for s in synths) * synth_note_cost
+    audio_max_load = max(audio_max_load, load)
+    if load >= 1:
+        audio_underrun_time += busy
+        load = 0.95
+    t = time.perf_counter() + busy * load / (1 - load)
+    while time.perf_counter() < t:
+        pass
+
+def press_pin(pin, pressure=1.0):
+    _touch_pressures[pin.num] = pressure
+
+def release_pin(pin):
+    _touch_pressures[pin.num] = 0
+
+def touch_raw_value(pin):
+    if touch_read_cost:
+        t = time.perf_counter() + touch_read_cost
+        while time.perf_counter() < t:
+            pass
+    pressure = _touch_pressures.get(pin.num, 0)
+    return int(touch_baseline + pressure * touch_span + random.randint(-touch_noise, touch_noise))
+
+
+class MidiPort:
+    """A byte pipe that looks like a usb_midi.PortIn/PortOut or busio.UART"""
+    def __init__(self, name, max_tx=4096):
+        self.name = name
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.max_tx = max_tx   # only keep the tail of what was written
+        self.tx_count = 0
+
+    def inject(self, data):
+        """Queue up bytes to be read by the code under test"""
+        self.rx.extend(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
+
+    def read(self, nbytes=None):
+        if not self.rx:
+            return None
+        nbytes = len(self.rx) if nbytes is None else nbytes
+        data = bytes(self.rx[:nbytes])
+        del self.rx[:nbytes]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        nbytes = min(len(buf) if nbytes is None else nbytes, len(self.rx))
+        buf[:nbytes] = self.rx[:nbytes]
+        del self.rx[:nbytes]
+        return nbytes or None
+
+    def write(self, buf, nbytes=None):
+        nbytes = len(buf) if nbytes is None else nbytes
+        self.tx.extend(buf[:nbytes])
+        self.tx_count += nbytes
+        if len(self.tx) > self.max_tx:
+            del self.tx[:len(self.tx) - self.max_tx]
+        return nbytes
+
+    def reset_input_buffer(self):
+        self.rx = bytearray()
+
+    def deinit(self):
+        pass
+
+usb_midi_in = MidiPort("usb_midi_in")
+usb_midi_out = MidiPort("usb_midi_out")
+uarts = []   # every busio.UART made, in order
+
+
+# CIRCUITPY filesystem emulation: code on the device uses absolute paths
+# like "/wav/PLAITS02.WAV", map those into a host directory
+fs_root = None
+_real_open = builtins.open
+_real_listdir = os.listdir
+_real_stat = os.stat
+_real_remove = os.remove
+_real_rename = os.rename
+_real_mkdir = os.mkdir
+
+def fs_path(path):
+    """Map a CIRCUITPY absolute path to a host path, if it needs mapping"""
+    if fs_root and isinstance(path, str) and path.startswith('/') and not path.startswith(fs_root):
+        top = '/' + path.split('/')[1]
+        try:
+            _real_stat(top)
+        except OSError:
+            return fs_root + path
+    return path
+
+def _fs_open(path, *args, **kw):
+    if flash_open_cost:
+        t = time.perf_counter() + flash_open_cost
+        while time.perf_counter() < t:
+            pass
+    return _real_open(fs_path(path), *args, **kw)
+
+def install_fs(root):
+    """Make absolute CIRCUITPY paths resolve inside directory 'root'"""
+    global fs_root
+    fs_root = os.path.abspath(root)
+    builtins.open = _fs_open
+    os.listdir = lambda path='.': _real_listdir(fs_path(path))
+    os.stat = lambda path, *args, **kw: _real_stat(fs_path(path), *args, **kw)
+    os.remove = lambda path: _real_remove(fs_path(path))
+    os.rename = lambda a, b: _real_rename(fs_path(a), fs_path(b))
+    os.mkdir = lambda path, *args: _real_mkdir(fs_path(path), *args)
@@ -0,0 +1,302 @@
+# synthio.py -- host stand-in for CircuitPython 'synthio'
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Models the control side of synthio (notes, envelopes, LFO & Math blocks,
+# filter coefficients, BlockBiquads) against time.monotonic(), but makes no sound.
+# Block values are computed when read, instead of on every audio buffer.
+#
+import math, time
+import simhw
+
+max_polyphony = 12   # CIRCUITPY_SYNTHIO_MAX_CHANNELS
+
+def midi_to_hz(midi_note):
+    return 440.0 * 2 ** ((midi_note - 69) / 12)
+
+def voct_to_hz(ctrl):
+    return midi_to_hz(60 + ctrl * 12)
+
+def _value(x):
+    """Resolve a BlockInput (a number or a block) to a number"""
+    return x.value if hasattr(x, 'value') else x
+
+
+class Envelope:
+    def __init__(self, *, attack_time=0.1, decay_time=0.05, release_time=0.2,
+                 attack_level=1.0, sustain_level=0.8):
+        self.attack_time = attack_time
+        self.decay_time = decay_time
+        self.release_time = release_time
+        self.attack_level = attack_level
+        self.sustain_level = sustain_level
+
+    def __repr__(self):
+        return "Envelope(attack_time=%s, decay_time=%s, release_time=%s, attack_level=%s, sustain_level=%s)" % (
+            self.attack_time, self.decay_time, self.release_time, self.attack_level, self.sustain_level)
+
+_default_envelope = Envelope()
+
+class EnvelopeState:
+    ATTACK = 1
+    DECAY = 2
+    SUSTAIN = 3
+    RELEASE = 4
+
+
+class LFO:
+    def __init__(self, waveform=None, *, rate=1, scale=1, offset=0, phase_offset=0,
+                 once=False, interpolate=True):
+        self.waveform = waveform
+        self.rate = rate
+        self.scale = scale
+        self.offset = offset
+        self.phase_offset = phase_offset
+        self.once = once
+        self.interpolate = interpolate
+        self.retrigger()
+
+    def retrigger(self):
+        self._phase = 0
+        self._last_t = time.monotonic()
+
+    @property
+    def phase(self):
+        now = time.monotonic()
+        self._phase += (now - self._last_t) * _value(self.rate)
+        self._last_t = now
+        if self.once:
+            self._phase = min(self._phase, 1)
+        return self._phase
+
+    @property
+    def value(self):
+        waveform = self.waveform if self.waveform is not None else (0, 32767, 0, -32767)
+        n = len(waveform)
+        p = self.phase + _value(self.phase_offset)
+        p = min(p, 1) if self.once else p % 1
+        i = p * n
+        j = int(i)
+        if j >= n:   # 'once' LFOs hold their last sample
+            w = waveform[n-1]
+        elif self.interpolate:
+            w = waveform[j] + (i - j) * (int(waveform[(j+1) % n]) - waveform[j])
+        else:
+            w = waveform[j]
+        return _value(self.offset) + _value(self.scale) * (w / 32768)
+
+
+class MathOperation:
+    SUM = 0
+    ADD_SUB = 1
+    PRODUCT = 2
+    MUL_DIV = 3
+    SCALE_OFFSET = 4
+    OFFSET_SCALE = 5
+    LERP = 6
+    CONSTRAINED_LERP = 7
+    DIV_ADD = 8
+    ADD_DIV = 9
+    MID = 10
+    MAX = 11
+    MIN = 12
+    ABS = 13
+
+_math_ops = (
+    lambda a,b,c: a + b + c,
+    lambda a,b,c: a + b - c,
+    lambda a,b,c: a * b * c,
+    lambda a,b,c: a * b / c if c else 0,
+    lambda a,b,c: a * b + c,
+    lambda a,b,c: (a + b) * c,
+    lambda a,b,c: a * (1 - c) + b * c,
+    lambda a,b,c: a * (1 - min(max(c,0),1)) + b * min(max(c,0),1),
+    lambda a,b,c: a / b + c if b else c,
+    lambda a,b,c: (a + b) / c if c else 0,
+    lambda a,b,c: sorted((a,b,c))[1],
+    lambda a,b,c: max(a,b,c),
+    lambda a,b,c: min(a,b,c),
+    lambda a,b,c: abs(a),
+)
+
+class Math:
+    def __init__(self, operation, a, b=0.0, c=1.0):
+        self.operation = operation
+        self.a = a
+        self.b = b
+        self.c = c
+
+    @property
+    def value(self):
+        return _math_ops[self.operation](_value(self.a), _value(self.b), _value(self.c))
+
+
+class Biquad:
+    """Filter coefficients, as returned by Synthesizer.low_pass_filter() and friends"""
+    def __init__(self, b0, b1, b2, a1, a2):
+        self.b0, self.b1, self.b2, self.a1, self.a2 = b0, b1, b2, a1, a2
+
+    def __repr__(self):
+        return "Biquad(b0=%.4f, b1=%.4f, b2=%.4f, a1=%.4f, a2=%.4f)" % (
+            self.b0, self.b1, self.b2, self.a1, self.a2)
+
+def _biquad(kind, frequency, Q, sample_rate):
+    # RBJ audio EQ cookbook, same as shared-module/synthio/Biquad.c
+    w0 = 2 * math.pi * min(frequency, sample_rate * 0.45) / sample_rate
+    s, c = math.sin(w0), math.cos(w0)
+    alpha = s / (2 * Q)
+    if kind == 'lp':
+        b0, b1, b2 = (1-c)/2, 1-c, (1-c)/2
+    elif kind == 'hp':
+        b0, b1, b2 = (1+c)/2, -(1+c), (1+c)/2
+    elif kind == 'notch':
+        b0, b1, b2 = 1, -2*c, 1
+    else:
+        b0, b1, b2 = alpha, 0, -alpha
+    a0 = 1 + alpha
+    return Biquad(b0/a0, b1/a0, b2/a0, (-2*c)/a0, (1-alpha)/a0)
+
+
+class FilterMode:
+    LOW_PASS = 0
+    HIGH_PASS = 1
+    BAND_PASS = 2
+    NOTCH = 3
+
+_filter_kinds = ('lp', 'hp', 'bp', 'notch')
+
+class BlockBiquad:
+    """Biquad whose frequency & Q are BlockInputs, so synthio can sweep it.
+    Coefficients are worked out from the inputs' current values by biquad()"""
+    def __init__(self, mode, frequency, Q=0.7071067811865475):
+        self.mode = mode
+        self.frequency = frequency
+        self.Q = Q
+
+    def biquad(self, sample_rate):
+        return _biquad(_filter_kinds[self.mode], _value(self.frequency), _value(self.Q), sample_rate)
+
+
+class Note:
+    def __init__(self, frequency, *, panning=0, waveform=None, waveform_loop_start=0,
+                 waveform_loop_end=None, envelope=None, amplitude=1.0, bend=0.0,
+                 filter=None, ring_frequency=0.0, ring_bend=0.0, ring_waveform=None):
+        self.frequency = frequency
+        self.panning = panning
+        self.waveform = waveform
+        self.waveform_loop_start = waveform_loop_start
+        self.waveform_loop_end = waveform_loop_end
+        self.envelope = envelope
+        self.amplitude = amplitude
+        self.bend = bend
+        self.filter = filter
+        self.ring_frequency = ring_frequency
+        self.ring_bend = ring_bend
+        self.ring_waveform = ring_waveform
+
+    def __repr__(self):
+        return "Note(frequency=%.2f)" % self.frequency
+
+
+def _env_value(env, pressed_t, released_t, now):
+    """(state, level) of an envelope pressed at pressed_t and maybe released at released_t"""
+    t = (released_t if released_t is not None else now) - pressed_t
+    if t < env.attack_time:
+        state, level = EnvelopeState.ATTACK, env.attack_level * t / env.attack_time
+    elif t < env.attack_time + env.decay_time:
+        frac = (t - env.attack_time) / env.decay_time
+        state, level = EnvelopeState.DECAY, env.attack_level + frac * (env.sustain_level - env.attack_level)
+    else:
+        state, level = EnvelopeState.SUSTAIN, env.sustain_level
+    if released_t is not None:
+        rt = now - released_t
+        if rt >= env.release_time:
+            return None, 0.0
+        state, level = EnvelopeState.RELEASE, level * (1 - rt / env.release_time)
+    return state, level
+
+
+class Synthesizer:
+    def __init__(self, *, sample_rate=11025, channel_count=1, waveform=None, envelope=None):
+        self.sample_rate = sample_rate
+        self.channel_count = channel_count
+        self.waveform = waveform
+        self.envelope = envelope
+        self.blocks = []
+        self._notes = {}   # key = Note, val = [pressed_time, released_time or None]
+        self.press_count = 0
+        self.dropped_count = 0
+        simhw.synths.append(self)
+
+    def sounding_count(self):
+        """Notes being rendered, including ones in their release"""
+        self._reap(time.monotonic())
+        return len(self._notes)
+
+    def _reap(self, now):
+        for note, (pt, rt) in list(self._notes.items()):
+            if rt is not None and _env_value(self._envelope(note), pt, rt, now)[0] is None:
+                del self._notes[note]
+
+    def _envelope(self, note):
+        return note.envelope or self.envelope or _default_envelope
+
+    def _as_notes(self, notes):
+        if isinstance(notes, (int, float, Note)):
+            return (notes,)
+        return notes
+
+    def press(self, press=()):
+        now = time.monotonic()
+        self._reap(now)
+        for note in self._as_notes(press):
+            if note not in self._notes and len(self._notes) >= max_polyphony:
+                self.dropped_count += 1
+                continue
+            self._notes[note] = [now, None]
+            self.press_count += 1
+
+    def release(self, release=()):
+        now = time.monotonic()
+        for note in self._as_notes(release):
+            times = self._notes.get(note)
+            if times and times[1] is None:
+                times[1] = now
+
+    def release_all(self):
+        self.release(tuple(self._notes.keys()))
+
+    def release_then_press(self, release=(), press=()):
+        self.release(release)
+        self.press(press)
+
+    def release_all_then_press(self, press=()):
+        self.release_all()
+        self.press(press)
+
+    def change(self, release=(), press=(), retrigger=()):
+        self.release(release)
+        self.press(press)
+        for block in retrigger:
+            block.retrigger()
+
+    @property
+    def pressed(self):
+        return tuple(n for n, (pt, rt) in self._notes.items() if rt is None)
+
+    def note_info(self, note):
+        times = self._notes.get(note)
+        if not times:
+            return (None, 0.0)
+        return _env_value(self._envelope(note), times[0], times[1], time.monotonic())
+
+    def low_pass_filter(self, frequency, Q=0.7071067811865475):
+        return _biquad('lp', frequency, Q, self.sample_rate)
+
+    def high_pass_filter(self, frequency, Q=0.7071067811865475):
+        return _biquad('hp', frequency, Q, self.sample_rate)
+
+    def band_pass_filter(self, frequency, Q=0.7071067811865475):
+        return _biquad('bp', frequency, Q, self.sample_rate)
+
+    def deinit(self):
+        pass
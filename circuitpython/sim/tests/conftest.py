@@ -0,0 +1,14 @@
+# conftest.py -- host tests of the CircuitPython libraries, against the sim stand-ins
+# Part of https://github.com/todbot/picotouch_synth
+#
+# Run from the circuitpython directory:
+#   python3 -m pytest sim/tests
+#
+import os, sys
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sim_dir = os.path.dirname(tests_dir)
+cp_dir = os.path.dirname(sim_dir)
+for _p in (os.path.join(cp_dir, 'lib'), sim_dir):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
@@ -0,0 +1,25 @@
+# test_instrument.py -- WavePolyTwoOsc voice allocation under a tight note budget
+# Part of https://github.com/todbot/picotouch_synth
+
+import synthio
+from synthio_instrument import WavePolyTwoOsc, Patch
+
+def test_retrigger_with_no_room_keeps_its_voice():
+    synth = synthio.Synthesizer(sample_rate=28000)
+    patch = Patch('sawT')
+    patch.amp_env_params.release_time = 10  # releases outlast the test
+    inst = WavePolyTwoOsc(synth, patch)
+    inst.note_on(60)
+    held = inst.voices[60]
+    for note in range(40, 45):  # the rest of the pool is releasing
+        inst.note_on(note)
+        inst.note_off(note)
+    assert len(inst.releasing) == 5
+    inst.max_notes = 4  # as if the governor lowered it
+
+    inst.note_on(60)  # same note again, no room left
+    assert inst.voices[60] is held
+    inst.note_off(60)
+    assert not synth.pressed  # nothing left stuck on
+    for voice in inst.voice_pool:
+        assert voice.midi_note is None
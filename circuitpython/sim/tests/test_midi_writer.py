@@ -0,0 +1,61 @@
+# test_midi_writer.py -- MidiWriter encoding and partial flushes
+# Part of https://github.com/todbot/picotouch_synth
+
+from midi_writer import MidiWriter
+
+class Port:
+    """Takes at most 'max_write' bytes per write(), like a full UART"""
+    def __init__(self, max_write=1000):
+        self.max_write = max_write
+        self.out = bytearray()
+
+    def write(self, buf):
+        n = min(len(buf), self.max_write)
+        self.out.extend(buf[:n])
+        return n
+
+def test_usb_always_sends_status():
+    port = Port()
+    midi_out = MidiWriter(port)
+    midi_out.note_on(60, 100)
+    midi_out.note_on(64, 100)
+    midi_out.flush()
+    assert port.out == bytes((0x90, 60, 100, 0x90, 64, 100))
+
+def test_uart_running_status():
+    port = Port()
+    midi_out = MidiWriter(port, baud_rate=31250, fifo_size=1000)
+    midi_out.note_on(60, 100)
+    midi_out.note_on(64, 100)
+    midi_out.note_off(60)
+    midi_out.flush()
+    assert port.out == bytes((0x90, 60, 100, 64, 100, 0x80, 60, 0))
+
+def test_partial_flushes_keep_order():
+    port = Port(max_write=5)
+    midi_out = MidiWriter(port, buf_size=16)
+    expected = bytearray()
+    for note in range(40, 60):
+        if midi_out.note_on(note, 100):
+            expected.extend((0x90, note, 100))
+        midi_out.flush()
+    while midi_out.flush():
+        pass
+    assert port.out == expected
+    assert midi_out.stats()[0] == 0
+
+def test_note_offs_survive_a_full_queue():
+    port = Port(max_write=0)  # nothing goes out until the end
+    midi_out = MidiWriter(port, buf_size=32, baud_rate=31250, note_off_reserve=9)
+    midi_out.note_on(60, 100)
+    midi_out.note_on(64, 100)
+    while midi_out.poly_pressure(60, 90):  # aftertouch fills the queue
+        pass
+    assert not midi_out.note_on(67, 100)
+    assert midi_out.note_off(60)
+    assert midi_out.note_off(64)
+    port.max_write = 1000
+    midi_out.fifo_size = 1000
+    midi_out.flush()
+    assert port.out.endswith(bytes((0x80, 60, 0, 64, 0)))
+    assert midi_out.stats()[3] == 2  # the poly pressure that didn't fit & the note-on
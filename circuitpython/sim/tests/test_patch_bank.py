@@ -0,0 +1,62 @@
+# test_patch_bank.py -- PatchBank save, load and read-only banks
+# Part of https://github.com/todbot/picotouch_synth
+
+import builtins
+from synthio_instrument import Patch, PatchBank, WaveType
+
+def make_patch():
+    patch = Patch('sawT')
+    patch.wave_type = WaveType.OSC
+    patch.wave = 'SAW'
+    patch.unison = 3
+    patch.amp_env_params.attack_time = 0.2
+    return patch
+
+def test_save_load(tmp_path):
+    bank = PatchBank(str(tmp_path / 'patches.bin'))
+    assert bank.writable
+    assert bank.load(0) is None
+    bank.save(0, make_patch())
+    patch = bank.load(0)
+    assert patch.name == 'sawT'
+    assert patch.unison == 3
+    bank.close()
+
+def test_read_only_bank(tmp_path, monkeypatch):
+    """A bank on a read-only CIRCUITPY still loads its patches"""
+    filepath = str(tmp_path / 'patches.bin')
+    bank = PatchBank(filepath)
+    bank.save(5, make_patch())
+    bank.close()
+
+    real_open = builtins.open
+    def read_only_open(path, mode='r', *args, **kw):
+        if 'w' in mode or '+' in mode:
+            raise OSError(30, "Read-only filesystem")  # EROFS, like CIRCUITPY to code
+        return real_open(path, mode, *args, **kw)
+    monkeypatch.setattr(builtins, 'open', read_only_open)
+
+    bank = PatchBank(filepath)
+    assert not bank.writable
+    patch = bank.load(5)
+    assert patch.name == 'sawT'
+    assert patch.unison == 3
+    assert bank.load(4) is None
+    bank.close()
+
+def test_bank_round_trip_hits_patch_cache(tmp_path):
+    """A patch loaded from the bank reuses the original's CompiledPatch"""
+    import synthio
+    from synthio_instrument import WavePolyTwoOsc
+    synth = synthio.Synthesizer(sample_rate=28000)
+    patch = make_patch()
+    inst = WavePolyTwoOsc(synth, patch)
+    bank = PatchBank(str(tmp_path / 'patches.bin'))
+    bank.save(0, patch)
+    loaded = bank.load(0)
+    assert loaded.amp_env_params.attack_time != patch.amp_env_params.attack_time  # float32 rounded
+    compiled = inst.compiled
+    inst.load_patch(loaded)
+    assert inst.compiled is compiled
+    assert inst.patch_cache.misses == 1
+    bank.close()
@@ -0,0 +1,47 @@
+# test_sample_cache.py -- SampleCache budget accounting, with loads interleaved
+# Part of https://github.com/todbot/picotouch_synth
+
+import wave
+from sample_cache import SampleCache
+
+def make_wav(path, nframes):
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(11025)
+        w.writeframes(bytes(nframes * 2))
+    return str(path)
+
+def held_bytes(samples):
+    return sum(entry[2] for entry in samples.samples.values())
+
+def test_get_during_chunked_preload(tmp_path):
+    kick = make_wav(tmp_path / 'kick.wav', 4000)
+    snare = make_wav(tmp_path / 'snare.wav', 3000)
+    hat = make_wav(tmp_path / 'hat.wav', 1000)
+    samples = SampleCache(max_bytes=64*1024)
+    preload = samples.preload_steps([kick, snare], chunk_bytes=1024)
+    next(preload)  # paused partway into loading kick
+    assert kick in samples.loading
+
+    assert samples.get(kick) is None  # still loading, streamed instead of loaded twice
+    assert samples.get(hat) is not None  # loads while the preload is paused
+    assert kick in samples.loading  # the preload's reservation is untouched
+    assert samples.used_bytes == held_bytes(samples) + samples.loading[kick]
+
+    for _ in preload:
+        pass
+    assert not samples.loading
+    assert set(samples.samples) == {kick, snare, hat}
+    assert samples.used_bytes == held_bytes(samples) == (4000 + 3000 + 1000) * 2
+
+def test_cancelled_preload_releases_only_its_reservation(tmp_path):
+    kick = make_wav(tmp_path / 'kick.wav', 4000)
+    hat = make_wav(tmp_path / 'hat.wav', 1000)
+    samples = SampleCache(max_bytes=64*1024)
+    preload = samples.preload_steps([kick], chunk_bytes=1024)
+    next(preload)
+    assert samples.get(hat) is not None
+    preload.close()  # e.g. the kit changed again
+    assert not samples.loading
+    assert samples.used_bytes == held_bytes(samples) == 1000 * 2
@@ -0,0 +1,56 @@
+# test_step_sequencer.py -- StepSequencer timing across MIDI stop & continue
+# Part of https://github.com/todbot/picotouch_synth
+
+from step_sequencer import StepSequencer
+
+MS = 1_000_000
+
+def test_stop_wait_continue():
+    hits = []
+    seq = StepSequencer(trigger_func=lambda track, vel: hits.append(seq.next_n), bpm=120)
+    for i in range(16):
+        seq.pattern.set(0, i, 100)
+    t0 = 1000 * MS
+    step = seq.step_ns  # 125 ms at 120 bpm, 4 steps per beat
+    seq.start(t0)
+    for n in range(4):
+        seq.update(t0 + n * step + MS)  # steps 0-3 played on time
+    assert hits == [0, 1, 2, 3]
+
+    seq.midi_realtime(0xFC, t0 + 3 * step + 50 * MS)  # stop partway to step 4
+    seq.update(t0 + 10 * step)
+    assert hits == [0, 1, 2, 3]
+
+    pause = 5000 * MS
+    seq.midi_realtime(0xFB, t0 + 3 * step + 50 * MS + pause)  # continue 5 s later
+    seq.update(t0 + 3 * step + 60 * MS + pause)
+    assert hits == [0, 1, 2, 3]  # step 4 is still 75 ms off, no catch-up burst
+    seq.update(t0 + 4 * step + pause + MS)
+    assert hits == [0, 1, 2, 3, 4]
+    assert seq.missed_count == 0
+
+def test_stop_continue_with_midi_clock():
+    """Clocks that keep coming while stopped don't move the song position"""
+    hits = []
+    seq = StepSequencer(trigger_func=lambda track, vel: hits.append(seq.next_n), bpm=120)
+    for i in range(16):
+        seq.pattern.set(0, i, 100)
+    clock = 500 * MS // 24  # 120 bpm
+    t = 1000 * MS
+
+    def clocks(count):
+        nonlocal t
+        for _ in range(count):
+            t += clock
+            seq.midi_realtime(0xF8, t)
+            seq.update(t + MS)
+
+    seq.midi_realtime(0xFA, t)  # start
+    clocks(30)  # 6 clocks per step: steps 0-4
+    assert hits == [0, 1, 2, 3, 4]
+    seq.midi_realtime(0xFC, t + MS)  # stop
+    clocks(100)  # the master keeps clocking
+    assert hits == [0, 1, 2, 3, 4]
+    seq.midi_realtime(0xFB, t + MS)  # continue
+    clocks(18)
+    assert hits == [0, 1, 2, 3, 4, 5, 6, 7]
@@ -0,0 +1,40 @@
+# test_touch.py -- touch pad baseline tracking and velocity in check_touch()
+# Part of https://github.com/todbot/picotouch_synth
+
+import simhw
+import picotouch_synth
+from picotouch_synth import PicoTouchSynthHardware
+
+pad = picotouch_synth.bot_pads[0]
+pin = picotouch_synth.touch_pins[pad]
+
+def setup_function():
+    simhw.release_pin(pin)
+
+def scan_until_pressed(hw, pressures):
+    """Scan with the pad at each of 'pressures' in turn, returns the press Event or None"""
+    for p in pressures:
+        simhw.press_pin(pin, p)
+        for event in hw.check_touch():
+            if event.key_number == pad and event.pressed:
+                return event
+    return None
+
+def test_baseline_doesnt_drift():
+    hw = PicoTouchSynthHardware()
+    for _ in range(2000):
+        hw.check_touch()
+    assert abs(hw.touch_baselines[pad] - simhw.touch_baseline) <= 8  # noise is +/-20, rounding is symmetric
+
+def test_slow_press_triggers_softly():
+    hw = PicoTouchSynthHardware()
+    threshold = hw.touch_thresholds[pad]
+    ramp = [i / 100 for i in range(101)]  # about 0.7 s of scans to full pressure
+    assert scan_until_pressed(hw, ramp)
+    assert hw.touch_thresholds[pad] - threshold < hw.touch_baseline_bands[pad]  # finger didn't move it far
+    assert hw.touch_velocities[pad] < 60
+
+def test_fast_press_is_loud():
+    hw = PicoTouchSynthHardware()
+    assert scan_until_pressed(hw, [0, 0, 1.0])
+    assert hw.touch_velocities[pad] > 110
@@ -0,0 +1,44 @@
+# test_waves.py -- shared and per-octave band-limited waveforms
+# Part of https://github.com/todbot/picotouch_synth
+
+import numpy
+from synthio_instrument import Waves, Patch, PatchCache, ModRouting
+
+def test_sine_octave_set_is_one_table():
+    waves = Waves.octave_set('SIN', 28000)
+    assert len(waves) == Waves.num_octaves
+    assert all(w is waves[0] for w in waves)
+    assert Waves.shared('SIN') is waves[0]
+
+def test_octaves_with_same_harmonics_share():
+    for waveid in ('SAW', 'SQU', 'TRI'):
+        waves = Waves.octave_set(waveid, 28000)
+        for lower, upper in zip(waves, waves[1:]):
+            assert lower is upper or (lower != upper).any()
+        Waves.release_octave_set(waveid, 28000)
+
+def test_band_limited_matches_summed_sines():
+    x = numpy.linspace(0, 2*numpy.pi, 512, endpoint=False, dtype=numpy.float64)
+    for waveid in ('SAW', 'SQU', 'TRI'):
+        tables = Waves.band_limited(waveid, 512, 30000, [1, 5, 255])
+        for n, table in tables.items():
+            want = numpy.zeros(512)
+            for k in range(1, n + 1, 1 if waveid == 'SAW' else 2):
+                if waveid == 'TRI':
+                    want -= numpy.cos(x * k) / (k * k)
+                else:
+                    want += numpy.sin(x * k) / k
+            want *= 30000 / numpy.max(numpy.abs(want))
+            assert numpy.max(numpy.abs(table - want)) <= 2, (waveid, n)
+
+def test_evicted_patch_frees_its_octave_set():
+    cache = PatchCache(22050, ModRouting(), max_patches=1)  # a rate no other test uses
+    saw, squ = ('SAW', 22050, 512, 30000), ('SQU', 22050, 512, 30000)
+    cache.get(Patch('saw', wave='SAW'), 8)
+    cache.get(Patch('saw2', wave='SAW'), 8)  # same compiled patch
+    assert saw in Waves.octave_sets
+    cache.get(Patch('squ', wave='SQU'), 8)  # evicts the saw
+    assert saw not in Waves.octave_sets
+    assert squ in Waves.octave_sets
+    cache.clear()
+    assert squ not in Waves.octave_sets
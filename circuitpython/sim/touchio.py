@@ -0,0 +1,21 @@
+# touchio.py -- host stand-in for CircuitPython 'touchio'
+# Part of https://github.com/todbot/picotouch_synth
+
+import simhw
+
+class TouchIn:
+    def __init__(self, pin):
+        self.pin = pin
+        # like the real touchio, threshold starts a bit above the untouched value
+        self.threshold = simhw.touch_raw_value(pin) + 100
+
+    @property
+    def raw_value(self):
+        return simhw.touch_raw_value(self.pin)
+
+    @property
+    def value(self):
+        return simhw.touch_raw_value(self.pin) > self.threshold
+
+    def deinit(self):
+        pass
@@ -0,0 +1 @@
+# ulab -- host stand-in for CircuitPython's ulab, backed by real NumPy
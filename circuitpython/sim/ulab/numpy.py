@@ -0,0 +1,7 @@
+# ulab/numpy.py -- host stand-in for ulab.numpy, just real NumPy
+# Part of https://github.com/todbot/picotouch_synth
+
+from numpy import *
+
+# ulab's float is single-precision on CircuitPython
+float = float32
@@ -0,0 +1,6 @@
+# usb_midi.py -- host stand-in for CircuitPython 'usb_midi'
+# Part of https://github.com/todbot/picotouch_synth
+
+import simhw
+
+ports = (simhw.usb_midi_in, simhw.usb_midi_out)